@@ -1,14 +1,24 @@
+import asyncio
 import os
 from typing import Literal
 
 from dotenv import load_dotenv
-from llama_index.core.indices.property_graph import SchemaLLMPathExtractor
+from llama_index.core.indices.property_graph import ImplicitPathExtractor
 from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.graph_stores.neo4j import Neo4jPGStore
-import pandas as pd
-from llama_index.core import Document, PropertyGraphIndex
+from llama_index.core import PropertyGraphIndex
 from llama_index.llms.openai import OpenAI
 
+from ann_index import IVFFlatIndex
+from buffered_graph_store import BufferedGraphStore, Neo4jBulkWriter
+from embedding_cache import PROVIDER_BATCH_LIMIT, CachedEmbedding
+from extraction_cache import CachedExtractor, ExtractionCache
+from graph_retriever import CachedGraphRetriever, CacheInvalidatingStore, NeighbourhoodCache
+from kg_ingestion import IngestionPipeline, RateLimiter, graph_index_sink, kg_extract
+from local_graph_store import LocalPropertyGraphStore
+from news_loader import OffsetCheckpoint, iter_news_documents
+from schema_validation import FastSchemaLLMPathExtractor
+
 load_dotenv()
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
 
@@ -16,26 +26,43 @@ username = os.environ.get('NEO4J_USERNAME')
 password = os.environ.get('NEO4J_PASSWORD')
 url = os.environ.get('NEO4J_URI')
 
-graph_store = Neo4jPGStore(
-    username=username,
-    password=password,
-    url=url,
-)
+# With LOCAL_GRAPH_PATH set the graph is kept in process (see local_graph_store.py) and persisted there,
+# no Neo4j needed
+LOCAL_GRAPH_PATH = os.environ.get('LOCAL_GRAPH_PATH')
+if LOCAL_GRAPH_PATH:
+    if os.path.exists(os.path.join(LOCAL_GRAPH_PATH, "meta.json")):
+        graph_store = LocalPropertyGraphStore.from_persist_dir(LOCAL_GRAPH_PATH)
+    else:
+        # the local counterpart of the my_entity vector index created at the end
+        graph_store = LocalPropertyGraphStore(vector_index=IVFFlatIndex())
+else:
+    graph_store = Neo4jPGStore(
+        username=username,
+        password=password,
+        url=url,
+    )
 
-news = pd.read_csv("https://raw.githubusercontent.com/tomasonjo/blog-datasets/main/news_articles.csv")
+NEWS_CSV = os.environ.get('NEWS_CSV', "https://raw.githubusercontent.com/tomasonjo/blog-datasets/main/news_articles.csv")
 text = """
 The Taj Mahal (/ˌtɑːdʒ məˈhɑːl, ˌtɑːʒ-/; lit. 'Crown of the Palace') is an ivory-white marble mausoleum on the right bank of the river Yamuna in Agra, Uttar Pradesh, India. It was commissioned in 1631 by the fifth Mughal emperor, Shah Jahan (r. 1628–1658) to house the tomb of his beloved wife, Mumtaz Mahal; it also houses the tomb of Shah Jahan himself. The tomb is the centrepiece of a 17-hectare (42-acre) complex, which includes a mosque and a guest house, and is set in formal gardens bounded on three sides by a crenellated wall.
 
 Construction of the mausoleum was completed in 1648, but work continued on other phases of the project for another five years. The first ceremony held at the mausoleum was an observance by Shah Jahan, on 6 February 1643, of the 12th anniversary of the death of Mumtaz Mahal. The Taj Mahal complex is believed to have been completed in its entirety in 1653 at a cost estimated at the time to be around ₹5 million, which in 2023 would be approximately ₹35 billion (US$77.8 million).
 
 """
-documents = [Document(text=f"{row['title']}: {row['text']}") for i, row in news.iterrows()]
+# The articles are streamed from NEWS_CSV (a path or URL) in chunks, only the ones ingested in this run are parsed
+# into Documents, starting from the first article a previous run did not finish (see news_loader.py)
+checkpoint = OffsetCheckpoint(os.environ.get('INGEST_CHECKPOINT_PATH', 'ingest_checkpoint.json'))
 # documents = [Document(text=text)]
 # for document in documents:
 #     print(document)
 
 llm = OpenAI(model="gpt-4o", temperature=0.0)
-embed_model = OpenAIEmbedding(model_name="text-embedding-3-small")
+# Entity names repeat across articles, so embeddings are deduplicated, packed into full requests
+# and kept on disk between runs (see embedding_cache.py)
+embed_model = CachedEmbedding(
+    OpenAIEmbedding(model_name="text-embedding-3-small", embed_batch_size=PROVIDER_BATCH_LIMIT),
+    cache_path=os.environ.get('EMBEDDING_CACHE_PATH', 'embedding_cache'),
+)
 
 #
 entities = Literal["PERSON", "LOCATION", "ORGANIZATION", "PRODUCT", "EVENT"]
@@ -87,7 +114,10 @@ validation_schema = {
 #     "Location": ["HAPPENED_AT", "IN_LOCATION"],
 # }
 
-kg_extractor = SchemaLLMPathExtractor(
+# Same as SchemaLLMPathExtractor, with the schema compiled into set lookups and a count of what each
+# rule rejects (printed after the run). Triplets whose entity types have no key in validation_schema are
+# not checked at all, the keys must match the upper-cased types: "Person" never matches PERSON.
+kg_extractor = FastSchemaLLMPathExtractor(
     llm=llm,
     possible_entities=entities,
     possible_relations=relations,
@@ -97,26 +127,76 @@ kg_extractor = SchemaLLMPathExtractor(
     strict=True,
 )
 
-NUMBER_OF_ARTICLES = 25
+# Number of articles ingested by this run
+NUMBER_OF_ARTICLES = int(os.environ.get('NUMBER_OF_ARTICLES', 25))
+documents = iter_news_documents(NEWS_CSV, start=checkpoint.resume_from, limit=NUMBER_OF_ARTICLES)
 
-index = PropertyGraphIndex.from_documents(
-    documents[:NUMBER_OF_ARTICLES],
-    kg_extractors=[kg_extractor],
+# Instead of PropertyGraphIndex.from_documents, which gives no control over how many LLM calls run at once,
+# the extraction runs through kg_ingestion.IngestionPipeline: a bounded pool of workers, one schema extraction
+# per chunk, each taking its share of the requests/min and tokens/min budget, with retries and backoff.
+# Extracted chunks are written to the graph store as they finish.
+# The index only runs the (LLM free) implicit extractor on insert, the schema extraction is already done.
+# Its upserts are buffered and written in large batches, one UNWIND statement per entity label and relation type.
+buffered_store = BufferedGraphStore(graph_store,
+                                    writer=None if LOCAL_GRAPH_PATH else Neo4jBulkWriter(graph_store.structured_query),
+                                    batch_size=5000, max_delay=10.0)
+# Neighbourhoods expanded by the retriever at the end are cached, the index writes drop the ones they change
+neighbourhoods = NeighbourhoodCache(capacity=4096)
+index = PropertyGraphIndex.from_existing(
+    property_graph_store=CacheInvalidatingStore(buffered_store, neighbourhoods),
+    kg_extractors=[ImplicitPathExtractor()],
     llm=llm,
     embed_model=embed_model,
-    property_graph_store=graph_store,
-    show_progress=True,
 )
+# Extractions are cached on disk, keyed on chunk text, model, prompt, schema and extractor settings,
+# so re-running the ingest (or resuming after a crash) does not send the same chunks to gpt-4o again
+extraction_cache = ExtractionCache(os.environ.get('EXTRACTION_CACHE_PATH', 'extraction_cache.sqlite'))
+write_to_graph = graph_index_sink(index)
+
+
+def write_and_checkpoint(nodes):
+    write_to_graph(nodes)
+    # the chunks only count as ingested once the buffer holding them is written
+    buffered_store.when_flushed(lambda: checkpoint.mark_nodes_done(nodes))
+
+
+pipeline = IngestionPipeline(
+    extract=kg_extract(CachedExtractor(kg_extractor, extraction_cache)),
+    sink=write_and_checkpoint,
+    concurrency=8,
+    limiter=RateLimiter(requests_per_minute=500, tokens_per_minute=30000),
+)
+stats = asyncio.run(pipeline.run(checkpoint.chunk_documents(documents)))
+buffered_store.flush()
+print("resume from article ", checkpoint.resume_from)
+print(stats)
+print(extraction_cache.stats())
+print(embed_model.stats)
+print(kg_extractor.validation_stats)
+
+if LOCAL_GRAPH_PATH:
+    graph_store.persist(LOCAL_GRAPH_PATH)
+else:
+    graph_store.structured_query("""
+    CREATE VECTOR INDEX my_entity IF NOT EXISTS
+    FOR (m:`__Entity__`)
+    ON m.embedding
+    OPTIONS {indexConfig: {
+     `vector.dimensions`: 1536,
+     `vector.similarity_function`: 'cosine'
+    }}
+    """)
 
-graph_store.structured_query("""
-CREATE VECTOR INDEX my_entity IF NOT EXISTS
-FOR (m:`__Entity__`)
-ON m.embedding
-OPTIONS {indexConfig: {
- `vector.dimensions`: 1536,
- `vector.similarity_function`: 'cosine'
-}}
-""")
+# QUESTION="..." retrieves from the graph: the entities closest to the question, expanded two hops
+QUESTION = os.environ.get('QUESTION')
+if QUESTION:
+    retriever = index.as_retriever(sub_retrievers=[
+        CachedGraphRetriever(index.property_graph_store, embed_model=embed_model, similarity_top_k=4,
+                             path_depth=2, max_fanout=5, cache=neighbourhoods),
+    ])
+    for node in retriever.retrieve(QUESTION):
+        print(f"{node.score:.3f}", node.text)
+    print(neighbourhoods.stats())
 # # Just for inspection
 # similarity_threshold = 0.1
 # word_edit_distance = 5
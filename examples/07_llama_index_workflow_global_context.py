@@ -1,12 +1,19 @@
 # Implemented the reflection pattern in llamaindex workflow
 import os
-from typing import Union
+from dataclasses import dataclass, field
+from typing import Optional, Union
 
 from dotenv import load_dotenv
 from llama_index.core.workflow import Context, step, Event, StartEvent, Workflow, StopEvent, draw_all_possible_flows, \
     draw_most_recent_execution
 from llama_index.llms.openai import OpenAI
 
+from llm_cache import CachedLLM, ResponseCache
+from parallel_reflection import ParallelReflection
+from workflow_state import BlobStore, StateSlot
+from workflow_stream import stream_complete, stream_tokens
+from workflow_trace import WorkflowTracer, annotate_flow_html
+
 # Loading OpenAI API Key and MEM0 api key
 load_dotenv()
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
@@ -24,16 +31,29 @@ class ReviewEvent(Event):
     query: str
 
 
+@dataclass(frozen=True, slots=True)
+class TeacherState:
+    category: str = "physics"
+    attempt: int = 0
+    # the texts, not the response objects; long ones are kept on disk and the state holds a reference
+    response: Optional[str] = field(default=None, metadata={"spill": True})
+    feedback: Optional[str] = field(default=None, metadata={"spill": True})
+
+
 class TeacherCrew(Workflow):
-    llm = OpenAI()
+    # repeated teacher and reviewer prompts are answered from memory or disk for a week. Calls above
+    # temperature 0.3 (ParallelReflection's spread of candidates) are meant to differ and are not cached.
+    llm = CachedLLM(OpenAI(), ResponseCache(path="llm_cache.sqlite", ttl=7 * 24 * 3600, max_temperature=0.3))
+    # long answers are kept in WORKFLOW_BLOB_DIR, which outlives the runs whose checkpoints refer to them
+    state = StateSlot(TeacherState, blobs=BlobStore(os.environ.get('WORKFLOW_BLOB_DIR', 'workflow_blobs'),
+                                                    min_bytes=2048))
     attempt = 0
 
     @step(pass_context=True)
     async def router(self, ctx: Context, ev: StartEvent) -> Union[MathEvent, PhysicsEvent]:
         query = ev.query
         category = ev.category
-        ctx.data["attempt"] = 0
-        ctx.data["category"] = category
+        await self.state.update(ctx, attempt=0, category=category)
 
         if category.lower() == "math":
             return MathEvent(query=query)
@@ -42,9 +62,10 @@ class TeacherCrew(Workflow):
 
     @step(pass_context=True)
     async def physics_agent(self, ctx: Context, ev: PhysicsEvent) -> Union[ReviewEvent, StopEvent]:
-        attempt = ctx.data.get("attempt")
-        response = ctx.data.get("response")
-        feedback = ctx.data.get("feedback")
+        state = await self.state.of(ctx)
+        attempt = state.attempt
+        response = state.response
+        feedback = state.feedback
         query = ev.query
         # print("In Physics Agent ")
         # print("attempt: ", attempt)
@@ -61,17 +82,18 @@ class TeacherCrew(Workflow):
             return StopEvent(result="final response : \n" + str(response) + "\n feedback:" + str(feedback))
         else:
             attempt = attempt + 1
-            ctx.data["attempt"] = attempt
-            response = await self.llm.acomplete(prompt)
-            ctx.data["response"] = response
-            print("attempt #: ", attempt, "\nfeeback :", feedback, "\nresponse :", response)
+            # the answer reaches the caller as it is written
+            response = await stream_complete(ctx, self.llm, prompt, "physics_agent")
+            # no print: the caller already shows the answer and the feedback token by token
+            await self.state.update(ctx, attempt=attempt, response=response.text)
             return ReviewEvent(query=query)
 
     @step(pass_context=True)
     async def math_agent(self, ctx: Context, ev: MathEvent) -> Union[ReviewEvent, StopEvent]:
-        attempt = ctx.data.get("attempt")
-        response = ctx.data.get("response")
-        feedback = ctx.data.get("feedback")
+        state = await self.state.of(ctx)
+        attempt = state.attempt
+        response = state.response
+        feedback = state.feedback
         query = ev.query
         # print("In Physics Agent ")
         # print("attempt: ", attempt)
@@ -88,17 +110,16 @@ class TeacherCrew(Workflow):
             return StopEvent(result="final response :\n" + str(response) + "\n feedback:" + str(feedback))
         else:
             attempt = attempt + 1
-            ctx.data["attempt"] = attempt
-            response = await self.llm.acomplete(prompt)
-            print("attempt #: ", attempt, "\nfeedback :", feedback, "\nresponse :", response)
-            ctx.data["response"] = response
+            response = await stream_complete(ctx, self.llm, prompt, "math_agent")
+            await self.state.update(ctx, attempt=attempt, response=response.text)
             return ReviewEvent(query=query)
 
     @step(pass_context=True)
     async def review_agent(self, ctx: Context, ev: ReviewEvent) -> Union[PhysicsEvent, MathEvent]:
-        category = ctx.data.get("category")
+        state = await self.state.of(ctx)
+        category = state.category
         query = ev.query
-        response = ctx.data.get("response")
+        response = state.response
         # print("In review Agent ")
         # print("category: ", category)
         # print("response: ",  response)
@@ -111,10 +132,10 @@ class TeacherCrew(Workflow):
         response:{response} \n
         feedback:
         """
-        feedback = await self.llm.acomplete(prompt)
+        feedback = await stream_complete(ctx, self.llm, prompt, "review_agent")
         # print("feedback: ", feedback)
         # print("--------------------------------")
-        ctx.data["feedback"] = feedback
+        await self.state.update(ctx, feedback=feedback.text)
 
         if category == "math":
             return MathEvent(query=query, response=response)
@@ -123,11 +144,28 @@ class TeacherCrew(Workflow):
 
 
 async def main():
+    # step timings, queue waits and LLM tokens of every run below, as OpenTelemetry spans
+    tracer = WorkflowTracer(path="teachercrew_trace.jsonl").install()
     w = TeacherCrew(timeout=60, verbose=False)
     draw_all_possible_flows(TeacherCrew, filename="teachercrew.html")
-    result = await w.run(query="what is reflection?", category="physics")
+    handler = w.run(query="what is reflection?", category="physics")
+    # each answer and review as it is generated, instead of everything at the end
+    async for token in stream_tokens(handler):
+        print(token.delta, end="\n\n" if token.done else "", flush=True)
+    result = await handler
     print(str(result))
+    # the run is over: delete the texts it spilled to workflow_blobs/
+    TeacherCrew.state.discard(handler.ctx)
     draw_most_recent_execution(w, filename="teachercrewrun.html")
+    annotate_flow_html("teachercrewrun.html", tracer, workflow="TeacherCrew")
+    print(TeacherCrew.llm.cache.stats)
+
+    # the same loop with 3 candidate answers written and reviewed at once, stopping at the first scoring 8 or more
+    parallel = ParallelReflection(llm=TeacherCrew.llm, candidates=3, threshold=8, max_rounds=2, timeout=60, verbose=False)
+    result = await parallel.run(query="what is reflection?", category="physics")
+    print(f"{result}\n score: {result.best.score} after {result.rounds} round(s)")
+    print(tracer.report())
+    tracer.uninstall()
 
 
 if __name__ == "__main__":
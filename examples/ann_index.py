@@ -0,0 +1,424 @@
+"""Local nearest-neighbour indexes over entity embeddings (cosine), no database needed.
+
+``ExactIndex`` scans every vector and is the reference. ``IVFFlatIndex`` clusters the vectors
+with spherical k-means into ``nlist`` lists. A query is only compared with the vectors in the
+``nprobe`` lists whose centroids are closest to it. Until ``train_size`` vectors are in,
+the index searches exactly.
+
+Both indexes take vectors under arbitrary hashable keys (entity names) and support:
+
+* ``add`` (re-adding a key replaces its vector), with new vectors going to their nearest
+  list. The lists are re-clustered once the index has grown ``retrain_growth`` times since
+  the last training,
+* ``remove``, for entities merged away by dedup,
+* ``search`` / ``search_many`` for the top k, and ``pairs`` for every pair above a cosine
+  threshold (the dedup candidate search),
+* ``save`` / ``load_vector_index``, vectors as ``.npy`` that can be memory-mapped.
+
+Scores are plain cosine. The Neo4j vector index reports ``(1 + cos) / 2``.
+Run this file directly for a recall-versus-latency benchmark against brute force.
+"""
+import json
+import os
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from entity_dedup import SIMILARITY_THRESHOLD, Entity, block_by_labels, embedding_matrix
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    if k >= len(scores):
+        return np.argsort(-scores, kind="stable")
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best], kind="stable")]
+
+
+class ExactIndex:
+    """Brute-force cosine search, the reference ``IVFFlatIndex`` is measured against."""
+
+    kind = "exact"
+
+    def __init__(self, dimensions: Optional[int] = None):
+        self.dimensions = dimensions
+        self._keys: List[Hashable] = []
+        self._slots: Dict[Hashable, int] = {}
+        self._vectors = np.zeros((0, dimensions or 0), dtype=np.float32)
+        self._live = np.zeros(0, dtype=bool)
+        self._count = 0
+        self._owned = True
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._slots
+
+    def _reserve(self, rows: int) -> None:
+        if self._owned and rows <= len(self._vectors):
+            return
+        size = max(rows, 2 * len(self._vectors), 64)
+        vectors = np.zeros((size, self.dimensions), dtype=np.float32)
+        live = np.zeros(size, dtype=bool)
+        if self._count:
+            vectors[:self._count] = self._vectors[:self._count]
+            live[:self._count] = self._live[:self._count]
+        # also where a memory-mapped (read-only) index gets its own copy
+        self._vectors, self._live, self._owned = vectors, live, True
+
+    def add(self, keys: Sequence[Hashable], vectors: Any) -> np.ndarray:
+        """Adds or replaces vectors, returns their slots."""
+        vectors = _normalize(vectors)
+        if self.dimensions is None:
+            self.dimensions = vectors.shape[1]
+        if vectors.shape[1] != self.dimensions:
+            raise ValueError(f"expected {self.dimensions}-dim vectors, got {vectors.shape[1]}")
+        if len(set(keys)) < len(keys):
+            last = {key: i for i, key in enumerate(keys)}
+            keys, vectors = list(last), vectors[list(last.values())]
+        self.remove(keys)
+        self._reserve(self._count + len(keys))
+        slots = np.arange(self._count, self._count + len(keys))
+        self._vectors[slots] = vectors
+        self._live[slots] = True
+        for key, slot in zip(keys, slots.tolist()):
+            self._slots[key] = slot
+            self._keys.append(key)
+        self._count += len(keys)
+        return slots
+
+    def remove(self, keys: Iterable[Hashable]) -> List[int]:
+        removed = [self._slots.pop(key) for key in keys if key in self._slots]
+        if removed:
+            self._reserve(self._count)
+            self._live[removed] = False
+        return removed
+
+    def _candidates(self, query: np.ndarray, nprobe: Optional[int]) -> np.ndarray:
+        return np.flatnonzero(self._live[:self._count])
+
+    def search(self, vector: Any, k: int = 10, nprobe: Optional[int] = None) -> Tuple[List[Hashable], List[float]]:
+        if not self._slots:
+            return [], []
+        query = _normalize(vector)[0]
+        slots = self._candidates(query, nprobe)
+        scores = self._vectors[slots] @ query
+        best = _top_k(scores, k)
+        return [self._keys[s] for s in slots[best].tolist()], scores[best].tolist()
+
+    def search_many(self, vectors: Any, k: int = 10,
+                    nprobe: Optional[int] = None) -> List[Tuple[List[Hashable], List[float]]]:
+        return [self.search(vector, k, nprobe) for vector in _normalize(vectors)]
+
+    def _probe_groups(self, nprobe: Optional[int]) -> Iterable[Tuple[np.ndarray, np.ndarray]]:
+        """(queries, members) slot groups that ``pairs`` compares, every pair of live slots here."""
+        live = np.flatnonzero(self._live[:self._count])
+        yield live, live
+
+    def pairs(self, min_cosine: float, nprobe: Optional[int] = None,
+              tile_size: int = 2048) -> Iterable[Tuple[Hashable, Hashable, float]]:
+        """Every pair of keys with cosine above ``min_cosine`` (for IVF, in the lists probed), once.
+
+        Strictly above, like ``entity_dedup.cosine_pairs`` and the Cypher ``score > 0.8``, so a tie
+        on the threshold is left out by both paths.
+        """
+        seen = set()
+        for queries, members in self._probe_groups(nprobe):
+            member_vectors = self._vectors[members]
+            for start in range(0, len(queries), tile_size):
+                tile = queries[start:start + tile_size]
+                scores = self._vectors[tile] @ member_vectors.T
+                rows, cols = np.nonzero(scores > min_cosine)
+                for a, b, score in zip(tile[rows].tolist(), members[cols].tolist(), scores[rows, cols].tolist()):
+                    if a < b and (a, b) not in seen:
+                        seen.add((a, b))
+                        yield self._keys[a], self._keys[b], score
+
+    # ----- persistence -----
+
+    def _compacted(self) -> Tuple[np.ndarray, List[Hashable]]:
+        slots = np.flatnonzero(self._live[:self._count])
+        return slots, [self._keys[s] for s in slots.tolist()]
+
+    def _meta(self) -> Dict[str, Any]:
+        return {"kind": self.kind, "dimensions": self.dimensions}
+
+    def save(self, path: str) -> None:
+        os.makedirs(path, exist_ok=True)
+        slots, keys = self._compacted()
+        arrays = {"vectors": self._vectors[slots], **self._arrays(slots)}
+        written = []
+        # write next to the old files and rename, an index mapping the old ones keeps reading them
+        for name, array in arrays.items():
+            target = os.path.join(path, f"{name}.npy")
+            with open(target + ".tmp", "wb") as f:
+                np.save(f, array)
+            written.append(target)
+        for name, data in (("keys.json", keys), ("meta.json", self._meta())):
+            target = os.path.join(path, name)
+            with open(target + ".tmp", "w") as f:
+                json.dump(data, f)
+            written.append(target)
+        for target in written:
+            os.replace(target + ".tmp", target)
+
+    def _arrays(self, slots: np.ndarray) -> Dict[str, np.ndarray]:
+        return {}
+
+    def _load(self, path: str, mmap: bool) -> None:
+        self._vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r" if mmap else None)
+        self._owned = not mmap
+        with open(os.path.join(path, "keys.json")) as f:
+            # JSON turns tuples into lists, keys are names here
+            self._keys = [tuple(key) if isinstance(key, list) else key for key in json.load(f)]
+        self._count = len(self._keys)
+        self._live = np.ones(self._count, dtype=bool)
+        self._slots = {key: slot for slot, key in enumerate(self._keys)}
+
+
+class IVFFlatIndex(ExactIndex):
+    kind = "ivf_flat"
+
+    def __init__(self, dimensions: Optional[int] = None,
+                 nlist: Optional[int] = None,
+                 nprobe: int = 8,
+                 train_size: int = 4096,
+                 retrain_growth: float = 4.0,
+                 kmeans_iterations: int = 10,
+                 seed: int = 0):
+        super().__init__(dimensions)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_size = train_size
+        self.retrain_growth = retrain_growth
+        self.kmeans_iterations = kmeans_iterations
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self.trained_on = 0
+        self._assignment = np.zeros(0, dtype=np.int32)
+        self._lists: List[List[int]] = []
+        self._list_arrays: Dict[int, np.ndarray] = {}
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def _assign(self, vectors: np.ndarray, chunk: int = 8192) -> np.ndarray:
+        return np.concatenate([np.argmax(vectors[i:i + chunk] @ self.centroids.T, axis=1)
+                               for i in range(0, len(vectors), chunk)] or [np.zeros(0, np.int64)]).astype(np.int32)
+
+    def _probe(self, vectors: np.ndarray, nprobe: int, chunk: int = 8192) -> np.ndarray:
+        nprobe = min(nprobe, len(self.centroids))
+        probes = []
+        for i in range(0, len(vectors), chunk):
+            scores = vectors[i:i + chunk] @ self.centroids.T
+            probes.append(np.argpartition(-scores, nprobe - 1, axis=1)[:, :nprobe])
+        return np.concatenate(probes) if probes else np.zeros((0, nprobe), dtype=np.int64)
+
+    def train(self) -> None:
+        """(Re)clusters the live vectors and rebuilds the lists."""
+        live = np.flatnonzero(self._live[:self._count])
+        nlist = self.nlist or max(1, int(np.sqrt(len(live))))
+        rng = np.random.default_rng(self.seed)
+        # k-means on a sample, the centroids do not get better with more than a few dozen points per list
+        sample = self._vectors[rng.choice(live, size=min(len(live), nlist * 64), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=min(nlist, len(sample)), replace=False)].copy()
+        for _ in range(self.kmeans_iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            empty = np.bincount(assignment, minlength=len(centroids)) == 0
+            # an empty list gets a random point, spherical k-means keeps centroids on the unit sphere
+            sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+            centroids = _normalize(sums)
+        self.centroids = centroids
+        self.trained_on = len(live)
+        self._assignment = np.zeros(len(self._vectors), dtype=np.int32)
+        self._assignment[live] = self._assign(self._vectors[live])
+        self._lists = [[] for _ in range(len(centroids))]
+        for slot, list_id in zip(live.tolist(), self._assignment[live].tolist()):
+            self._lists[list_id].append(slot)
+        self._list_arrays = {}
+
+    def add(self, keys: Sequence[Hashable], vectors: Any) -> np.ndarray:
+        slots = super().add(keys, vectors)
+        if len(self._assignment) < len(self._vectors):
+            assignment = np.zeros(len(self._vectors), dtype=np.int32)
+            assignment[:len(self._assignment)] = self._assignment
+            self._assignment = assignment
+        if not self.trained:
+            if len(self) >= self.train_size:
+                self.train()
+        elif len(self) >= self.trained_on * self.retrain_growth:
+            # the clusters were fitted to a much smaller index, the lists get too unbalanced
+            self.train()
+        else:
+            self._assignment[slots] = self._assign(self._vectors[slots])
+            for slot, list_id in zip(slots.tolist(), self._assignment[slots].tolist()):
+                self._lists[list_id].append(slot)
+                self._list_arrays.pop(list_id, None)
+        return slots
+
+    def remove(self, keys: Iterable[Hashable]) -> List[int]:
+        removed = super().remove(keys)
+        if self.trained:
+            for slot in removed:
+                list_id = int(self._assignment[slot])
+                self._lists[list_id].remove(slot)
+                self._list_arrays.pop(list_id, None)
+        return removed
+
+    def _list(self, list_id: int) -> np.ndarray:
+        array = self._list_arrays.get(list_id)
+        if array is None:
+            array = self._list_arrays[list_id] = np.asarray(self._lists[list_id], dtype=np.int64)
+        return array
+
+    def _candidates(self, query: np.ndarray, nprobe: Optional[int]) -> np.ndarray:
+        if not self.trained:
+            return super()._candidates(query, nprobe)
+        probe = self._probe(query[None, :], nprobe or self.nprobe)[0]
+        return np.concatenate([self._list(l) for l in probe.tolist()])
+
+    def _probe_groups(self, nprobe: Optional[int]) -> Iterable[Tuple[np.ndarray, np.ndarray]]:
+        if not self.trained:
+            yield from super()._probe_groups(nprobe)
+            return
+        live = np.flatnonzero(self._live[:self._count])
+        probes = self._probe(self._vectors[live], nprobe or self.nprobe)
+        # invert the probes: for every list, the vectors that probe it
+        order = np.argsort(probes.ravel(), kind="stable")
+        queries = live[order // probes.shape[1]]
+        bounds = np.searchsorted(probes.ravel()[order], np.arange(len(self._lists) + 1))
+        for list_id in range(len(self._lists)):
+            members = self._list(list_id)
+            if len(members) and bounds[list_id + 1] > bounds[list_id]:
+                yield queries[bounds[list_id]:bounds[list_id + 1]], members
+
+    def _meta(self) -> Dict[str, Any]:
+        return {**super()._meta(), "nlist": self.nlist, "nprobe": self.nprobe, "train_size": self.train_size,
+                "retrain_growth": self.retrain_growth, "kmeans_iterations": self.kmeans_iterations,
+                "seed": self.seed, "trained_on": self.trained_on}
+
+    def _arrays(self, slots: np.ndarray) -> Dict[str, np.ndarray]:
+        if not self.trained:
+            return {}
+        return {"centroids": self.centroids, "assignment": self._assignment[slots]}
+
+    def _load(self, path: str, mmap: bool) -> None:
+        super()._load(path, mmap)
+        centroids = os.path.join(path, "centroids.npy")
+        if not os.path.exists(centroids):
+            return
+        self.centroids = np.load(centroids)
+        self._assignment = np.load(os.path.join(path, "assignment.npy")).astype(np.int32)
+        self._lists = [[] for _ in range(len(self.centroids))]
+        for slot, list_id in enumerate(self._assignment.tolist()):
+            self._lists[list_id].append(slot)
+
+
+INDEX_KINDS = {cls.kind: cls for cls in (ExactIndex, IVFFlatIndex)}
+
+
+def load_vector_index(path: str, mmap: bool = True) -> ExactIndex:
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    kind = meta.pop("kind")
+    trained_on = meta.pop("trained_on", None)
+    index = INDEX_KINDS[kind](**meta)
+    index._load(path, mmap)
+    if trained_on is not None:
+        index.trained_on = trained_on
+    return index
+
+
+def ann_candidate_pairs(entities: Sequence[Entity],
+                        threshold: float = SIMILARITY_THRESHOLD,
+                        nprobe: int = 8,
+                        train_size: int = 4096) -> Iterable[Tuple[int, int]]:
+    """Like entity_dedup.embedding_candidate_pairs, but only compares entities in nearby IVF lists.
+
+    Pass it as ``DedupEngine(candidate_fn=ann_candidate_pairs)``. Blocks smaller than
+    ``train_size`` are still compared exactly.
+    """
+    min_cosine = 2 * threshold - 1  # same (1 + cos) / 2 score as the vector index
+    for indices in block_by_labels(entities).values():
+        matrix, kept = embedding_matrix(entities, indices)
+        if not len(kept):
+            continue
+        index = IVFFlatIndex(nprobe=nprobe, train_size=train_size)
+        index.add(list(range(len(kept))), matrix)
+        for a, b, _ in index.pairs(min_cosine):
+            yield int(kept[a]), int(kept[b])
+
+
+if __name__ == "__main__":
+    import sys
+    import tempfile
+    import time
+
+    from entity_dedup import cosine_pairs
+
+    # python ann_index.py [number of vectors]
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    dimensions, queries = 256, 200
+    rng = np.random.default_rng(7)
+    # embeddings of real entities cluster by topic, uniform random vectors would be the worst case for IVF
+    topics = _normalize(rng.standard_normal((500, dimensions)))
+    data = _normalize(topics[rng.integers(0, len(topics), size)]
+                      + 1.2 * rng.standard_normal((size, dimensions)) / np.sqrt(dimensions))
+    probes = _normalize(data[rng.integers(0, size, queries)] + 0.05 * rng.standard_normal((queries, dimensions)))
+    keys = [f"Entity {i}" for i in range(size)]
+    print(f"{size} vectors, {dimensions} dims, {queries} queries, k=10")
+
+    exact = ExactIndex()
+    exact.add(keys, data)
+    start = time.perf_counter()
+    truth = [set(found) for found, _ in exact.search_many(probes, 10)]
+    print(f"{'exact':16}{(time.perf_counter() - start) / queries * 1000:8.2f} ms/query  recall 1.000")
+
+    start = time.perf_counter()
+    ivf = IVFFlatIndex()
+    for i in range(0, size, 1000):  # incremental inserts, trains and retrains on the way
+        ivf.add(keys[i:i + 1000], data[i:i + 1000])
+    print(f"built IVF ({len(ivf.centroids)} lists, trained on {ivf.trained_on}) in {time.perf_counter() - start:.1f}s")
+    for nprobe in (1, 2, 4, 8, 16, 32):
+        start = time.perf_counter()
+        results = ivf.search_many(probes, 10, nprobe=nprobe)
+        seconds = (time.perf_counter() - start) / queries
+        recall = np.mean([len(truth[i] & set(found)) / 10 for i, (found, _) in enumerate(results)])
+        print(f"{'nprobe=' + str(nprobe):16}{seconds * 1000:8.2f} ms/query  recall {recall:.3f}")
+
+    # dedup: every pair above the threshold, with a few planted near-duplicates
+    sample = min(size, 20000)
+    dup_data = data[:sample].copy()
+    planted = rng.choice(sample, size=sample // 50, replace=False)
+    dup_data[planted[: len(planted) // 2]] = _normalize(dup_data[planted[len(planted) // 2:]]
+                                                        + 0.3 * rng.standard_normal((len(planted) // 2, dimensions))
+                                                        / np.sqrt(dimensions))
+    min_cosine = 2 * SIMILARITY_THRESHOLD - 1
+    start = time.perf_counter()
+    expected = {tuple(sorted(p)) for p in cosine_pairs(dup_data, min_cosine)}
+    print(f"\nall pairs with cos > {min_cosine:.1f} among {sample}: {len(expected)}, "
+          f"brute force {time.perf_counter() - start:.2f}s")
+    for nprobe in (2, 4, 8):
+        start = time.perf_counter()
+        index = IVFFlatIndex(nprobe=nprobe)
+        index.add(list(range(sample)), dup_data)
+        found = {tuple(sorted((a, b))) for a, b, _ in index.pairs(min_cosine)}
+        print(f"{'nprobe=' + str(nprobe):16}{time.perf_counter() - start:8.2f}s  "
+              f"pair recall {len(found & expected) / max(1, len(expected)):.3f}")
+
+    with tempfile.TemporaryDirectory() as path:
+        ivf.remove(keys[:100])
+        ivf.save(path)
+        loaded = load_vector_index(path)
+        assert loaded.search(data[500], 10, nprobe=8) == ivf.search(data[500], 10, nprobe=8)
+        print(f"\nsaved and reloaded (mmap) {len(loaded)} vectors")
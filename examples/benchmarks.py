@@ -0,0 +1,343 @@
+"""Offline benchmarks for knowledge graph ingestion (03) and entity deduplication (04).
+
+Nothing here talks to OpenAI or Neo4j. A ``SyntheticCorpus`` generates news-like documents about
+made-up companies. A known share of the company names in it are variants of another one
+("Velora Logistics Inc.", "VELORA Logistics", "Vlero Logistics"), so the dedup result can be
+scored against the truth. Sibling companies ("Velora Logistics", "Velora Energy") have similar
+names and similar embeddings but must not be merged.
+
+Stages:
+
+* ``ingest``: the 03_llama_index_kg.py pipeline, built from the same parts (``IngestionPipeline``,
+  ``CachedExtractor`` over ``FastSchemaLLMPathExtractor``, ``CachedEmbedding``, a ``BufferedGraphStore``
+  in front of a ``LocalPropertyGraphStore``) with ``FakeLLM`` / ``CorpusEmbedding`` and empty caches,
+  per-chunk p50/p99 from the pipeline. ``--ingest from_documents`` times the stock
+  ``PropertyGraphIndex.from_documents`` with ``SchemaLLMPathExtractor`` instead, which has no per-chunk
+  latencies.
+* ``dedup``: ``DedupEngine.merge_plan`` over every name in the corpus, the in-process version of
+  04_dedepulicating_the_graph.py, with pairwise precision/recall against the truth.
+
+Every (stage, scale) runs in its own process, so the reported peak RSS is that run's alone.
+
+    python benchmarks.py                                   # both stages at 1k, 10k and 100k (slow)
+    python benchmarks.py --stages dedup --scales 1000,10000 --duplicate-rate 0.3 --candidates ann
+    python benchmarks.py --llm-latency 0.5 --concurrency 32 --results results.jsonl
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+from llama_index.core import Document
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+from entity_dedup import Entity
+from fakes import FakeEmbedding
+
+LABELS = ("ORGANIZATION", "PRODUCT", "EVENT", "LOCATION", "PERSON")
+SYLLABLES = ("ka", "lo", "ve", "ri", "ta", "no", "mi", "sa", "dex", "tor", "lin", "var", "bel", "cor", "fen",
+             "gal", "hal", "jun", "mar", "nor", "pel", "ros", "sil", "tan", "ul", "wen", "zar", "qua", "bri", "ox")
+SECTORS = ("Logistics", "Energy", "Capital", "Systems", "Foods", "Health", "Motors", "Media", "Labs", "Networks",
+           "Partners", "Robotics", "Pharma", "Telecom", "Holdings", "Materials", "Airways", "Insurance")
+SUFFIXES = ("Inc.", "Corp", "Group", "Ltd", "PLC", "Co.")
+# the fake LLM relates consecutive capitalised phrases, so names are always separated by lowercase words
+SENTENCES = (
+    "{a} signed a partnership with {b} on the new platform.",
+    "{a} agreed to supply parts to {b} for three years.",
+    "{a} and {b} announced a joint venture in the region.",
+    "{a} reported higher revenue, according to analysts at {b}.",
+    "{a} is in talks to acquire a stake in {b}, people familiar said.",
+    "shares of {a} rose after {b} confirmed the order.",
+)
+
+
+class SyntheticCorpus:
+    def __init__(self, names: int, duplicate_rate: float = 0.2, sibling_rate: float = 0.1,
+                 dimensions: int = 256, variant_noise: float = 0.6, sibling_noise: float = 1.0, seed: int = 0):
+        """``names`` surface forms, ``duplicate_rate`` of them variants of another one.
+
+        Embeddings are unit vectors. A variant's cosine to its original is about
+        1 / sqrt(1 + variant_noise ** 2), a sibling's about 1 / sqrt(1 + sibling_noise ** 2).
+        """
+        self.rng = random.Random(seed)
+        rng = np.random.default_rng(seed)
+        self.dimensions = dimensions
+        self.names: List[str] = []
+        self.labels: List[str] = []
+        # index of the original name every name is a form of (its own index for originals)
+        self.canonical: List[int] = []
+        vectors: List[np.ndarray] = []
+        taken: Set[str] = set()
+
+        def add(name: str, label: str, canonical: int, vector: np.ndarray) -> None:
+            taken.add(name.lower())
+            self.names.append(name)
+            self.labels.append(label)
+            self.canonical.append(canonical if canonical >= 0 else len(self.canonical))
+            vectors.append(vector / np.linalg.norm(vector))
+
+        def noisy(vector: np.ndarray, scale: float) -> np.ndarray:
+            return vector + scale * rng.standard_normal(dimensions) / np.sqrt(dimensions)
+
+        originals = max(1, round(names * (1 - duplicate_rate)))
+        while len(self.names) < originals:
+            if self.names and self.rng.random() < sibling_rate:
+                # same name stem as an earlier company, another sector
+                parent = self.rng.randrange(len(self.names))
+                stem = self.names[self.canonical[parent]].rsplit(" ", 1)[0]
+                name, vector = f"{stem} {self.rng.choice(SECTORS)}", noisy(vectors[parent], sibling_noise)
+                label = self.labels[parent]
+            else:
+                name, vector = f"{self._word()} {self.rng.choice(SECTORS)}", rng.standard_normal(dimensions)
+                label = self.rng.choice(LABELS)
+            if name.lower() not in taken:
+                add(name, label, -1, vector)
+        while len(self.names) < names:
+            original = self.rng.randrange(originals)
+            variant = self._variant(self.names[original])
+            if variant.lower() not in taken:
+                add(variant, self.labels[original], original, noisy(vectors[original], variant_noise))
+        self.vectors = np.stack(vectors).astype(np.float32)
+        self._index = {name: i for i, name in enumerate(self.names)}
+
+    def _word(self) -> str:
+        return "".join(self.rng.choice(SYLLABLES) for _ in range(self.rng.choice((2, 3)))).capitalize()
+
+    def _variant(self, name: str) -> str:
+        words = name.split(" ")
+        kind = self.rng.randrange(4)
+        if kind == 0:
+            return f"{name} {self.rng.choice(SUFFIXES)}"
+        if kind == 1:
+            return " ".join([words[0].upper()] + words[1:])
+        if kind == 2 and len(words[0]) > 3:
+            # two letters of the first word swapped, the initial stays a capital
+            i = self.rng.randrange(1, len(words[0]) - 1)
+            first = words[0][:i] + words[0][i + 1] + words[0][i] + words[0][i + 2:]
+            return " ".join([first] + words[1:])
+        return " ".join(words[:-1]) if len(words) > 1 else f"{name} {self.rng.choice(SUFFIXES)}"
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def vector(self, name: str) -> Optional[np.ndarray]:
+        index = self._index.get(name)
+        return None if index is None else self.vectors[index]
+
+    def entities(self) -> List[Entity]:
+        """Every name as the ``Entity`` 04 would fetch from the graph."""
+        return [Entity(name=name, labels=(label,), embedding=vector)
+                for name, label, vector in zip(self.names, self.labels, self.vectors)]
+
+    def true_pairs(self) -> Set[Tuple[str, str]]:
+        groups: Dict[int, List[str]] = {}
+        for name, canonical in zip(self.names, self.canonical):
+            groups.setdefault(canonical, []).append(name)
+        return {pair for group in groups.values() for pair in _pairs(group)}
+
+    def documents(self, count: int, sentences: int = 6) -> Iterator[Document]:
+        rng = random.Random(count)
+        for i in range(count):
+            text = " ".join(rng.choice(SENTENCES).format(a=rng.choice(self.names), b=rng.choice(self.names))
+                            for _ in range(sentences))
+            yield Document(text=text, id_=f"synthetic-{i}")
+
+
+def _pairs(names: List[str]) -> Set[Tuple[str, str]]:
+    names = sorted(names)
+    return {(a, b) for i, a in enumerate(names) for b in names[i + 1:]}
+
+
+class CorpusEmbedding(FakeEmbedding):
+    """``FakeEmbedding`` that gives the corpus' entity names their corpus vectors, so variants embed close."""
+
+    _corpus: SyntheticCorpus = PrivateAttr()
+
+    def __init__(self, corpus: SyntheticCorpus, **kwargs):
+        super().__init__(dimensions=corpus.dimensions, **kwargs)
+        self._corpus = corpus
+
+    def _vector(self, text: str) -> List[float]:
+        # PropertyGraphIndex embeds str(entity), the name followed by its properties
+        vector = self._corpus.vector(text.split(" (", 1)[0])
+        return super()._vector(text) if vector is None else vector.tolist()
+
+
+@dataclass
+class BenchmarkResult:
+    stage: str
+    scale: int
+    items: int
+    seconds: float
+    throughput: float
+    p50: Optional[float] = None
+    p99: Optional[float] = None
+    peak_rss_mb: Optional[float] = None
+    precision: Optional[float] = None
+    recall: Optional[float] = None
+
+    def __str__(self) -> str:
+        def ms(value: Optional[float]) -> str:
+            return "-" if value is None else f"{value * 1000:.1f}"
+
+        def ratio(value: Optional[float]) -> str:
+            return "-" if value is None else f"{value:.3f}"
+
+        rss = "-" if self.peak_rss_mb is None else f"{self.peak_rss_mb:.0f}"
+        return (f"{self.stage:22} {self.scale:>8} {self.items:>8} {self.seconds:9.2f} {self.throughput:10.1f} "
+                f"{ms(self.p50):>8} {ms(self.p99):>8} {rss:>8} {ratio(self.precision):>9} {ratio(self.recall):>7}")
+
+
+HEADER = (f"{'stage':22} {'scale':>8} {'items':>8} {'seconds':>9} {'items/s':>10} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'rss MB':>8} {'precision':>9} {'recall':>7}")
+
+
+def peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def _percentile(latencies: List[float], q: float) -> Optional[float]:
+    return float(np.percentile(latencies, q)) if latencies else None
+
+
+def run_ingest(corpus: SyntheticCorpus, documents: int, args: argparse.Namespace) -> BenchmarkResult:
+    import tempfile
+    from typing import Literal
+
+    from llama_index.core import PropertyGraphIndex
+    from llama_index.core.indices.property_graph import ImplicitPathExtractor, SchemaLLMPathExtractor
+
+    from buffered_graph_store import BufferedGraphStore
+    from embedding_cache import CachedEmbedding
+    from extraction_cache import CachedExtractor, ExtractionCache
+    from fakes import fake_kg_llm
+    from graph_retriever import CacheInvalidatingStore, NeighbourhoodCache
+    from kg_ingestion import IngestionPipeline, chunk_documents, graph_index_sink, kg_extract
+    from local_graph_store import LocalPropertyGraphStore
+    from schema_validation import FastSchemaLLMPathExtractor
+
+    llm = fake_kg_llm(latency=args.llm_latency)
+    embed_model = CorpusEmbedding(corpus, latency=args.embed_latency, embed_batch_size=args.embed_batch_size)
+    # the fake LLM calls everything an ORGANIZATION in a PARTNERSHIP, which the validation schema must allow
+    schema = dict(llm=llm, possible_entities=Literal["ORGANIZATION"], possible_relations=Literal["PARTNERSHIP"],
+                  kg_validation_schema=[("ORGANIZATION", "PARTNERSHIP", "ORGANIZATION")], strict=True,
+                  num_workers=args.concurrency)
+    store = LocalPropertyGraphStore()
+    if args.ingest == "from_documents":
+        # the stock path 03 replaced, as the baseline
+        start = time.perf_counter()
+        PropertyGraphIndex.from_documents(list(corpus.documents(documents)), property_graph_store=store,
+                                          kg_extractors=[SchemaLLMPathExtractor(**schema)], llm=llm,
+                                          embed_model=embed_model)
+        seconds = time.perf_counter() - start
+        assert store.get_triplets(), "no triplets were extracted"
+        return BenchmarkResult("ingest (from_documents)", documents, documents, seconds, documents / seconds)
+    # wired as in 03, with cold caches in a directory of this run
+    with tempfile.TemporaryDirectory(prefix="benchmark_ingest_") as directory:
+        embed_model = CachedEmbedding(embed_model, cache_path=os.path.join(directory, "embedding_cache"),
+                                      batch_limit=args.embed_batch_size)
+        buffered_store = BufferedGraphStore(store, batch_size=5000, max_delay=10.0)
+        index = PropertyGraphIndex.from_existing(
+            property_graph_store=CacheInvalidatingStore(buffered_store, NeighbourhoodCache(capacity=4096)),
+            kg_extractors=[ImplicitPathExtractor()], llm=llm, embed_model=embed_model)
+        extraction_cache = ExtractionCache(os.path.join(directory, "extraction_cache.sqlite"))
+        pipeline = IngestionPipeline(extract=kg_extract(CachedExtractor(FastSchemaLLMPathExtractor(**schema),
+                                                                        extraction_cache)),
+                                     sink=graph_index_sink(index), concurrency=args.concurrency,
+                                     sink_batch_size=args.sink_batch_size)
+        stats = asyncio.run(pipeline.run(chunk_documents(corpus.documents(documents))))
+        buffered_store.flush()
+        extraction_cache.close()
+    assert not stats.failed, stats.errors[:3]
+    assert store.get_triplets(), "no triplets were extracted"
+    return BenchmarkResult("ingest (pipeline)", documents, stats.completed, stats.elapsed, stats.throughput,
+                           _percentile(stats.latencies, 50), _percentile(stats.latencies, 99))
+
+
+def run_dedup(corpus: SyntheticCorpus, args: argparse.Namespace) -> BenchmarkResult:
+    from entity_dedup import DedupEngine, embedding_candidate_pairs
+
+    candidate_fn = embedding_candidate_pairs
+    if args.candidates == "ann":
+        from ann_index import ann_candidate_pairs
+        candidate_fn = ann_candidate_pairs
+    entities = corpus.entities()
+    start = time.perf_counter()
+    plan = DedupEngine(candidate_fn=candidate_fn).merge_plan(entities)
+    seconds = time.perf_counter() - start
+    found = {pair for group in plan for pair in _pairs(group)}
+    truth = corpus.true_pairs()
+    correct = len(found & truth)
+    return BenchmarkResult(f"dedup ({args.candidates})", len(entities), len(entities), seconds,
+                           len(entities) / seconds,
+                           precision=correct / len(found) if found else 1.0,
+                           recall=correct / len(truth) if truth else 1.0)
+
+
+def run_one(stage: str, scale: int, args: argparse.Namespace) -> BenchmarkResult:
+    # ingest: ``scale`` documents about scale / 2 names, dedup: ``scale`` names
+    names = max(10, scale // 2) if stage == "ingest" else scale
+    corpus = SyntheticCorpus(names, duplicate_rate=args.duplicate_rate, dimensions=args.dimensions,
+                             variant_noise=args.variant_noise, seed=args.seed)
+    result = run_ingest(corpus, scale, args) if stage == "ingest" else run_dedup(corpus, args)
+    result.peak_rss_mb = peak_rss_mb()
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--stages", default="ingest,dedup")
+    parser.add_argument("--scales", default="1000,10000,100000")
+    parser.add_argument("--duplicate-rate", type=float, default=0.2)
+    parser.add_argument("--variant-noise", type=float, default=0.6,
+                        help="how far a duplicate's embedding is from its original's, 0.6 is a cosine of about 0.86")
+    parser.add_argument("--dimensions", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ingest", choices=("pipeline", "from_documents"), default="pipeline")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds per fake LLM call")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="seconds per fake embedding request")
+    parser.add_argument("--embed-batch-size", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--sink-batch-size", type=int, default=16)
+    parser.add_argument("--candidates", choices=("exact", "ann"), default="exact")
+    parser.add_argument("--results", help="append every result to this JSONL file")
+    parser.add_argument("--worker", nargs=2, metavar=("STAGE", "SCALE"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        stage, scale = args.worker
+        print(json.dumps(asdict(run_one(stage, int(scale), args))))
+        return
+
+    print(HEADER)
+    passed = list(argv if argv is not None else sys.argv[1:])
+    for stage in args.stages.split(","):
+        for scale in args.scales.split(","):
+            # a fresh process per run, peak RSS is per process
+            completed = subprocess.run([sys.executable, os.path.abspath(__file__), *passed, "--worker", stage, scale],
+                                       capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            if completed.returncode != 0:
+                print(f"{stage} at {scale} failed:\n{completed.stderr[-2000:]}")
+                continue
+            result = BenchmarkResult(**json.loads(completed.stdout.strip().splitlines()[-1]))
+            print(result, flush=True)
+            if args.results:
+                with open(args.results, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({**asdict(result), "args": vars(args)}) + "\n")
+
+
+if __name__ == "__main__":
+    main()
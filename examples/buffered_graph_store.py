@@ -0,0 +1,452 @@
+"""Buffered writes in front of a property graph store.
+
+``PropertyGraphIndex`` upserts whatever one insert batch extracted, which with a concurrent
+ingestion pipeline means many small writes, each a round trip and a transaction. The
+``BufferedGraphStore`` wrapper collects ``EntityNode``, ``ChunkNode`` and ``Relation``
+upserts and flushes them when ``batch_size`` items are waiting or ``max_delay`` seconds
+after the first one arrived. Repeated upserts of the same node are coalesced in the buffer.
+
+How a flush is written is up to the writer:
+
+* ``StoreWriter`` hands the whole batch to the wrapped store's own upserts,
+* ``Neo4jBulkWriter`` sends one ``UNWIND`` statement per node label and relation type, with
+  the label/type in the statement instead of an apoc call per row,
+* ``CsvBulkWriter`` appends to CSV files for an initial load with ``LOAD CSV``.
+
+Reads flush first, so the wrapper never hides its own writes. A write that fails leaves
+the batch in the buffer for the next flush. When it failed on the timer thread, the error
+is raised by the next ``upsert_*``, ``flush`` or ``close``, so ingestion cannot end as if
+everything was written. Run this file directly for a writes/second benchmark against an
+in-memory store with simulated round trips.
+"""
+import csv
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from llama_index.core.graph_stores.types import ChunkNode, EntityNode, LabelledNode, PropertyGraphStore, Relation
+
+# Labels Neo4jPGStore puts on every node / every entity
+BASE_NODE_LABEL = "__Node__"
+BASE_ENTITY_LABEL = "__Entity__"
+
+
+def _quote(name: str) -> str:
+    return "`" + name.replace("`", "``") + "`"
+
+
+def _dump(model: Any) -> Dict[str, Any]:
+    return model.model_dump() if hasattr(model, "model_dump") else model.dict()
+
+
+class StoreWriter:
+    """Writes a flush through the wrapped store's upsert_nodes/upsert_relations."""
+
+    def __init__(self, store: PropertyGraphStore):
+        self.store = store
+
+    def write(self, nodes: List[LabelledNode], relations: List[Relation]) -> None:
+        if nodes:
+            self.store.upsert_nodes(nodes)
+        if relations:
+            self.store.upsert_relations(relations)
+
+
+class Neo4jBulkWriter:
+    """One parameterised statement per chunk of each entity label and relation type.
+
+    Writes the same graph as Neo4jPGStore.upsert_nodes/upsert_relations.
+    ``query`` is ``Neo4jPGStore.structured_query`` or anything with the same signature.
+    """
+
+    def __init__(self, query: Callable[..., Any], chunk_size: int = 5000):
+        self.query = query
+        self.chunk_size = chunk_size
+
+    def _run(self, statement: str, rows: List[Dict[str, Any]]) -> None:
+        for start in range(0, len(rows), self.chunk_size):
+            self.query(statement, param_map={"data": rows[start:start + self.chunk_size]})
+
+    def write(self, nodes: List[LabelledNode], relations: List[Relation]) -> None:
+        chunks = [{**_dump(n), "id": n.id} for n in nodes if isinstance(n, ChunkNode)]
+        entities: Dict[str, List[Dict[str, Any]]] = {}
+        for node in nodes:
+            if isinstance(node, EntityNode):
+                entities.setdefault(node.label, []).append({**_dump(node), "id": node.id})
+        by_type: Dict[str, List[Dict[str, Any]]] = {}
+        for relation in relations:
+            by_type.setdefault(relation.label, []).append(_dump(relation))
+
+        if chunks:
+            self._run(f"""
+                UNWIND $data AS row
+                MERGE (c:{BASE_NODE_LABEL} {{id: row.id}})
+                SET c.text = row.text, c:Chunk
+                SET c += row.properties
+                WITH c, row.embedding AS embedding
+                WHERE embedding IS NOT NULL
+                CALL db.create.setNodeVectorProperty(c, 'embedding', embedding)
+                RETURN count(*)
+                """, chunks)
+        for label, rows in entities.items():
+            self._run(f"""
+                UNWIND $data AS row
+                MERGE (e:{BASE_NODE_LABEL} {{id: row.id}})
+                SET e += apoc.map.clean(row.properties, [], [])
+                SET e.name = row.name, e:{BASE_ENTITY_LABEL}:{_quote(label)}
+                WITH e, row
+                CALL (e, row) {{
+                    WITH e, row
+                    WHERE row.embedding IS NOT NULL
+                    CALL db.create.setNodeVectorProperty(e, 'embedding', row.embedding)
+                    RETURN count(*) AS count
+                }}
+                WITH e, row WHERE row.properties.triplet_source_id IS NOT NULL
+                MERGE (c:{BASE_NODE_LABEL} {{id: row.properties.triplet_source_id}})
+                MERGE (e)<-[:MENTIONS]-(c)
+                """, rows)
+        for rel_type, rows in by_type.items():
+            self._run(f"""
+                UNWIND $data AS row
+                MERGE (source:{BASE_NODE_LABEL} {{id: row.source_id}})
+                ON CREATE SET source:Chunk
+                MERGE (target:{BASE_NODE_LABEL} {{id: row.target_id}})
+                ON CREATE SET target:Chunk
+                MERGE (source)-[r:{_quote(rel_type)}]->(target)
+                ON CREATE SET r += row.properties
+                RETURN count(*)
+                """, rows)
+
+
+class CsvBulkWriter:
+    """Appends flushes to CSV files, one per entity label and relation type, for an initial bulk load.
+
+    Properties and embeddings are stored as JSON. Put ``directory`` in (or point it at) the
+    Neo4j import directory and call ``load`` once everything is written.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.files: Dict[Tuple[str, str], str] = {}
+
+    def _append(self, kind: str, name: str, header: List[str], rows: List[List[Any]]) -> None:
+        if (kind, name) not in self.files:
+            # labels can be anything, number the files instead of using them as file names
+            self.files[kind, name] = os.path.join(self.directory, f"{kind}_{len(self.files)}.csv")
+        path = self.files[kind, name]
+        new = not os.path.exists(path)
+        with open(path, "a", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            if new:
+                writer.writerow(header)
+            writer.writerows(rows)
+
+    def write(self, nodes: List[LabelledNode], relations: List[Relation]) -> None:
+        chunks, entities = [], {}
+        for node in nodes:
+            embedding = json.dumps(node.embedding) if node.embedding is not None else ""
+            if isinstance(node, ChunkNode):
+                chunks.append([node.id, node.text, json.dumps(node.properties, default=str), embedding])
+            elif isinstance(node, EntityNode):
+                entities.setdefault(node.label, []).append(
+                    [node.id, node.name, json.dumps(node.properties, default=str), embedding])
+        if chunks:
+            self._append("chunks", "", ["id", "text", "properties", "embedding"], chunks)
+        for label, rows in entities.items():
+            self._append("entities", label, ["id", "name", "properties", "embedding"], rows)
+        by_type: Dict[str, List[List[Any]]] = {}
+        for relation in relations:
+            by_type.setdefault(relation.label, []).append(
+                [relation.source_id, relation.target_id, json.dumps(relation.properties, default=str)])
+        for rel_type, rows in by_type.items():
+            self._append("relations", rel_type, ["source_id", "target_id", "properties"], rows)
+
+    def load(self, query: Callable[..., Any], url_prefix: str = "file:///", rows_per_transaction: int = 10000) -> None:
+        """Runs LOAD CSV for every file written, chunks and entities before relations."""
+        batching = f"IN TRANSACTIONS OF {rows_per_transaction} ROWS"
+        for (kind, name), path in sorted(self.files.items(), key=lambda item: item[0][0] == "relations"):
+            url = url_prefix + os.path.basename(path)
+            if kind == "chunks":
+                body = f"""
+                    MERGE (c:{BASE_NODE_LABEL} {{id: row.id}})
+                    SET c.text = row.text, c:Chunk
+                    SET c += apoc.convert.fromJsonMap(row.properties)
+                    WITH c, row WHERE row.embedding <> ''
+                    CALL db.create.setNodeVectorProperty(c, 'embedding', apoc.convert.fromJsonList(row.embedding))"""
+            elif kind == "entities":
+                body = f"""
+                    MERGE (e:{BASE_NODE_LABEL} {{id: row.id}})
+                    SET e += apoc.convert.fromJsonMap(row.properties)
+                    SET e.name = row.name, e:{BASE_ENTITY_LABEL}:{_quote(name)}
+                    WITH e, row
+                    CALL (e, row) {{
+                        WITH e, row
+                        WHERE row.embedding <> ''
+                        CALL db.create.setNodeVectorProperty(e, 'embedding', apoc.convert.fromJsonList(row.embedding))
+                        RETURN count(*) AS count
+                    }}
+                    WITH e, apoc.convert.fromJsonMap(row.properties).triplet_source_id AS source_id
+                    WHERE source_id IS NOT NULL
+                    MERGE (c:{BASE_NODE_LABEL} {{id: source_id}})
+                    MERGE (e)<-[:MENTIONS]-(c)"""
+            else:
+                body = f"""
+                    MERGE (source:{BASE_NODE_LABEL} {{id: row.source_id}})
+                    ON CREATE SET source:Chunk
+                    MERGE (target:{BASE_NODE_LABEL} {{id: row.target_id}})
+                    ON CREATE SET target:Chunk
+                    MERGE (source)-[r:{_quote(name)}]->(target)
+                    ON CREATE SET r += apoc.convert.fromJsonMap(row.properties)"""
+            query(f"LOAD CSV WITH HEADERS FROM '{url}' AS row CALL (row) {{ {body} }} {batching}")
+
+
+class BufferedGraphStore(PropertyGraphStore):
+    def __init__(self, store: PropertyGraphStore, writer: Any = None,
+                 batch_size: int = 1000, max_delay: Optional[float] = 5.0):
+        self.store = store
+        self.writer = writer if writer is not None else StoreWriter(store)
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.supports_structured_queries = store.supports_structured_queries
+        self.supports_vector_queries = store.supports_vector_queries
+        self.flushes = 0
+        self._nodes: Dict[str, LabelledNode] = {}
+        self._relations: Dict[Tuple[str, str, str], Relation] = {}
+        self._callbacks: List[Callable[[], Any]] = []
+        self._lock = threading.RLock()
+        self._timer: Optional[threading.Timer] = None
+        # a flush on the timer thread failed and nobody has been told yet
+        self._failure: Optional[BaseException] = None
+
+    @property
+    def client(self) -> Any:
+        return self.store.client
+
+    @property
+    def pending(self) -> int:
+        return len(self._nodes) + len(self._relations)
+
+    def _buffered(self) -> None:
+        if self.pending >= self.batch_size:
+            self.flush()
+        elif self.max_delay is not None and self._timer is None:
+            self._timer = threading.Timer(self.max_delay, self._flush_on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def upsert_nodes(self, nodes: Sequence[LabelledNode]) -> None:
+        with self._lock:
+            self._raise_failure()
+            for node in nodes:
+                previous = self._nodes.get(node.id)
+                if previous is not None and type(previous) is type(node):
+                    # same as two SET e += row.properties in a row
+                    update = {"properties": {**previous.properties, **node.properties}}
+                    if node.embedding is None:
+                        update["embedding"] = previous.embedding
+                    node = node.model_copy(update=update) if hasattr(node, "model_copy") else node.copy(update=update)
+                self._nodes[node.id] = node
+            self._buffered()
+
+    def upsert_relations(self, relations: List[Relation]) -> None:
+        with self._lock:
+            self._raise_failure()
+            for relation in relations:
+                # properties are only set when the relation is created, the first upsert wins
+                self._relations.setdefault((relation.label, relation.source_id, relation.target_id), relation)
+            self._buffered()
+
+    def when_flushed(self, callback: Callable[[], Any]) -> None:
+        """Calls ``callback`` once everything upserted so far has been written, e.g. to checkpoint.
+
+        Callbacks run under the store's lock, whichever thread flushes, so they never run at the
+        same time as each other and run in the order they were given.
+        """
+        with self._lock:
+            if self.pending:
+                self._callbacks.append(callback)
+            else:
+                callback()
+
+    def _raise_failure(self) -> None:
+        failure, self._failure = self._failure, None
+        if failure is not None:
+            raise failure
+
+    def _flush_on_timer(self) -> None:
+        try:
+            self.flush()
+        except BaseException as e:
+            # an exception would end with the timer thread, keep it for the caller
+            with self._lock:
+                self._failure = e
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._raise_failure()
+            if not self.pending:
+                return
+            nodes, relations = list(self._nodes.values()), list(self._relations.values())
+            # the lock keeps upserts out until the write is done, and the buffers are only
+            # emptied once it succeeded, so a failed batch is written by the next flush
+            self.writer.write(nodes, relations)
+            callbacks = self._callbacks
+            self._nodes, self._relations, self._callbacks = {}, {}, []
+            self.flushes += 1
+            for callback in callbacks:
+                callback()
+
+    def close(self) -> None:
+        self.flush()
+
+    # ----- reads and deletes see everything written so far -----
+
+    def get(self, properties: Optional[dict] = None, ids: Optional[List[str]] = None) -> List[LabelledNode]:
+        self.flush()
+        return self.store.get(properties=properties, ids=ids)
+
+    def get_triplets(self, entity_names: Optional[List[str]] = None, relation_names: Optional[List[str]] = None,
+                     properties: Optional[dict] = None, ids: Optional[List[str]] = None) -> List[Any]:
+        self.flush()
+        return self.store.get_triplets(entity_names=entity_names, relation_names=relation_names,
+                                       properties=properties, ids=ids)
+
+    def get_rel_map(self, graph_nodes: List[LabelledNode], depth: int = 2, limit: int = 30,
+                    ignore_rels: Optional[List[str]] = None) -> List[Any]:
+        self.flush()
+        return self.store.get_rel_map(graph_nodes, depth=depth, limit=limit, ignore_rels=ignore_rels)
+
+    def delete(self, entity_names: Optional[List[str]] = None, relation_names: Optional[List[str]] = None,
+               properties: Optional[dict] = None, ids: Optional[List[str]] = None) -> None:
+        self.flush()
+        self.store.delete(entity_names=entity_names, relation_names=relation_names, properties=properties, ids=ids)
+
+    def structured_query(self, query: str, param_map: Optional[Dict[str, Any]] = None) -> Any:
+        self.flush()
+        return self.store.structured_query(query, param_map=param_map)
+
+    def vector_query(self, query: Any, **kwargs: Any) -> Tuple[List[LabelledNode], List[float]]:
+        self.flush()
+        return self.store.vector_query(query, **kwargs)
+
+    def get_schema(self, refresh: bool = False) -> Any:
+        return self.store.get_schema(refresh=refresh)
+
+    def persist(self, persist_path: str, fs: Any = None) -> None:
+        self.flush()
+        self.store.persist(persist_path, fs)
+
+
+if __name__ == "__main__":
+    import random
+    import sys
+    import time
+
+    from llama_index.core.graph_stores import SimplePropertyGraphStore
+
+    class RoundTripStore(SimplePropertyGraphStore):
+        """In-memory store that charges a fixed round trip per call plus a small cost per row."""
+
+        round_trip = 0.002
+        per_row = 0.00002
+
+        def upsert_nodes(self, nodes):
+            time.sleep(self.round_trip + self.per_row * len(nodes))
+            super().upsert_nodes(nodes)
+
+        def upsert_relations(self, relations):
+            time.sleep(self.round_trip + self.per_row * len(relations))
+            super().upsert_relations(relations)
+
+    # python buffered_graph_store.py [number of extracted chunks]
+    chunks = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    random.seed(5)
+    names = [f"Entity {i}" for i in range(3000)]
+    calls = []
+    for _ in range(chunks):
+        picked = random.sample(names, 4)
+        nodes = [EntityNode(name=name, label="ORGANIZATION") for name in picked]
+        relations = [Relation(label="PARTNERSHIP", source_id=a, target_id=b) for a, b in zip(picked, picked[1:])]
+        calls.append((nodes, relations))
+    writes = sum(len(n) + len(r) for n, r in calls)
+    print(f"{chunks} extracted chunks, {writes} node/relation upserts")
+
+    for batch_size in (0, 10, 100, 1000, 10000):
+        inner = RoundTripStore()
+        store = inner if batch_size == 0 else BufferedGraphStore(inner, batch_size=batch_size, max_delay=None)
+        start = time.perf_counter()
+        for nodes, relations in calls:
+            store.upsert_nodes(nodes)
+            store.upsert_relations(relations)
+        if batch_size:
+            store.flush()
+        seconds = time.perf_counter() - start
+        label = "unbuffered" if batch_size == 0 else f"batch_size={batch_size}"
+        print(f"{label:18}{seconds:8.2f}s  {writes / seconds:10.0f} writes/s  "
+              f"{len(inner.graph.nodes)} nodes, {len(inner.graph.relations)} relations")
+
+    class FlakyWriter(StoreWriter):
+        """Fails the first ``failures`` writes, like a dropped connection."""
+
+        def __init__(self, store, failures):
+            super().__init__(store)
+            self.failures = failures
+
+        def write(self, nodes, relations):
+            if self.failures:
+                self.failures -= 1
+                raise ConnectionError("connection to the graph store lost")
+            super().write(nodes, relations)
+
+    # a failed flush on the timer thread keeps the batch and fails the next call
+    inner = SimplePropertyGraphStore()
+    store = BufferedGraphStore(inner, writer=FlakyWriter(inner, failures=1), batch_size=100, max_delay=0.05)
+    store.upsert_nodes(calls[0][0])
+    time.sleep(0.3)
+    assert store.pending == len(calls[0][0]) and not inner.graph.nodes
+    try:
+        store.upsert_relations(calls[0][1])
+        raise AssertionError("the timer flush failure was not raised")
+    except ConnectionError as e:
+        print(f"\nafter a failed timer flush: {e!r}, {store.pending} upserts still buffered")
+    store.close()
+    assert len(inner.graph.nodes) == len(calls[0][0]) and store.pending == 0
+
+    # checkpoints taken by sink threads (the pipeline runs its sink with asyncio.to_thread) and by
+    # timer flushes run one at a time, and each thread's in the order it took them
+    store = BufferedGraphStore(SimplePropertyGraphStore(), batch_size=1000, max_delay=0.001)
+    running, overlaps, order = [0], [0], {}
+
+    def checkpoint(thread, n):
+        def callback():
+            running[0] += 1
+            overlaps[0] += running[0] > 1
+            time.sleep(0.0002)
+            order.setdefault(thread, []).append(n)
+            running[0] -= 1
+        return callback
+
+    def sink(thread):
+        for n, (nodes, relations) in enumerate(calls[thread::4]):
+            store.upsert_nodes(nodes)
+            store.upsert_relations(relations)
+            if n % 2:
+                # nothing pending afterwards (unless another thread was quicker): the callback runs right away
+                store.flush()
+            store.when_flushed(checkpoint(thread, n))
+            time.sleep(0.0005 * (n % 3))
+
+    threads = [threading.Thread(target=sink, args=(thread,)) for thread in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    store.close()
+    assert overlaps[0] == 0, f"{overlaps[0]} checkpoints ran at the same time as another"
+    assert all(order[thread] == list(range(len(calls[thread::4]))) for thread in range(4))
+    print(f"{store.flushes} flushes, {len(calls)} checkpoints from 4 threads, one at a time")
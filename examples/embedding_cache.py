@@ -0,0 +1,245 @@
+"""Batched, deduplicated and disk-cached embeddings for graph entities and chunks.
+
+News corpora repeat the same entity names ('Bank of America', 'India', ...) across
+documents, and ``PropertyGraphIndex`` embeds every kg node it upserts. ``CachedEmbedding``
+wraps the configured embed model:
+
+* texts are deduplicated within a batch,
+* texts already embedded (in this run or an earlier one) come from a float32 memory-mapped
+  vector file keyed by a hash of the text,
+* the rest go to the wrapped model in requests packed up to the provider's batch limit.
+
+Run this file directly for a benchmark against a deterministic fake embedding model.
+"""
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+
+# OpenAI accepts up to 2048 inputs and 300k tokens per embeddings request
+PROVIDER_BATCH_LIMIT = 2048
+PROVIDER_TOKEN_LIMIT = 300_000
+DIGEST_SIZE = 16
+
+
+def text_key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=DIGEST_SIZE).digest()
+
+
+class VectorCache:
+    """Append-only vector store on disk: ``vectors.f32`` rows, and ``keys.bin`` text hashes in the same order.
+
+    Vectors are read through a memory map, so opening a cache of millions of vectors only
+    loads the hash index. The vector width is taken from the first write and kept in ``meta.json``.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._vectors_path = os.path.join(path, "vectors.f32")
+        self._keys_path = os.path.join(path, "keys.bin")
+        self._meta_path = os.path.join(path, "meta.json")
+        self._lock = threading.Lock()
+        self._rows: Dict[bytes, int] = {}
+        self._map: Optional[np.memmap] = None
+        self._count = 0
+        self.dimensions: Optional[int] = None
+        if not os.path.exists(self._meta_path):
+            return
+
+        with open(self._meta_path) as f:
+            self.dimensions = json.load(f)["dimensions"]
+        keys = np.fromfile(self._keys_path, dtype=np.uint8) if os.path.exists(self._keys_path) else np.zeros(0, np.uint8)
+        row_bytes = 4 * self.dimensions
+        stored_rows = os.path.getsize(self._vectors_path) // row_bytes if os.path.exists(self._vectors_path) else 0
+        # a crash between the two appends leaves one file longer than the other, trust the shorter one
+        self._count = min(len(keys) // DIGEST_SIZE, stored_rows)
+        for row, key in enumerate(keys[:self._count * DIGEST_SIZE].reshape(-1, DIGEST_SIZE)):
+            self._rows[key.tobytes()] = row
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, key: bytes) -> bool:
+        return key in self._rows
+
+    def _mapped(self) -> np.ndarray:
+        if self._map is None or len(self._map) < self._count:
+            self._map = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(self._count, self.dimensions))
+        return self._map
+
+    def get_many(self, keys: List[bytes]) -> List[Optional[List[float]]]:
+        with self._lock:
+            rows = [self._rows.get(key) for key in keys]
+            if all(row is None for row in rows):
+                return [None] * len(keys)
+            mapped = self._mapped()
+            return [mapped[row].tolist() if row is not None else None for row in rows]
+
+    def put_many(self, keys: List[bytes], vectors: List[List[float]]) -> None:
+        with self._lock:
+            fresh = [(key, vector) for key, vector in zip(keys, vectors) if key not in self._rows]
+            if not fresh:
+                return
+            matrix = np.asarray([vector for _, vector in fresh], dtype=np.float32)
+            if self.dimensions is None:
+                self.dimensions = matrix.shape[1]
+                with open(self._meta_path, "w") as f:
+                    json.dump({"dimensions": self.dimensions, "dtype": "float32"}, f)
+            if matrix.shape[1] != self.dimensions:
+                raise ValueError(f"expected {self.dimensions}-dim vectors, got {matrix.shape[1]}")
+            # vectors first: a crash before the keys are written only leaves unreachable rows
+            with open(self._vectors_path, "ab") as f:
+                matrix.tofile(f)
+            with open(self._keys_path, "ab") as f:
+                f.write(b"".join(key for key, _ in fresh))
+            for key, _ in fresh:
+                self._rows[key] = self._count
+                self._count += 1
+
+
+class CachedEmbedding(BaseEmbedding):
+    """Drop-in ``embed_model`` that dedupes, packs and caches calls to the wrapped model."""
+
+    batch_limit: int = Field(default=PROVIDER_BATCH_LIMIT, description="Most texts sent in one request.")
+    token_limit: int = Field(default=PROVIDER_TOKEN_LIMIT, description="Most (estimated) tokens in one request.")
+
+    _inner: BaseEmbedding = PrivateAttr()
+    _cache: Optional[VectorCache] = PrivateAttr(default=None)
+    _memory: Dict[bytes, List[float]] = PrivateAttr(default_factory=dict)
+    _hits: int = PrivateAttr(default=0)
+    _misses: int = PrivateAttr(default=0)
+
+    def __init__(self, inner: BaseEmbedding, cache_path: Optional[str] = None,
+                 batch_limit: int = PROVIDER_BATCH_LIMIT, token_limit: int = PROVIDER_TOKEN_LIMIT, **kwargs):
+        # The base class splits batches by embed_batch_size before we see them, let whole batches through.
+        # The wrapped model splits by its own embed_batch_size too, give it one >= batch_limit to get full requests.
+        super().__init__(model_name=inner.model_name, batch_limit=batch_limit, token_limit=token_limit,
+                         embed_batch_size=batch_limit, **kwargs)
+        self._inner = inner
+        # without a path, vectors are only remembered for the lifetime of this object
+        self._cache = VectorCache(cache_path) if cache_path is not None else None
+        self._memory = {}
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self._hits, "misses": self._misses,
+                "cached_vectors": len(self._cache) if self._cache is not None else len(self._memory)}
+
+    def _lookup(self, keys: List[bytes]) -> List[Optional[List[float]]]:
+        if self._cache is not None:
+            return self._cache.get_many(keys)
+        return [self._memory.get(key) for key in keys]
+
+    def _remember(self, keys: List[bytes], vectors: List[List[float]]) -> None:
+        if self._cache is not None:
+            self._cache.put_many(keys, vectors)
+        else:
+            self._memory.update(zip(keys, vectors))
+
+    def _plan(self, texts: List[str]):
+        """Unique texts still to embed, and where each input text's vector comes from."""
+        unique: Dict[bytes, str] = {}
+        keys = []
+        for text in texts:
+            key = text_key(text)
+            keys.append(key)
+            unique.setdefault(key, text)
+        unique_keys = list(unique)
+        known = dict(zip(unique_keys, self._lookup(unique_keys)))
+        missing = [key for key in unique_keys if known[key] is None]
+        self._hits += len(unique_keys) - len(missing)
+        self._misses += len(missing)
+        return keys, known, missing, unique
+
+    def _requests(self, missing: List[bytes], unique: Dict[bytes, str]) -> Iterator[List[bytes]]:
+        """Packs the texts to embed into as few requests as the provider limits allow."""
+        batch: List[bytes] = []
+        tokens = 0
+        for key in missing:
+            estimate = len(unique[key]) // 4 + 1
+            if batch and (len(batch) >= self.batch_limit or tokens + estimate > self.token_limit):
+                yield batch
+                batch, tokens = [], 0
+            batch.append(key)
+            tokens += estimate
+        if batch:
+            yield batch
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        keys, known, missing, unique = self._plan(texts)
+        for batch in self._requests(missing, unique):
+            vectors = self._inner.get_text_embedding_batch([unique[key] for key in batch])
+            self._remember(batch, vectors)
+            known.update(zip(batch, vectors))
+        return [known[key] for key in keys]
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        keys, known, missing, unique = self._plan(texts)
+        for batch in self._requests(missing, unique):
+            vectors = await self._inner.aget_text_embedding_batch([unique[key] for key in batch])
+            self._remember(batch, vectors)
+            known.update(zip(batch, vectors))
+        return [known[key] for key in keys]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._inner.get_query_embedding(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return await self._inner.aget_query_embedding(query)
+
+
+if __name__ == "__main__":
+    import random
+    import sys
+    import tempfile
+    import time
+
+    from fakes import FakeEmbedding
+
+    # python embedding_cache.py [number of entity mentions]
+    mentions = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    random.seed(3)
+    # entity names in news follow a long-tailed distribution: a few names are mentioned everywhere
+    vocabulary = [f"Entity {i}" for i in range(5000)]
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    texts = random.choices(vocabulary, weights=weights, k=mentions)
+    # PropertyGraphIndex embeds the kg nodes of one insert batch at a time
+    batches = [texts[i:i + 200] for i in range(0, len(texts), 200)]
+    print(f"{mentions} mentions of {len(set(texts))} distinct names in {len(batches)} batches")
+
+    def run(model, label):
+        start = time.perf_counter()
+        for batch in batches:
+            model.get_text_embedding_batch(batch)
+        print(f"{label:28}{time.perf_counter() - start:8.2f}s")
+
+    plain = FakeEmbedding(dimensions=1536, latency=0.02, embed_batch_size=100)
+    run(plain, "plain")
+    print(f"{'':28}{plain.requests} requests, {plain.texts} texts embedded")
+
+    with tempfile.TemporaryDirectory() as path:
+        inner = FakeEmbedding(dimensions=1536, latency=0.02, embed_batch_size=PROVIDER_BATCH_LIMIT)
+        cached = CachedEmbedding(inner, cache_path=path)
+        run(cached, "cached, first run")
+        print(f"{'':28}{inner.requests} requests, {inner.texts} texts embedded, {cached.stats}")
+
+        inner = FakeEmbedding(dimensions=1536, latency=0.02, embed_batch_size=PROVIDER_BATCH_LIMIT)
+        cached = CachedEmbedding(inner, cache_path=path)
+        run(cached, "cached, second run")
+        print(f"{'':28}{inner.requests} requests, {inner.texts} texts embedded, {cached.stats}")
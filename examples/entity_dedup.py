@@ -0,0 +1,234 @@
+"""In-process entity deduplication for the property graph built in 03_llama_index_kg.py.
+
+The Cypher version in 04_dedepulicating_the_graph.py probes the vector index once per
+entity, merges the similar-node lists with a quadratic ``reduce`` and prunes subsets on
+the server. Here we pull every ``__Entity__`` in one read, find candidate pairs locally
+with a tiled matrix product over the embeddings, and let a union-find build the connected
+components. Every component with more than one name becomes a merge group.
+"""
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from name_matching import names_match, normalize_name
+
+# Same cut-offs the Cypher pipeline used
+SIMILARITY_THRESHOLD = 0.8
+
+# One bulk read instead of one vector index probe per entity.
+# The internal labels (__Entity__, __Node__) are the same for every entity so they are dropped.
+ENTITY_QUERY = """
+MATCH (e:__Entity__)
+RETURN e.name AS name,
+       [l IN labels(e) WHERE NOT l STARTS WITH '__'] AS labels,
+       e.embedding AS embedding
+"""
+
+ENTITY_NAMES_QUERY = """
+MATCH (e:__Entity__)
+RETURN e.name AS name
+"""
+
+ENTITIES_BY_NAME_QUERY = """
+UNWIND $names AS name
+MATCH (e:__Entity__ {name: name})
+RETURN e.name AS name,
+       [l IN labels(e) WHERE NOT l STARTS WITH '__'] AS labels,
+       e.embedding AS embedding
+"""
+
+
+@dataclass
+class Entity:
+    name: str
+    labels: Tuple[str, ...] = ()
+    embedding: Optional[List[float]] = field(default=None, repr=False)
+
+
+class UnionFind:
+    """Disjoint sets over 0..n-1 with union by rank and path halving."""
+
+    def __init__(self, size: int = 0):
+        self.parent = list(range(size))
+        self.rank = [0] * size
+
+    def add(self) -> int:
+        self.parent.append(len(self.parent))
+        self.rank.append(0)
+        return len(self.parent) - 1
+
+    def find(self, x: int) -> int:
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a: int, b: int) -> bool:
+        ra, rb = self.find(a), self.find(b)
+        if ra == rb:
+            return False
+        if self.rank[ra] < self.rank[rb]:
+            ra, rb = rb, ra
+        self.parent[rb] = ra
+        if self.rank[ra] == self.rank[rb]:
+            self.rank[ra] += 1
+        return True
+
+    def groups(self) -> List[List[int]]:
+        components: Dict[int, List[int]] = {}
+        for i in range(len(self.parent)):
+            components.setdefault(self.find(i), []).append(i)
+        return list(components.values())
+
+
+def fetch_entities(driver, names: Optional[Sequence[str]] = None) -> List[Entity]:
+    """Every entity, or only the ones called ``names``, in a single read."""
+    query, params = (ENTITY_QUERY, {}) if names is None else (ENTITIES_BY_NAME_QUERY, {"names": list(names)})
+    with driver.session() as session:
+        result = session.run(query, params)
+        return [Entity(name=record["name"], labels=tuple(sorted(record["labels"] or [])),
+                       embedding=record["embedding"])
+                for record in result]
+
+
+def fetch_entity_names(driver) -> List[str]:
+    with driver.session() as session:
+        return [record["name"] for record in session.run(ENTITY_NAMES_QUERY, {})]
+
+
+def block_by_labels(entities: Sequence[Entity]) -> Dict[Tuple[str, ...], List[int]]:
+    # labels(e) = labels(node) in the Cypher filter, so only entities with the same labels are compared
+    blocks: Dict[Tuple[str, ...], List[int]] = {}
+    for i, entity in enumerate(entities):
+        blocks.setdefault(entity.labels, []).append(i)
+    return blocks
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def embedding_matrix(entities: Sequence[Entity], indices: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+    """Row-normalised float32 embeddings for ``indices``, skipping entities without an embedding."""
+    kept = np.array([i for i in indices if entities[i].embedding is not None], dtype=np.int64)
+    if len(kept) == 0:
+        return np.zeros((0, 0), dtype=np.float32), kept
+    matrix = np.asarray([entities[i].embedding for i in kept], dtype=np.float32)
+    return normalize_rows(matrix), kept
+
+
+def cosine_pairs(matrix: np.ndarray, min_cosine: float, tile_size: int = 2048) -> Iterable[Tuple[int, int]]:
+    """Every (i, j), i < j, with cosine above ``min_cosine``.
+
+    The similarity matrix is computed tile by tile, so memory stays at tile_size x tile_size
+    floats instead of n x n, and only the upper triangle is visited.
+    """
+    n = len(matrix)
+    for row_start in range(0, n, tile_size):
+        rows = matrix[row_start:row_start + tile_size]
+        for col_start in range(row_start, n, tile_size):
+            scores = rows @ matrix[col_start:col_start + tile_size].T
+            i, j = np.nonzero(scores > min_cosine)
+            i += row_start
+            j += col_start
+            upper = j > i
+            yield from zip(i[upper].tolist(), j[upper].tolist())
+
+
+def cross_cosine_pairs(left: np.ndarray, right: np.ndarray, min_cosine: float,
+                       tile_size: int = 2048) -> Iterable[Tuple[int, int]]:
+    """Every (i, j) with cosine(left[i], right[j]) above ``min_cosine``, tile by tile."""
+    for row_start in range(0, len(left), tile_size):
+        rows = left[row_start:row_start + tile_size]
+        for col_start in range(0, len(right), tile_size):
+            scores = rows @ right[col_start:col_start + tile_size].T
+            i, j = np.nonzero(scores > min_cosine)
+            yield from zip((i + row_start).tolist(), (j + col_start).tolist())
+
+
+def embedding_candidate_pairs(entities: Sequence[Entity],
+                              threshold: float = SIMILARITY_THRESHOLD,
+                              tile_size: int = 2048) -> Iterable[Tuple[int, int]]:
+    # db.index.vector.queryNodes reports cosine as (1 + cos) / 2, so "score > 0.8" is cos > 0.6.
+    # Unlike the index probe there is no top-10 cap, every pair above the threshold is returned.
+    min_cosine = 2 * threshold - 1
+    for indices in block_by_labels(entities).values():
+        matrix, kept = embedding_matrix(entities, indices)
+        for a, b in cosine_pairs(matrix, min_cosine, tile_size):
+            yield int(kept[a]), int(kept[b])
+
+
+CandidateFn = Callable[[Sequence[Entity]], Iterable[Tuple[int, int]]]
+
+
+class DedupEngine:
+    def __init__(self,
+                 candidate_fn: CandidateFn = embedding_candidate_pairs,
+                 name_filter: Optional[Callable[[str, str], bool]] = names_match,
+                 collapse_normalized_names: bool = False):
+        # candidate_fn=name_matching.string_candidate_pairs skips embeddings altogether.
+        # collapse_normalized_names merges names that only differ in case or spacing ('FASTag', 'Fastag')
+        # before the embedding stage, which then only sees one representative per name.
+        self.candidate_fn = candidate_fn
+        self.name_filter = name_filter
+        self.collapse_normalized_names = collapse_normalized_names
+
+    def components(self, entities: Sequence[Entity]) -> List[List[int]]:
+        uf = UnionFind(len(entities))
+        representatives = list(range(len(entities)))
+        if self.collapse_normalized_names:
+            representatives = self._collapse(entities, uf)
+
+        subset = entities if len(representatives) == len(entities) else [entities[i] for i in representatives]
+        for a, b in self.candidate_fn(subset):
+            i, j = representatives[a], representatives[b]
+            if self.name_filter is None or self.name_filter(entities[i].name, entities[j].name):
+                uf.union(i, j)
+        return [group for group in uf.groups() if len(group) > 1]
+
+    @staticmethod
+    def _collapse(entities: Sequence[Entity], uf: UnionFind) -> List[int]:
+        chosen: Dict[Tuple[Tuple[str, ...], str], int] = {}
+        for i, entity in enumerate(entities):
+            key = (entity.labels, normalize_name(entity.name))
+            if key not in chosen:
+                chosen[key] = i
+                continue
+            uf.union(chosen[key], i)
+            # keep a representative that has an embedding
+            if entities[chosen[key]].embedding is None and entity.embedding is not None:
+                chosen[key] = i
+        return sorted(chosen.values())
+
+    def merge_plan(self, entities: Sequence[Entity]) -> List[List[str]]:
+        """Groups of names to merge, the longest (most descriptive) name first so it survives the merge."""
+        plan = []
+        for group in self.components(entities):
+            names = sorted({entities[i].name for i in group}, key=lambda n: (-len(n), n))
+            if len(names) > 1:
+                plan.append(names)
+        plan.sort(key=lambda names: names[0])
+        return plan
+
+
+if __name__ == "__main__":
+    from fakes import SAMPLE_MERGE_GROUPS, RecordingDriver, entity_records
+
+    # python entity_dedup.py: the merge plan of a small in-memory graph, no Neo4j needed
+    driver = RecordingDriver(lambda query, params: entity_records())
+    entities = fetch_entities(driver)
+    assert [query for query, _ in driver.statements] == [ENTITY_QUERY]
+    assert len(entities) == len(entity_records())
+    assert (entities[-1].name, entities[-1].labels) == ("Bank of Japan", ("ORGANIZATION",))
+
+    expected = sorted((sorted(names, key=lambda n: (-len(n), n)) for _, names in SAMPLE_MERGE_GROUPS),
+                      key=lambda names: names[0])
+    plan = DedupEngine().merge_plan(entities)
+    assert plan == expected, plan
+    assert DedupEngine(collapse_normalized_names=True).merge_plan(entities) == expected
+    for names in plan:
+        print(names)
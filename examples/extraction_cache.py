@@ -0,0 +1,301 @@
+"""Persistent cache of SchemaLLMPathExtractor results, so re-ingesting does not re-pay for gpt-4o.
+
+The key is a hash of everything that decides what the extractor returns for a chunk: the
+text (with the metadata the LLM sees), the model and its temperature, the prompt, the
+entity/relation schema, the validation schema and the extractor settings. Changing any of
+them misses the cache, while re-running the same ingest (or resuming after a crash) costs
+one SQLite lookup per chunk.
+
+Entries are evicted oldest-access first once the cache is over ``max_bytes``, and dropped
+once older than ``max_age`` seconds.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence
+
+from llama_index.core.graph_stores.types import KG_NODES_KEY, KG_RELATIONS_KEY, ChunkNode, EntityNode, Relation
+from llama_index.core.schema import MetadataMode
+
+
+def _dump(model: Any) -> Dict[str, Any]:
+    return model.model_dump() if hasattr(model, "model_dump") else model.dict()
+
+
+def _schema(cls: Any) -> Any:
+    if cls is None:
+        return None
+    return cls.model_json_schema() if hasattr(cls, "model_json_schema") else cls.schema()
+
+
+def extractor_fingerprint(extractor: Any) -> str:
+    """Everything about the extractor that changes its output, as a stable string."""
+    llm = getattr(extractor, "llm", None)
+    prompt = getattr(extractor, "extract_prompt", None)
+    settings = {
+        "extractor": type(extractor).__name__,
+        "model": getattr(llm, "model", None) or getattr(getattr(llm, "metadata", None), "model_name", None),
+        "temperature": getattr(llm, "temperature", None),
+        "prompt": getattr(prompt, "template", prompt),
+        "schema": _schema(getattr(extractor, "kg_schema_cls", None)),
+        "validation_schema": getattr(extractor, "kg_validation_schema", None),
+        "strict": getattr(extractor, "strict", None),
+        "max_triplets_per_chunk": getattr(extractor, "max_triplets_per_chunk", None),
+        "possible_entity_props": getattr(extractor, "possible_entity_props", None),
+        "possible_relation_props": getattr(extractor, "possible_relation_props", None),
+    }
+    return json.dumps(settings, sort_keys=True, default=str)
+
+
+def serialize_extraction(nodes: Sequence[Any], relations: Sequence[Relation]) -> bytes:
+    payload = {
+        "nodes": [{"kind": "chunk" if isinstance(n, ChunkNode) else "entity", **_dump(n)} for n in nodes],
+        "relations": [_dump(r) for r in relations],
+    }
+    return json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+
+def deserialize_extraction(blob: bytes):
+    payload = json.loads(blob.decode("utf-8"))
+    nodes = []
+    for data in payload["nodes"]:
+        kind = data.pop("kind")
+        nodes.append(ChunkNode(**data) if kind == "chunk" else EntityNode(**data))
+    return nodes, [Relation(**data) for data in payload["relations"]]
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    bytes_read: int = 0
+    bytes_written: int = 0
+    evictions: int = 0
+    entries: int = 0
+    size_bytes: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class ExtractionCache:
+    def __init__(self, path: str = "extraction_cache.sqlite",
+                 max_bytes: Optional[int] = 1 << 30,
+                 max_age: Optional[float] = None):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._stats = CacheStats()
+        self._lock = threading.Lock()
+        # the ingestion pipeline writes from worker threads as well as the event loop
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS extractions (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS extractions_accessed ON extractions (accessed)")
+        self._db.commit()
+        self.expire()
+
+    @staticmethod
+    def key(text: str, fingerprint: str) -> str:
+        return hashlib.sha256(f"{fingerprint}\x00{text}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._db.execute("SELECT value, created FROM extractions WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.max_age is not None and time.time() - row[1] > self.max_age):
+                self._stats.misses += 1
+                return None
+            self._db.execute("UPDATE extractions SET accessed = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            self._stats.hits += 1
+            self._stats.bytes_read += len(row[0])
+            return row[0]
+
+    def put(self, key: str, value: bytes) -> None:
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO extractions VALUES (?, ?, ?, ?, ?)",
+                             (key, value, len(value), now, now))
+            self._db.commit()
+            self._stats.bytes_written += len(value)
+        self._evict()
+
+    def expire(self) -> None:
+        if self.max_age is None:
+            return
+        with self._lock:
+            deleted = self._db.execute("DELETE FROM extractions WHERE created < ?",
+                                       (time.time() - self.max_age,)).rowcount
+            self._db.commit()
+            self._stats.evictions += deleted
+
+    def _evict(self) -> None:
+        if self.max_bytes is None:
+            return
+        with self._lock:
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM extractions").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            # least recently used first, until we are back under the limit
+            for key, size in self._db.execute("SELECT key, size FROM extractions ORDER BY accessed").fetchall():
+                if total <= self.max_bytes:
+                    break
+                self._db.execute("DELETE FROM extractions WHERE key = ?", (key,))
+                total -= size
+                self._stats.evictions += 1
+            self._db.commit()
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM extractions").fetchone()
+        self._stats.entries, self._stats.size_bytes = entries, size
+        return CacheStats(**vars(self._stats))
+
+    def close(self) -> None:
+        self._db.close()
+
+
+class CachedExtractor:
+    """Wraps a kg extractor (e.g. SchemaLLMPathExtractor) and only sends cache misses to it.
+
+    Called like the extractor, ``await cached.acall(nodes)``, as with kg_ingestion.kg_extract in
+    03_llama_index_kg.py. It is not a ``TransformComponent``, so ``PropertyGraphIndex`` does not
+    take it in ``kg_extractors=[...]``.
+    """
+
+    def __init__(self, extractor: Any, cache: ExtractionCache):
+        self.extractor = extractor
+        self.cache = cache
+        self.fingerprint = extractor_fingerprint(extractor)
+
+    def _key(self, node: Any) -> str:
+        metadata = {k: v for k, v in node.metadata.items() if k not in (KG_NODES_KEY, KG_RELATIONS_KEY)}
+        text = node.get_content(metadata_mode=MetadataMode.LLM)
+        # the extractor copies the node metadata into every triplet, so it is part of the key
+        return self.cache.key(text + "\x00" + json.dumps(metadata, sort_keys=True, default=str), self.fingerprint)
+
+    def _lookup(self, nodes: Sequence[Any]):
+        """Fills in the cached nodes and returns the misses, with how many kg nodes/relations they had before."""
+        misses = []
+        for node in nodes:
+            key = self._key(node)
+            kg_nodes = node.metadata.get(KG_NODES_KEY, [])
+            kg_relations = node.metadata.get(KG_RELATIONS_KEY, [])
+            blob = self.cache.get(key)
+            if blob is None:
+                misses.append((node, key, len(kg_nodes), len(kg_relations)))
+                continue
+            cached_nodes, cached_relations = deserialize_extraction(blob)
+            node.metadata[KG_NODES_KEY] = kg_nodes + cached_nodes
+            node.metadata[KG_RELATIONS_KEY] = kg_relations + cached_relations
+        return misses
+
+    def _store(self, misses) -> None:
+        for node, key, nodes_before, relations_before in misses:
+            # only what this extractor added, earlier extractors in the chain have their own entries
+            kg_nodes = node.metadata.get(KG_NODES_KEY, [])[nodes_before:]
+            kg_relations = node.metadata.get(KG_RELATIONS_KEY, [])[relations_before:]
+            # SchemaLLMPathExtractor turns unparsable LLM output into an empty result, do not pin that
+            if kg_nodes or kg_relations:
+                self.cache.put(key, serialize_extraction(kg_nodes, kg_relations))
+
+    def __call__(self, nodes: Sequence[Any], **kwargs: Any) -> List[Any]:
+        misses = self._lookup(nodes)
+        if misses:
+            self.extractor([node for node, *_ in misses], **kwargs)
+            self._store(misses)
+        return list(nodes)
+
+    async def acall(self, nodes: Sequence[Any], **kwargs: Any) -> List[Any]:
+        misses = self._lookup(nodes)
+        if misses:
+            await self.extractor.acall([node for node, *_ in misses], **kwargs)
+            self._store(misses)
+        return list(nodes)
+
+
+if __name__ == "__main__":
+    import asyncio
+    import os
+    import tempfile
+    from typing import Literal
+
+    from llama_index.core.indices.property_graph import SchemaLLMPathExtractor
+    from llama_index.core.schema import TextNode
+
+    from fakes import fake_kg_llm
+
+    # python extraction_cache.py
+    def chunks():
+        return [TextNode(text=f"Velora Logistics signed a partnership with Acme Systems {i} on the new platform.")
+                for i in range(20)]
+
+    def extracted(nodes):
+        return [(sorted(n.name for n in node.metadata[KG_NODES_KEY]),
+                 sorted(r.label for r in node.metadata[KG_RELATIONS_KEY])) for node in nodes]
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "extractions.sqlite")
+        llm = fake_kg_llm()
+        # the fake LLM calls everything an ORGANIZATION in a PARTNERSHIP
+        schema = [("ORGANIZATION", "PARTNERSHIP", "ORGANIZATION")]
+        extractor = SchemaLLMPathExtractor(llm=llm, possible_entities=Literal["ORGANIZATION"],
+                                           possible_relations=Literal["PARTNERSHIP"], kg_validation_schema=schema,
+                                           strict=True)
+        cache = ExtractionCache(path)
+        first = asyncio.run(CachedExtractor(extractor, cache).acall(chunks()))
+        stats = cache.stats()
+        assert (stats.hits, stats.misses, llm.calls) == (0, 20, 20) and extracted(first)[0][0]
+        assert stats.bytes_written == stats.size_bytes and stats.entries == 20
+        cache.close()
+
+        # a rerun, in a new process: every chunk from disk, nothing sent to the LLM, the same graph
+        cache = ExtractionCache(path)
+        second = asyncio.run(CachedExtractor(extractor, cache).acall(chunks()))
+        stats = cache.stats()
+        assert (stats.hits, stats.misses, llm.calls) == (20, 0, 20)
+        assert stats.bytes_read == stats.size_bytes and extracted(second) == extracted(first)
+        # another schema is another key
+        other = SchemaLLMPathExtractor(llm=llm, possible_entities=Literal["ORGANIZATION", "PERSON"],
+                                       possible_relations=Literal["PARTNERSHIP"], kg_validation_schema=schema,
+                                       strict=True)
+        asyncio.run(CachedExtractor(other, cache).acall(chunks()[:1]))
+        assert cache.stats().misses == 1 and llm.calls == 21
+        cache.close()
+        print(f"rerun of 20 chunks: {stats.hits} hits, {stats.bytes_read} bytes read, no LLM calls")
+
+        # over max_bytes, the least recently read entries go first
+        cache = ExtractionCache(os.path.join(directory, "small.sqlite"), max_bytes=300)
+        for key in "abc":
+            cache.put(key, b"x" * 100)
+            time.sleep(0.01)
+        assert cache.get("a") is not None
+        time.sleep(0.01)
+        cache.put("d", b"x" * 100)
+        assert [cache.get(key) is not None for key in "abcd"] == [True, False, True, True]
+        assert cache.stats().evictions == 1 and cache.stats().size_bytes == 300
+        cache.close()
+
+        # older than max_age: a miss, and dropped when the cache is opened again
+        path = os.path.join(directory, "aged.sqlite")
+        cache = ExtractionCache(path, max_age=0.05)
+        cache.put("a", b"x" * 100)
+        assert cache.get("a") is not None
+        time.sleep(0.1)
+        assert cache.get("a") is None
+        cache.close()
+        cache = ExtractionCache(path, max_age=0.05)
+        assert cache.stats().evictions == 1 and cache.stats().entries == 0
+        cache.close()
+        print("eviction by size and by age as configured")
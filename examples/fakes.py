@@ -0,0 +1,282 @@
+"""Deterministic stand-ins for the OpenAI models, for offline runs and benchmarks.
+
+Every call (a whole batch for embeddings) costs ``latency`` seconds (slept asynchronously in the async methods) so
+concurrency and rate limiting behave the way they would against the real API. ``FakeLLM`` can add up to ``jitter``
+seconds more per call, derived from the prompt, so concurrent calls finish in a realistic, repeatable order.
+Its streams yield a word at a time, the first after the call's latency and each further one ``token_latency``
+seconds later. Calls that do not stream take as long as the whole stream would.
+
+``RecordingDriver`` stands in for a Neo4j driver: it keeps every statement its sessions run, with the parameters,
+and answers each with the records its ``responder`` returns, or the error it raises. ``entity_records`` is a small
+graph of ``__Entity__`` rows in the shape ``entity_dedup.ENTITY_QUERY`` returns, whose duplicates are
+``SAMPLE_MERGE_GROUPS``.
+"""
+import asyncio
+import hashlib
+import json
+import re
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from llama_index.core.base.llms.types import (CompletionResponse, CompletionResponseAsyncGen, CompletionResponseGen,
+                                              LLMMetadata)
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.llms import CustomLLM
+from llama_index.core.llms.callbacks import llm_completion_callback
+
+
+class FakeRateLimitError(Exception):
+    """Raised by the first ``failures`` calls, like a 429 from the provider."""
+
+
+def echo_response(prompt: str) -> str:
+    return f"answer to: {prompt.strip()[-200:]}"
+
+
+_CAPITALISED = re.compile(r"\b[A-Z][a-zA-Z0-9&.-]+(?: [A-Z][a-zA-Z0-9&.-]+)*")
+
+
+def kg_triplets_response(prompt: str, max_triplets: int = 10) -> str:
+    """JSON the schema extractor can parse: consecutive capitalised phrases become related organisations."""
+    # the default extraction prompt fences the chunk text with -------
+    parts = prompt.split("-------")
+    text = parts[1] if len(parts) > 2 else prompt
+    names = list(dict.fromkeys(name.rstrip(".") for name in _CAPITALISED.findall(text)))
+    triplets = [{"subject": {"type": "ORGANIZATION", "name": a},
+                 "relation": {"type": "PARTNERSHIP"},
+                 "object": {"type": "ORGANIZATION", "name": b}}
+                for a, b in zip(names, names[1:])][:max_triplets]
+    return json.dumps({"triplets": triplets})
+
+
+class FakeLLM(CustomLLM):
+    latency: float = Field(default=0.0, description="Seconds every call takes.")
+    jitter: float = Field(default=0.0, description="Up to this many extra seconds per call, fixed for each prompt.")
+    token_latency: float = Field(default=0.0, description="Seconds between the words of a streamed response.")
+    failures: int = Field(default=0, description="Number of initial calls that raise FakeRateLimitError.")
+    model_name: str = Field(default="fake-llm")
+    responder: Callable[[str], str] = Field(default=echo_response, exclude=True)
+
+    _calls: int = PrivateAttr(default=0)
+
+    @property
+    def calls(self) -> int:
+        return self._calls
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name=self.model_name, num_output=256, context_window=128000)
+
+    def _delay(self, prompt: str) -> float:
+        if not self.jitter:
+            return self.latency
+        fraction = int.from_bytes(hashlib.blake2b(prompt.encode("utf-8"), digest_size=4).digest(), "little") / 2 ** 32
+        return self.latency + self.jitter * fraction
+
+    def _generation(self, response: CompletionResponse) -> float:
+        # the words after the first, at token_latency each
+        return self.token_latency * response.text.count(" ")
+
+    def _respond(self, prompt: str) -> CompletionResponse:
+        self._calls += 1
+        if self._calls <= self.failures:
+            raise FakeRateLimitError(f"call {self._calls} rate limited")
+        text = self.responder(prompt)
+        # token counts where the OpenAI LLM puts them, at roughly 4 characters a token
+        return CompletionResponse(text=text, additional_kwargs={"prompt_tokens": len(prompt) // 4,
+                                                                "completion_tokens": len(text) // 4})
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        time.sleep(self._delay(prompt))
+        response = self._respond(prompt)
+        time.sleep(self._generation(response))
+        return response
+
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        await asyncio.sleep(self._delay(prompt))
+        response = self._respond(prompt)
+        await asyncio.sleep(self._generation(response))
+        return response
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        time.sleep(self._delay(prompt))
+        response = self._respond(prompt)
+
+        def gen() -> CompletionResponseGen:
+            text = ""
+            for word in response.text.split(" "):
+                delta = word if not text else " " + word
+                text += delta
+                if text != delta:
+                    time.sleep(self.token_latency)
+                yield CompletionResponse(text=text, delta=delta)
+
+        return gen()
+
+    @llm_completion_callback()
+    async def astream_complete(self, prompt: str, formatted: bool = False,
+                               **kwargs: Any) -> CompletionResponseAsyncGen:
+        await asyncio.sleep(self._delay(prompt))
+        response = self._respond(prompt)
+
+        async def gen() -> CompletionResponseAsyncGen:
+            text = ""
+            for word in response.text.split(" "):
+                delta = word if not text else " " + word
+                text += delta
+                if text != delta:
+                    await asyncio.sleep(self.token_latency)
+                yield CompletionResponse(text=text, delta=delta, additional_kwargs=response.additional_kwargs)
+
+        return gen()
+
+
+def fake_kg_llm(latency: float = 0.0, failures: int = 0) -> FakeLLM:
+    return FakeLLM(latency=latency, failures=failures, responder=kg_triplets_response)
+
+
+class FakeEmbedding(BaseEmbedding):
+    """Unit vectors seeded from a hash of the text, so the same text always gets the same vector."""
+
+    dimensions: int = Field(default=1536)
+    latency: float = Field(default=0.0, description="Seconds every request takes, whatever the batch size.")
+
+    _requests: int = PrivateAttr(default=0)
+    _texts: int = PrivateAttr(default=0)
+
+    @property
+    def requests(self) -> int:
+        return self._requests
+
+    @property
+    def texts(self) -> int:
+        return self._texts
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimensions).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        self._requests += 1
+        self._texts += len(texts)
+        time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        self._requests += 1
+        self._texts += len(texts)
+        await asyncio.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._get_text_embedding(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return await self._aget_text_embedding(query)
+
+
+class FakeResult:
+    def __init__(self, records: List[Dict[str, Any]]):
+        self.records = records
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(self.records)
+
+    def single(self) -> Optional[Dict[str, Any]]:
+        return self.records[0] if self.records else None
+
+    def values(self) -> List[List[Any]]:
+        return [list(record.values()) for record in self.records]
+
+
+class RecordingSession:
+    def __init__(self, driver: "RecordingDriver"):
+        self.driver = driver
+
+    def __enter__(self) -> "RecordingSession":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        return None
+
+    def run(self, query: str, parameters: Optional[Dict[str, Any]] = None, **kwargs: Any) -> FakeResult:
+        parameters = {**(parameters or {}), **kwargs}
+        self.driver.statements.append((query, parameters))
+        return FakeResult(list(self.driver.responder(query, parameters)))
+
+    def close(self) -> None:
+        return None
+
+
+class RecordingDriver:
+    """``driver.session().run(query, parameters)`` without a database. ``statements`` lists every call in order."""
+
+    def __init__(self, responder: Callable[[str, Dict[str, Any]], List[Dict[str, Any]]] = lambda query, params: []):
+        self.responder = responder
+        self.statements: List[Tuple[str, Dict[str, Any]]] = []
+        self.sessions = 0
+
+    def session(self, **kwargs: Any) -> RecordingSession:
+        self.sessions += 1
+        return RecordingSession(self)
+
+    def close(self) -> None:
+        return None
+
+
+# The groups the Cypher dedup found in the news graph, see 04_dedepulicating_the_graph.py
+SAMPLE_MERGE_GROUPS = [
+    (("ORGANIZATION",), ["Epic", "Epic Games"]),
+    (("ORGANIZATION",), ["Bank of America", "Bank of America Corp."]),
+    (("PRODUCT",), ["Star Ocean: The Second Story R", "Star Ocean: The Second Story R logos"]),
+    (("EVENT",), ["logo leak", "logo leaked"]),
+    (("PRODUCT",), ["Star Ocean: First Departure", "Star Ocean: First Departure R"]),
+    (("URL",), ["support.na.square-enix.com/images/title_banner/title_banner_19285.jpg",
+                "support.na.square-enix.com/images/title_banner/title_banner_19288.jpg"]),
+    (("PRODUCT",), ["FASTag", "Fastag"]),
+    (("ID",), ["333-228379", "333-228379-04"]),
+]
+
+
+def entity_records(dimensions: int = 64, seed: int = 7) -> List[Dict[str, Any]]:
+    """``SAMPLE_MERGE_GROUPS`` as entity rows, with entities that must stay apart.
+
+    The names of a group share an embedding up to a little noise. Next to them: a name with
+    an embedding close to "Epic" that does not match it, a matching name under another label, an entity
+    without an embedding, and unrelated entities.
+    """
+    rng = np.random.default_rng(seed)
+
+    def near(base: np.ndarray) -> List[float]:
+        return (base + 0.2 * rng.standard_normal(dimensions) / np.sqrt(dimensions)).tolist()
+
+    def unit() -> np.ndarray:
+        vector = rng.standard_normal(dimensions)
+        return vector / np.linalg.norm(vector)
+
+    records = []
+    bases = {}
+    for labels, names in SAMPLE_MERGE_GROUPS:
+        bases[names[0]] = base = unit()
+        records += [{"name": name, "labels": list(labels), "embedding": near(base)} for name in names]
+    records += [
+        {"name": "Square Enix", "labels": ["ORGANIZATION"], "embedding": near(bases["Epic"])},
+        {"name": "Epic Games Store", "labels": ["PRODUCT"], "embedding": near(bases["Epic"])},
+        {"name": "Bank of America Corp", "labels": ["ORGANIZATION"], "embedding": None},
+        {"name": "Nintendo", "labels": ["ORGANIZATION"], "embedding": unit().tolist()},
+        {"name": "Bank of Japan", "labels": ["ORGANIZATION"], "embedding": unit().tolist()},
+    ]
+    return records
@@ -0,0 +1,556 @@
+"""Entity kNN plus k-hop expansion over the graph store, with expanded neighbourhoods cached.
+
+``CachedGraphRetriever`` is a property graph sub-retriever, like ``VectorContextRetriever``:
+
+* the seeds are the ``similarity_top_k`` entities closest to the query (``vector_query``),
+* each seed is expanded ``path_depth`` hops in both directions, following at most
+  ``max_fanout`` new relations per node and hop, so a hub does not pull in the whole graph,
+* the seeds that are not cached are expanded together, in one round trip for every hop. On
+  Neo4j that is one statement that applies the fan-out cap on every hop (``expand_query``). A
+  store with ``expand_incident`` (``LocalPropertyGraphStore``) is asked for the capped
+  relations in one call too, any other gets one ``get_rel_map`` call for all the seeds,
+* the expanded neighbourhoods are kept in a ``NeighbourhoodCache`` (LRU), so a popular entity
+  costs the vector query only.
+
+A neighbourhood is dropped from the cache when any node in it is upserted, deleted or merged,
+or when a relation touching one of them is upserted. This relies on the writes going through
+a ``CacheInvalidatingStore``. Writes from another process do not, e.g. the merges of
+04_dedepulicating_the_graph.py. For those, set ``max_age`` or call ``cache.clear()``.
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Sequence, Set, Tuple
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.graph_stores.types import EntityNode, LabelledNode, PropertyGraphStore, Relation, Triplet
+from llama_index.core.indices.property_graph import BasePGRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.settings import Settings
+from llama_index.core.vector_stores.types import MetadataFilters, VectorStoreQuery
+
+from buffered_graph_store import BASE_ENTITY_LABEL, BASE_NODE_LABEL
+
+
+
+def expand_query(depth: int) -> str:
+    """``depth`` hops from every node in ``$ids``, both directions, entity to entity, in one statement.
+
+    Each hop's subquery stops after ``$fanout`` relations of a node, so a hub is not read in
+    full. The nodes of the next hop are the ones reached that were not expanded yet. Every row
+    is one relation of an expanded ``node``, triplet fields as in ``Neo4jPGStore.get_triplets``.
+    """
+    hop = f"""
+CALL (frontier) {{
+  UNWIND frontier AS n
+  CALL (n) {{
+    MATCH (n)-[r]-(m:`{BASE_ENTITY_LABEL}`)
+    RETURN r, m
+    LIMIT $fanout
+  }}
+  RETURN collect({{node: n.id, r: r}}) AS found, collect(DISTINCT m) AS reached
+}}
+WITH rels + found AS rels, [m IN reached WHERE NOT m IN seen] AS frontier, seen
+WITH rels, frontier, seen + frontier AS seen"""
+    return f"""
+UNWIND $ids AS id
+MATCH (e:`{BASE_ENTITY_LABEL}` {{id: id}})
+WITH collect(DISTINCT e) AS frontier
+WITH frontier, frontier AS seen, [] AS rels{hop * depth}
+UNWIND rels AS row
+WITH row.node AS node, row.r AS r, startNode(row.r) AS s, endNode(row.r) AS t
+RETURN node, s.name AS source_id, [l in labels(s) WHERE NOT l IN ['{BASE_ENTITY_LABEL}', '{BASE_NODE_LABEL}'] | l][0] AS source_type,
+       s{{.*, embedding: Null, name: Null}} AS source_properties,
+       type(r) AS type, r{{.*}} AS rel_properties,
+       t.name AS target_id, [l in labels(t) WHERE NOT l IN ['{BASE_ENTITY_LABEL}', '{BASE_NODE_LABEL}'] | l][0] AS target_type,
+       t{{.*, embedding: Null, name: Null}} AS target_properties
+"""
+
+
+def _key(triplet: Triplet) -> Tuple[str, str, str]:
+    return triplet[0].id, triplet[1].label, triplet[2].id
+
+
+def _non_empty(properties: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    return {k: v for k, v in (properties or {}).items() if v}
+
+
+def _record_triplet(record: Dict[str, Any]) -> Triplet:
+    source = EntityNode(name=record["source_id"], label=record["source_type"],
+                        properties=_non_empty(record["source_properties"]))
+    target = EntityNode(name=record["target_id"], label=record["target_type"],
+                        properties=_non_empty(record["target_properties"]))
+    relation = Relation(source_id=record["source_id"], target_id=record["target_id"], label=record["type"],
+                        properties=_non_empty(record["rel_properties"]))
+    return source, relation, target
+
+
+class NeighbourhoodCache:
+    def __init__(self, capacity: int = 1024, max_age: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.capacity = capacity
+        self.max_age = max_age
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # bumped by every invalidation, see put()
+        self.generation = 0
+        self._entries: "OrderedDict[Hashable, Tuple[List[Tuple[Triplet, int]], Set[str], float]]" = OrderedDict()
+        # node id -> keys of the cached neighbourhoods it is in
+        self._containing: Dict[str, Set[Hashable]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[List[Tuple[Triplet, int]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.max_age is not None and self.clock() - entry[2] > self.max_age:
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, triplets: List[Tuple[Triplet, int]], nodes: Set[str], generation: int) -> None:
+        """Caches a neighbourhood expanded from the store when ``generation`` was current.
+
+        It is not cached when something was invalidated in the meantime: the expansion may have
+        read the store before that write.
+        """
+        with self._lock:
+            if generation != self.generation:
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (triplets, nodes, self.clock())
+            for node in nodes:
+                self._containing.setdefault(node, set()).add(key)
+            while len(self._entries) > self.capacity:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key: Hashable) -> None:
+        _, nodes, _ = self._entries.pop(key)
+        for node in nodes:
+            keys = self._containing.get(node)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._containing[node]
+
+    def invalidate(self, ids: Iterable[str]) -> int:
+        """Drops every neighbourhood containing one of the nodes, returns how many."""
+        with self._lock:
+            self.generation += 1
+            keys = set()
+            for node in ids:
+                keys |= self._containing.get(node, set())
+            for key in keys:
+                self._drop(key)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._containing.clear()
+
+    def stats(self) -> str:
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups if lookups else 0.0
+        return (f"neighbourhood cache: {len(self)}/{self.capacity} cached, {self.hits}/{lookups} hits ({rate:.0%}), "
+                f"{self.evictions} evicted, {self.invalidations} invalidated")
+
+
+class CacheInvalidatingStore(PropertyGraphStore):
+    """Passes everything through to ``store``, invalidating the cached neighbourhoods a write changes."""
+
+    def __init__(self, store: PropertyGraphStore, cache: NeighbourhoodCache):
+        self.store = store
+        self.cache = cache
+        self.supports_structured_queries = store.supports_structured_queries
+        self.supports_vector_queries = store.supports_vector_queries
+
+    def __getattr__(self, name: str) -> Any:
+        # flush(), when_flushed(), ... of the wrapped store
+        if name == "store":
+            raise AttributeError(name)
+        return getattr(self.store, name)
+
+    @property
+    def client(self) -> Any:
+        return self.store.client
+
+    def upsert_nodes(self, nodes: Sequence[LabelledNode]) -> None:
+        self.store.upsert_nodes(nodes)
+        self.cache.invalidate(node.id for node in nodes)
+
+    def upsert_relations(self, relations: List[Relation]) -> None:
+        self.store.upsert_relations(relations)
+        self.cache.invalidate({node for r in relations for node in (r.source_id, r.target_id)})
+
+    def delete(self, entity_names: Optional[List[str]] = None, relation_names: Optional[List[str]] = None,
+               properties: Optional[dict] = None, ids: Optional[List[str]] = None) -> None:
+        self.store.delete(entity_names=entity_names, relation_names=relation_names, properties=properties, ids=ids)
+        if relation_names or properties:
+            # which nodes that touched is not known without asking the store
+            self.cache.clear()
+        else:
+            # entity ids are their names
+            self.cache.invalidate([*(entity_names or ()), *(ids or ())])
+
+    def merge_nodes(self, groups: Iterable[Sequence[str]]) -> int:
+        groups = [list(group) for group in groups]
+        merged = self.store.merge_nodes(groups)
+        self.cache.invalidate(name for group in groups for name in group)
+        return merged
+
+    def get(self, properties: Optional[dict] = None, ids: Optional[List[str]] = None) -> List[LabelledNode]:
+        return self.store.get(properties=properties, ids=ids)
+
+    def get_triplets(self, entity_names: Optional[List[str]] = None, relation_names: Optional[List[str]] = None,
+                     properties: Optional[dict] = None, ids: Optional[List[str]] = None) -> List[Triplet]:
+        return self.store.get_triplets(entity_names=entity_names, relation_names=relation_names,
+                                       properties=properties, ids=ids)
+
+    def get_rel_map(self, graph_nodes: List[LabelledNode], depth: int = 2, limit: int = 30,
+                    ignore_rels: Optional[List[str]] = None) -> List[Triplet]:
+        return self.store.get_rel_map(graph_nodes, depth=depth, limit=limit, ignore_rels=ignore_rels)
+
+    def structured_query(self, query: str, param_map: Optional[Dict[str, Any]] = None) -> Any:
+        # writes made with Cypher are not seen, like the ones from another process
+        return self.store.structured_query(query, param_map=param_map)
+
+    def vector_query(self, query: Any, **kwargs: Any) -> Tuple[List[LabelledNode], List[float]]:
+        return self.store.vector_query(query, **kwargs)
+
+    def get_schema(self, refresh: bool = False) -> Any:
+        return self.store.get_schema(refresh=refresh)
+
+    def persist(self, persist_path: str, fs: Any = None) -> None:
+        self.store.persist(persist_path, fs)
+
+
+class _Expansion:
+    """Breadth-first expansion of several seeds at once, over the relations of each node the store returned."""
+
+    def __init__(self, seeds: Sequence[str], max_fanout: Optional[int]):
+        self.max_fanout = max_fanout
+        self.nodes = {seed: {seed} for seed in seeds}
+        self.triplets: Dict[str, Dict[Tuple[str, str, str], Tuple[Triplet, int]]] = {seed: {} for seed in seeds}
+        self.frontiers = {seed: [seed] for seed in seeds}
+        self.hop = 0
+
+    @staticmethod
+    def incident(triplets: Iterable[Triplet]) -> Dict[str, List[Triplet]]:
+        """Node id -> relations, for a store that returns a flat list of triplets (``get_rel_map``)."""
+        incident: Dict[str, List[Triplet]] = {}
+        for triplet in triplets:
+            # some stores also return the relations of chunks (SOURCE, MENTIONS), only entities are expanded
+            if not (isinstance(triplet[0], EntityNode) and isinstance(triplet[2], EntityNode)):
+                continue
+            incident.setdefault(triplet[0].id, []).append(triplet)
+            if triplet[2].id != triplet[0].id:
+                incident.setdefault(triplet[2].id, []).append(triplet)
+        return incident
+
+    def expand(self, incident: Dict[str, List[Triplet]], depth: int) -> None:
+        for _ in range(depth):
+            if not any(self.frontiers.values()):
+                break
+            self.add(incident)
+
+    def add(self, incident: Dict[str, List[Triplet]]) -> None:
+        """One hop from every seed's frontier."""
+        self.hop += 1
+        for seed, frontier in self.frontiers.items():
+            nodes, found, reached = self.nodes[seed], self.triplets[seed], []
+            for node in frontier:
+                taken = 0
+                for triplet in incident.get(node, ()):
+                    key = _key(triplet)
+                    if key in found:
+                        continue
+                    if self.max_fanout is not None and taken >= self.max_fanout:
+                        break
+                    taken += 1
+                    found[key] = (triplet, self.hop)
+                    other = triplet[2].id if triplet[0].id == node else triplet[0].id
+                    if other not in nodes:
+                        nodes.add(other)
+                        reached.append(other)
+            self.frontiers[seed] = reached
+
+    def result(self, seed: str) -> Tuple[List[Tuple[Triplet, int]], Set[str]]:
+        return list(self.triplets[seed].values()), self.nodes[seed]
+
+
+class CachedGraphRetriever(BasePGRetriever):
+    """
+    Retrieves the relations around the entities closest to the query, caching each entity's neighbourhood.
+
+    Args:
+        graph_store (PropertyGraphStore):
+            The graph store, it has to support vector queries.
+        embed_model (Optional[BaseEmbedding], optional):
+            Embeds the query. Defaults to Settings.embed_model.
+        similarity_top_k (int, optional):
+            The number of seed entities. Defaults to 4.
+        path_depth (int, optional):
+            How many hops to expand from each seed. Defaults to 2.
+        max_fanout (Optional[int], optional):
+            The most relations followed from one node per hop, None for all. Defaults to 5.
+        limit (int, optional):
+            The most triplets returned. Defaults to 30.
+        similarity_score (Optional[float], optional):
+            Seeds scoring below it are not expanded. Defaults to None.
+        cache (Optional[NeighbourhoodCache], optional):
+            Shared with the ``CacheInvalidatingStore`` the index writes through. Defaults to a new one.
+        cypher_expansion (Optional[bool], optional):
+            Expand with ``expand_query`` instead of the store's methods.
+            Defaults to whether the store supports structured queries.
+
+    """
+
+    def __init__(
+        self,
+        graph_store: PropertyGraphStore,
+        embed_model: Optional[BaseEmbedding] = None,
+        similarity_top_k: int = 4,
+        path_depth: int = 2,
+        max_fanout: Optional[int] = 5,
+        limit: int = 30,
+        similarity_score: Optional[float] = None,
+        filters: Optional[MetadataFilters] = None,
+        cache: Optional[NeighbourhoodCache] = None,
+        cypher_expansion: Optional[bool] = None,
+        include_text: bool = True,
+        **kwargs: Any,
+    ) -> None:
+        if not graph_store.supports_vector_queries:
+            raise ValueError("CachedGraphRetriever needs a graph store that supports vector queries.")
+        self._embed_model = embed_model or Settings.embed_model
+        self._similarity_top_k = similarity_top_k
+        self._path_depth = path_depth
+        self._max_fanout = max_fanout
+        self._limit = limit
+        self._similarity_score = similarity_score
+        self._filters = filters
+        self.cache = cache if cache is not None else NeighbourhoodCache()
+        if cypher_expansion is None:
+            cypher_expansion = graph_store.supports_structured_queries
+        self._cypher_expansion = cypher_expansion and max_fanout is not None
+        self._expand_query = expand_query(path_depth)
+        super().__init__(graph_store=graph_store, include_text=include_text, **kwargs)
+
+    def _cache_key(self, seed: str) -> Hashable:
+        return seed, self._path_depth, self._max_fanout
+
+    def _vector_store_query(self, query_bundle: QueryBundle) -> VectorStoreQuery:
+        return VectorStoreQuery(query_embedding=query_bundle.embedding, similarity_top_k=self._similarity_top_k,
+                                filters=self._filters)
+
+    def _seeds(self, result: Tuple[List[LabelledNode], List[float]]) -> List[Tuple[str, float]]:
+        nodes, scores = result
+        return [(node.id, score) for node, score in zip(nodes, scores)
+                if self._similarity_score is None or score >= self._similarity_score]
+
+    def _lookup(self, seeds: List[Tuple[str, float]]) -> Tuple[Dict[str, List[Tuple[Triplet, int]]], List[str]]:
+        cached, missing = {}, []
+        for seed, _ in seeds:
+            triplets = self.cache.get(self._cache_key(seed))
+            if triplets is None:
+                missing.append(seed)
+            else:
+                cached[seed] = triplets
+        return cached, missing
+
+    def _expand_params(self, seeds: List[str]) -> Dict[str, Any]:
+        # one more than the cap, the relation back to where the node was reached from is in there too
+        return {"ids": seeds, "fanout": self._max_fanout + 1}
+
+    @staticmethod
+    def _records_incident(records: Optional[List[Dict[str, Any]]]) -> Dict[str, List[Triplet]]:
+        incident: Dict[str, List[Triplet]] = {}
+        for record in records or ():
+            incident.setdefault(record["node"], []).append(_record_triplet(record))
+        return incident
+
+    def _rel_map_nodes(self, seeds: List[str]) -> List[LabelledNode]:
+        # entity ids are their names
+        return [EntityNode(name=seed) for seed in seeds]
+
+    def _rel_map_limit(self, seeds: List[str]) -> int:
+        return len(seeds) * self._limit
+
+    def _incident(self, seeds: List[str]) -> Dict[str, List[Triplet]]:
+        """The relations of every node within ``path_depth`` hops of the seeds, in one round trip."""
+        if self._cypher_expansion:
+            return self._records_incident(
+                self._graph_store.structured_query(self._expand_query, param_map=self._expand_params(seeds)))
+        if self._max_fanout is not None and hasattr(self._graph_store, "expand_incident"):
+            return self._graph_store.expand_incident(seeds, self._path_depth, limit=self._max_fanout + 1)
+        return _Expansion.incident(self._graph_store.get_rel_map(
+            self._rel_map_nodes(seeds), depth=self._path_depth, limit=self._rel_map_limit(seeds)))
+
+    async def _aincident(self, seeds: List[str]) -> Dict[str, List[Triplet]]:
+        if self._cypher_expansion:
+            return self._records_incident(await self._graph_store.astructured_query(
+                self._expand_query, param_map=self._expand_params(seeds)))
+        if self._max_fanout is not None and hasattr(self._graph_store, "expand_incident"):
+            # a synchronous store method, kept off the event loop
+            return await asyncio.to_thread(self._graph_store.expand_incident, seeds, self._path_depth,
+                                           limit=self._max_fanout + 1)
+        return _Expansion.incident(await self._graph_store.aget_rel_map(
+            self._rel_map_nodes(seeds), depth=self._path_depth, limit=self._rel_map_limit(seeds)))
+
+    def _store(self, expansion: _Expansion, generation: int) -> Dict[str, List[Tuple[Triplet, int]]]:
+        expanded = {}
+        for seed in expansion.nodes:
+            triplets, nodes = expansion.result(seed)
+            self.cache.put(self._cache_key(seed), triplets, nodes, generation)
+            expanded[seed] = triplets
+        return expanded
+
+    def _rank(self, seeds: List[Tuple[str, float]], neighbourhoods: Dict[str, List[Tuple[Triplet, int]]],
+              limit: int) -> List[NodeWithScore]:
+        # every triplet scores as the best seed it was reached from, nearer hops first
+        best: Dict[Tuple[str, str, str], Tuple[float, int, Triplet]] = {}
+        for seed, score in seeds:
+            for triplet, hop in neighbourhoods[seed]:
+                key = _key(triplet)
+                if key not in best or (score, -hop) > (best[key][0], -best[key][1]):
+                    best[key] = (score, hop, triplet)
+        ranked = sorted(best.values(), key=lambda x: (-x[0], x[1]))[:limit]
+        return self._get_nodes_with_score([x[2] for x in ranked], [x[0] for x in ranked])
+
+    def retrieve_from_graph(self, query_bundle: QueryBundle, limit: Optional[int] = None) -> List[NodeWithScore]:
+        if query_bundle.embedding is None:
+            query_bundle.embedding = self._embed_model.get_agg_embedding_from_queries(query_bundle.embedding_strs)
+        seeds = self._seeds(self._graph_store.vector_query(self._vector_store_query(query_bundle)))
+        neighbourhoods, missing = self._lookup(seeds)
+        if missing:
+            generation = self.cache.generation
+            expansion = _Expansion(missing, self._max_fanout)
+            expansion.expand(self._incident(missing), self._path_depth)
+            neighbourhoods.update(self._store(expansion, generation))
+        return self._rank(seeds, neighbourhoods, limit or self._limit)
+
+    async def aretrieve_from_graph(self, query_bundle: QueryBundle,
+                                   limit: Optional[int] = None) -> List[NodeWithScore]:
+        if query_bundle.embedding is None:
+            query_bundle.embedding = await self._embed_model.aget_agg_embedding_from_queries(
+                query_bundle.embedding_strs)
+        seeds = self._seeds(await self._graph_store.avector_query(self._vector_store_query(query_bundle)))
+        neighbourhoods, missing = self._lookup(seeds)
+        if missing:
+            generation = self.cache.generation
+            expansion = _Expansion(missing, self._max_fanout)
+            expansion.expand(await self._aincident(missing), self._path_depth)
+            neighbourhoods.update(self._store(expansion, generation))
+        return self._rank(seeds, neighbourhoods, limit or self._limit)
+
+
+if __name__ == "__main__":
+    import random
+    import sys
+    from collections import Counter
+
+    import numpy as np
+    from llama_index.core.indices.property_graph import VectorContextRetriever
+
+    from fakes import FakeEmbedding
+    from local_graph_store import LocalPropertyGraphStore
+
+    class RoundTripStore(LocalPropertyGraphStore):
+        """Local store that charges a fixed round trip per read, like a remote Neo4j."""
+
+        round_trip = 0.003
+
+        def get_triplets(self, *args, **kwargs):
+            time.sleep(self.round_trip)
+            return super().get_triplets(*args, **kwargs)
+
+        def expand_incident(self, *args, **kwargs):
+            time.sleep(self.round_trip)
+            return super().expand_incident(*args, **kwargs)
+
+        def get_rel_map(self, *args, **kwargs):
+            time.sleep(self.round_trip)
+            return super().get_rel_map(*args, **kwargs)
+
+        def vector_query(self, *args, **kwargs):
+            time.sleep(self.round_trip)
+            return super().vector_query(*args, **kwargs)
+
+    # python graph_retriever.py [number of entities] [number of queries]
+    entities = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    queries = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    dimensions = 64
+    random.seed(14)
+    rng = np.random.default_rng(14)
+    names = [f"Entity {i}" for i in range(entities)]
+    vectors = rng.standard_normal((entities, dimensions)).astype(np.float32)
+    store = RoundTripStore()
+    cache = NeighbourhoodCache(capacity=2048)
+    graph = CacheInvalidatingStore(store, cache)
+    graph.upsert_nodes([EntityNode(name=name, label="ORGANIZATION", embedding=vector.tolist())
+                        for name, vector in zip(names, vectors)])
+    # preferential attachment, so a few hubs have hundreds of relations
+    ends = [random.choice(names) for _ in range(10)]
+    relations = []
+    for _ in range(entities * 3):
+        source, target = random.choice(names), random.choice(ends)
+        relations.append(Relation(label="PARTNERSHIP", source_id=source, target_id=target))
+        ends += [source, target]
+    graph.upsert_relations(relations)
+    # popular entities are asked about over and over (zipf)
+    weights = 1.0 / np.arange(1, entities + 1)
+    # the first half warms the cache, the second half is timed
+    asked = rng.choice(entities, size=2 * queries, p=weights / weights.sum())
+    questions = [QueryBundle(query_str=names[i], embedding=(vectors[i] + 0.1 * rng.standard_normal(dimensions)).tolist())
+                 for i in asked]
+    print(f"{entities} entities, {len(relations)} relations, {queries} queries after {queries} to warm up, "
+          f"{store.round_trip * 1000:.0f} ms per round trip")
+
+    def timed(label, retriever):
+        for question in questions[:queries]:
+            retriever.retrieve(question)
+        latencies = []
+        for question in questions[queries:]:
+            start = time.perf_counter()
+            retriever.retrieve(question)
+            latencies.append(time.perf_counter() - start)
+        p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+        print(f"{label:34} p50 {p50:7.2f} ms  p95 {p95:7.2f} ms")
+
+    # the questions come with their embeddings, the model is never called
+    arguments = dict(graph_store=graph, embed_model=FakeEmbedding(), include_text=False, similarity_top_k=4, path_depth=2, limit=30)
+    timed("VectorContextRetriever", VectorContextRetriever(**arguments))
+    timed("CachedGraphRetriever (no cache)",
+          CachedGraphRetriever(cache=NeighbourhoodCache(capacity=0), **arguments))
+    retriever = CachedGraphRetriever(cache=cache, **arguments)
+    timed("CachedGraphRetriever", retriever)
+    print(cache.stats())
+
+    # a write through the wrapper drops the neighbourhoods it changes
+    # one with fewer relations than the fan-out cap, so the new one is followed
+    degree = Counter(node for r in relations for node in (r.source_id, r.target_id))
+    entity = min(names, key=lambda name: degree[name])
+    question = QueryBundle(query_str=entity, embedding=vectors[names.index(entity)].tolist())
+    before = {n.node.get_content() for n in retriever.retrieve(question)}
+    graph.upsert_nodes([EntityNode(name="New Entity", label="ORGANIZATION")])
+    graph.upsert_relations([Relation(label="ACQUISITION", source_id="New Entity", target_id=entity)])
+    after = {n.node.get_content() for n in retriever.retrieve(question)}
+    assert f"New Entity -> ACQUISITION -> {entity}" in after - before, after - before
+    print(cache.stats())
@@ -0,0 +1,417 @@
+"""Incremental entity dedup: only entities added since the last run are compared.
+
+A nightly ingest through ``PropertyGraphIndex.from_documents`` adds a few hundred
+entities to a graph of hundreds of thousands. Instead of re-reading and re-comparing the
+whole graph, the state of the previous run (names, labels, normalised embeddings and
+the union-find) is kept on disk. A run then
+
+1. reads the entity names (strings only) and diffs them against the saved state,
+2. fetches labels and embeddings for the new names only,
+3. compares the new entities with each other and with the saved ones of the same labels,
+4. unions the matches into the saved components and emits merge groups for the
+   components the new entities touched.
+
+Names merged away by an earlier run stay in the state as aliases of their component, so a
+new "Fastag" still finds the component "FASTag" was merged into.
+
+The work of a run follows the new entities, not the size of the state: the embeddings are
+kept in one contiguous block per label set, and the new rows are compared with a block
+where it lies (memory-mapped with ``DedupState.load(path, mmap=True)``), so saved rows are
+never copied. New rows go to a buffer that doubles when full, and ``save`` appends them to
+the block's file. The union-find keeps the members of each component, so only the
+components the new entities touched are walked.
+"""
+import json
+import os
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from entity_dedup import (SIMILARITY_THRESHOLD, Entity, UnionFind, cross_cosine_pairs, fetch_entities,
+                          fetch_entity_names, normalize_rows)
+from name_matching import names_match, normalize_name
+
+STATE_VERSION = 3
+EMBEDDINGS_DIR = "embeddings"
+
+
+class ComponentUnionFind(UnionFind):
+    """A union-find that also keeps the members of every component of two or more, updated on each union."""
+
+    def __init__(self, size: int = 0):
+        super().__init__(size)
+        self.members: Dict[int, List[int]] = {}
+
+    def union(self, a: int, b: int) -> bool:
+        ra, rb = self.find(a), self.find(b)
+        if not super().union(a, b):
+            return False
+        root, other = (ra, rb) if self.parent[rb] == ra else (rb, ra)
+        kept, moved = self.members.pop(root, [root]), self.members.pop(other, [other])
+        if len(kept) < len(moved):
+            kept, moved = moved, kept
+        kept.extend(moved)
+        self.members[root] = kept
+        return True
+
+    def component(self, x: int) -> List[int]:
+        root = self.find(x)
+        return self.members.get(root, [root])
+
+
+class EmbeddingBlock:
+    """The normalised embeddings of the entities with one label set, a row each.
+
+    Rows saved by an earlier run stay in the array ``load`` gave (memory-mapped with
+    ``mmap=True``) and are never copied. Rows added since go to a buffer that doubles its
+    capacity when full. An entity that comes back with another embedding or other labels gets
+    a new row and its old one is marked dead (position -1), so ``save`` only appends.
+    """
+
+    def __init__(self, dimensions: int, saved: Optional[np.ndarray] = None, positions: Optional[List[int]] = None,
+                 file: Optional[str] = None):
+        self.saved = saved if saved is not None else np.zeros((0, dimensions), dtype=np.float32)
+        self.positions: List[int] = positions if positions is not None else []
+        self._added = np.zeros((0, dimensions), dtype=np.float32)
+        self._added_rows = 0
+        # rows already written to ``file``
+        self.file = file
+        self.persisted = len(self.saved)
+
+    def __len__(self) -> int:
+        return len(self.saved) + self._added_rows
+
+    @property
+    def added(self) -> np.ndarray:
+        return self._added[:self._added_rows]
+
+    def parts(self) -> Iterable[Tuple[int, np.ndarray]]:
+        """(first row, view) pieces covering every row, without copying."""
+        yield 0, self.saved
+        yield len(self.saved), self.added
+
+    def append(self, vectors: np.ndarray, positions: Sequence[int]) -> List[int]:
+        needed = self._added_rows + len(vectors)
+        if needed > len(self._added):
+            grown = np.zeros((max(needed, 2 * len(self._added), 64), self.saved.shape[1]), dtype=np.float32)
+            grown[:self._added_rows] = self.added
+            self._added = grown
+        first = len(self)
+        self._added[self._added_rows:needed] = vectors
+        self._added_rows = needed
+        self.positions.extend(positions)
+        return list(range(first, first + len(vectors)))
+
+    def rows(self, rows: Sequence[int]) -> np.ndarray:
+        split = len(self.saved)
+        return np.stack([self.saved[row] if row < split else self._added[row - split] for row in rows])
+
+    def save(self, file: str) -> None:
+        """Appends the rows ``file`` does not have yet, or writes them all to a file it was not loaded from."""
+        start = self.persisted if file == self.file and os.path.exists(file) else 0
+        with open(file, "r+b" if start else "wb") as f:
+            # drops whatever an interrupted save appended after the rows the state knows about
+            f.seek(start * self.saved.shape[1] * 4)
+            f.truncate()
+            for offset, part in self.parts():
+                if offset + len(part) > start:
+                    f.write(np.ascontiguousarray(part[max(start - offset, 0):]).tobytes())
+        self.file, self.persisted = file, len(self)
+
+    @classmethod
+    def load(cls, file: str, rows: int, dimensions: int, positions: List[int], mmap: bool) -> "EmbeddingBlock":
+        if rows == 0:
+            saved = np.zeros((0, dimensions), dtype=np.float32)
+        elif mmap:
+            saved = np.memmap(file, dtype=np.float32, mode="r", shape=(rows, dimensions))
+        else:
+            saved = np.fromfile(file, dtype=np.float32, count=rows * dimensions).reshape(rows, dimensions)
+        return cls(dimensions, saved, positions, file)
+
+
+class DedupState:
+    """Everything a previous run learned. Entities are positions into parallel lists, embeddings live per label set."""
+
+    def __init__(self):
+        self.names: List[str] = []
+        self.labels: List[Tuple[str, ...]] = []
+        # row of each entity in the block of its labels, -1 without an embedding
+        self.rows: List[int] = []
+        # positions of names no longer in the graph, usually merged away
+        self.dead: Set[int] = set()
+        self.blocks: Dict[Tuple[str, ...], EmbeddingBlock] = {}
+        self.dimensions = 0
+        self.uf = ComponentUnionFind()
+        self.runs = 0
+        self.updated_at: Optional[float] = None
+        self.index: Dict[str, int] = {}
+        self._name_keys: Optional[Dict[Tuple[Tuple[str, ...], str], int]] = None
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def name_keys(self) -> Dict[Tuple[Tuple[str, ...], str], int]:
+        """(labels, normalised name) -> first position with them. Built on first use, then kept up to date by ``add``."""
+        if self._name_keys is None:
+            self._name_keys = {}
+            for i, (labels, name) in enumerate(zip(self.labels, self.names)):
+                self._name_keys.setdefault((labels, normalize_name(name)), i)
+        return self._name_keys
+
+    def add(self, entities: Sequence[Entity]) -> List[int]:
+        """Appends (or revives) ``entities`` and returns their positions."""
+        entities = list({entity.name: entity for entity in entities}.values())
+        positions = []
+        pending: Dict[Tuple[str, ...], Tuple[List[np.ndarray], List[int]]] = {}
+        for entity in entities:
+            embedding = entity.embedding
+            i = self.index.get(entity.name)
+            if i is None:
+                i = self.uf.add()
+                self.index[entity.name] = i
+                self.names.append(entity.name)
+                self.labels.append(entity.labels)
+                self.rows.append(-1)
+            else:
+                self.dead.discard(i)
+                row = self.rows[i]
+                if row >= 0 and (embedding is not None or entity.labels != self.labels[i]):
+                    block = self.blocks[self.labels[i]]
+                    if embedding is None:
+                        embedding = block.rows([row])[0]  # moves to the block of its new labels
+                    block.positions[row] = -1
+                    self.rows[i] = -1
+                self.labels[i] = entity.labels
+            if self._name_keys is not None:
+                self._name_keys.setdefault((entity.labels, normalize_name(entity.name)), i)
+            if embedding is not None:
+                vectors, owners = pending.setdefault(entity.labels, ([], []))
+                vectors.append(np.asarray(embedding, dtype=np.float32))
+                owners.append(i)
+            positions.append(i)
+
+        for labels, (vectors, owners) in pending.items():
+            if not self.dimensions:
+                self.dimensions = len(vectors[0])
+            block = self.blocks.get(labels)
+            if block is None:
+                block = self.blocks[labels] = EmbeddingBlock(self.dimensions)
+            for i, row in zip(owners, block.append(normalize_rows(np.stack(vectors)), owners)):
+                self.rows[i] = row
+        return positions
+
+    def save(self, path: str) -> None:
+        """Writes the state. Embedding files loaded from ``path`` only get the new rows appended."""
+        os.makedirs(os.path.join(path, EMBEDDINGS_DIR), exist_ok=True)
+        roots = list(self.uf.members)
+        members = [self.uf.members[root] for root in roots]
+        arrays = {"parent": np.asarray(self.uf.parent, dtype=np.int64),
+                  "rank": np.asarray(self.uf.rank, dtype=np.int64),
+                  "member_roots": np.asarray(roots, dtype=np.int64),
+                  "member_sizes": np.asarray([len(m) for m in members], dtype=np.int64),
+                  "members": np.asarray([i for m in members for i in m], dtype=np.int64)}
+        blocks = []
+        for n, (labels, block) in enumerate(self.blocks.items()):
+            block.save(os.path.join(path, EMBEDDINGS_DIR, f"{n}.f32"))
+            arrays[f"positions_{n}"] = np.asarray(block.positions, dtype=np.int64)
+            blocks.append({"labels": list(labels), "rows": len(block)})
+        # a new file each time, named in meta.json: until meta.json is replaced, the previous one is still used
+        arrays_file = f"arrays.{uuid.uuid4().hex}.npz"
+        np.savez(os.path.join(path, arrays_file), **arrays)
+        # meta.json last, so an interrupted save still loads as the previous state (the embedding files
+        # only grow, and meta.json says how many of their rows belong to it)
+        partial = os.path.join(path, "meta.json.tmp")
+        with open(partial, "w") as f:
+            # dumps rather than dump, which streams through the pure Python encoder
+            f.write(json.dumps({"version": STATE_VERSION, "runs": self.runs, "updated_at": self.updated_at,
+                       "dimensions": self.dimensions, "names": self.names,
+                       "labels": self.labels, "rows": self.rows,
+                       "dead": sorted(self.dead), "blocks": blocks, "arrays": arrays_file}))
+        os.replace(partial, os.path.join(path, "meta.json"))
+        for name in os.listdir(path):
+            # the previous state's arrays, and those of saves that were interrupted
+            if name.startswith("arrays.") and name != arrays_file:
+                os.remove(os.path.join(path, name))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = False) -> "DedupState":
+        state = cls()
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            return state
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        if meta["version"] != STATE_VERSION:
+            raise ValueError(f"dedup state at {path} has version {meta['version']}, expected {STATE_VERSION}")
+        state.names = meta["names"]
+        state.labels = [tuple(labels) for labels in meta["labels"]]
+        state.rows = meta["rows"]
+        state.dead = set(meta["dead"])
+        state.dimensions = meta["dimensions"]
+        state.runs = meta["runs"]
+        state.updated_at = meta["updated_at"]
+        state.index = {name: i for i, name in enumerate(state.names)}
+        arrays = np.load(os.path.join(path, meta["arrays"]))
+        for n, block in enumerate(meta["blocks"]):
+            state.blocks[tuple(block["labels"])] = EmbeddingBlock.load(
+                os.path.join(path, EMBEDDINGS_DIR, f"{n}.f32"), block["rows"], state.dimensions,
+                arrays[f"positions_{n}"].tolist(), mmap)
+        state.uf.parent = arrays["parent"].tolist()
+        state.uf.rank = arrays["rank"].tolist()
+        offsets = np.cumsum(arrays["member_sizes"])[:-1] if len(arrays["member_sizes"]) else []
+        members = np.split(arrays["members"], offsets)
+        state.uf.members = {root: m.tolist() for root, m in zip(arrays["member_roots"].tolist(), members)}
+        return state
+
+
+class IncrementalDedup:
+    def __init__(self, state: Optional[DedupState] = None,
+                 threshold: float = SIMILARITY_THRESHOLD,
+                 collapse_normalized_names: bool = False,
+                 tile_size: int = 2048):
+        self.state = state if state is not None else DedupState()
+        self.min_cosine = 2 * threshold - 1  # same (1 + cos) / 2 score as the vector index
+        self.collapse_normalized_names = collapse_normalized_names
+        self.tile_size = tile_size
+
+    def new_names(self, live_names: Iterable[str]) -> List[str]:
+        """Names never seen before, or seen before and merged away but now back in the graph."""
+        state = self.state
+        live = set(live_names)
+        # set differences, so only the names that changed are visited one by one
+        for name in state.index.keys() - live:
+            state.dead.add(state.index[name])
+        revived = {state.names[i] for i in state.dead} & live
+        return sorted((live - state.index.keys()) | revived)
+
+    def _candidates(self, new: Sequence[int]) -> Iterable[Tuple[int, int]]:
+        state = self.state
+        fresh_by_labels: Dict[Tuple[str, ...], List[int]] = {}
+        for i in new:
+            if state.rows[i] >= 0:
+                fresh_by_labels.setdefault(state.labels[i], []).append(i)
+
+        for labels, fresh in fresh_by_labels.items():
+            block = state.blocks[labels]
+            fresh_rows = [state.rows[i] for i in fresh]
+            order = {row: k for k, row in enumerate(fresh_rows)}
+            # only the fresh rows are copied, every other row is compared where it is
+            fresh_matrix = block.rows(fresh_rows)
+            for offset, part in block.parts():
+                for a, b in cross_cosine_pairs(fresh_matrix, part, self.min_cosine, self.tile_size):
+                    row = offset + b
+                    j = block.positions[row]
+                    # a dead row, the entity itself, or a pair of fresh ones already seen the other way round
+                    if j < 0 or order.get(row, len(fresh)) <= a:
+                        continue
+                    yield fresh[a], j
+
+        if self.collapse_normalized_names:
+            keys = state.name_keys()
+            for i in new:
+                first = keys[(state.labels[i], normalize_name(state.names[i]))]
+                if first != i:
+                    yield first, i
+
+    def update(self, new_entities: Sequence[Entity]) -> List[List[str]]:
+        """Adds ``new_entities`` to the state and returns the merge groups they caused."""
+        state = self.state
+        new = state.add(new_entities)
+        for i, j in self._candidates(new):
+            if names_match(state.names[i], state.names[j]):
+                state.uf.union(i, j)
+
+        # only the components the new entities are in, from the members kept by the union-find
+        roots = {state.uf.find(i) for i in new}
+        plan = []
+        for root in roots:
+            names = [state.names[i] for i in state.uf.component(root) if i not in state.dead]
+            if len(names) > 1:
+                plan.append(sorted(names, key=lambda n: (-len(n), n)))
+        plan.sort(key=lambda names: names[0])
+
+        state.runs += 1
+        state.updated_at = time.time()
+        return plan
+
+    def run(self, driver) -> List[List[str]]:
+        names = self.new_names(fetch_entity_names(driver))
+        if not names:
+            return []
+        return self.update(fetch_entities(driver, names))
+
+
+if __name__ == "__main__":
+    import shutil
+    import sys
+    import tempfile
+
+    from entity_dedup import DedupEngine
+    from fakes import entity_records
+
+    # python incremental_dedup.py [saved entities]
+    saved = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    path = tempfile.mkdtemp(prefix="dedup_state_")
+    try:
+        # the sample graph arriving over two runs gives the plan of deduplicating it at once
+        entities = [Entity(r["name"], tuple(r["labels"]), r["embedding"]) for r in entity_records()]
+        dedup = IncrementalDedup()
+        first = dedup.update(entities[::2])
+        dedup.state.save(path)
+        dedup = IncrementalDedup(DedupState.load(path, mmap=True))
+        second = dedup.update(entities[1::2])
+        dedup.state.save(path)
+        assert second == DedupEngine().merge_plan(entities), second
+        assert IncrementalDedup(DedupState.load(path)).update([]) == []
+
+        # a save that stops before meta.json is replaced leaves the previous state, arrays included
+        replace = os.replace
+
+        def interrupted(source, target):
+            if target.endswith("meta.json"):
+                raise KeyboardInterrupt
+            replace(source, target)
+
+        state = DedupState.load(path)
+        state.add([Entity(f"Interrupted {k}", ("ORGANIZATION",), None) for k in range(5)])
+        os.replace = interrupted
+        try:
+            state.save(path)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.replace = replace
+        state = DedupState.load(path)
+        assert len(state.names) == len(state.uf.parent) == len(entities)
+        assert IncrementalDedup(state).update(entities) == second
+        print(f"sample graph over two runs: {len(first)} then {len(second)} groups, as deduplicating it at once")
+
+        # a day's entities against a large saved state, all of one label like most of a news graph
+        rng = np.random.default_rng(0)
+        dimensions, daily = 256, 500
+
+        def batch(start, size):
+            vectors = rng.standard_normal((size, dimensions)).astype(np.float32)
+            return [Entity(f"Company {start + k}", ("ORGANIZATION",), vectors[k]) for k in range(size)]
+
+        shutil.rmtree(path)
+        for size in (saved // 4, saved):
+            state = DedupState()
+            for start in range(0, size, 50_000):
+                state.add(batch(start, min(50_000, size - start)))
+            state.save(path)
+            state = DedupState.load(path, mmap=True)
+            t0 = time.perf_counter()
+            dedup = IncrementalDedup(state)
+            dedup.update(batch(size, daily))
+            t1 = time.perf_counter()
+            state.save(path)
+            t2 = time.perf_counter()
+            written = os.path.getsize(os.path.join(path, EMBEDDINGS_DIR, "0.f32"))
+            print(f"{size:8} saved, {daily} new: update {t1 - t0:6.3f}s, save {t2 - t1:6.3f}s, "
+                  f"{written / 1e6:.0f} MB of embeddings on disk")
+            assert written == (size + daily) * dimensions * 4
+            shutil.rmtree(path)
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
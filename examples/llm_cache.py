@@ -0,0 +1,441 @@
+"""A response cache for LLM calls: an in-memory LRU in front of SQLite, shared by every step and every run.
+
+The same prompts go out again and again: TeacherCrew's teacher and reviewer prompts, the
+review prompt of the summary workflow, and every prompt of a regression rerun over the same
+inputs. Each repeat pays full network latency for an answer the process has already seen.
+The key is a hash of what decides the response: the model, the messages, the temperature,
+the response format and any other request arguments. It covers both:
+
+* ``CachedLLM``: wraps a llama_index LLM such as ``OpenAI()``. Use it wherever the LLM goes
+  (``self.llm.acomplete``, ``chat``, ``predict``, extractors),
+* ``CachedCompletions``: ``create``/``parse`` like ``openai_pool.PooledOpenAI``, in front
+  of a ``PooledOpenAI``, an ``openai.AsyncOpenAI`` or an ``openai.OpenAI``. A synchronous
+  client is called on a worker thread.
+
+``ResponseCache`` keeps the ``capacity`` most recently used responses in memory and, with a
+``path``, all of them in SQLite, so later processes hit as well. Entries older than ``ttl``
+seconds are misses. ``normalise=True`` collapses whitespace in the messages before hashing,
+so prompts that only differ in indentation or line wrapping share an entry. Responses above
+``max_temperature`` are not cached. Identical async requests in flight at the same time are
+sent once, and the others wait for that response. Async streams share the entries of the
+plain calls: a hit is replayed as a single chunk, and a miss is stored when its stream
+ends. Sync streams are passed through.
+
+``CachedCompletions.create(on_delta=...)`` streams a miss through a ``PooledOpenAI``. A hit,
+or the response of another client, reaches ``on_delta`` in one piece.
+
+Usage on a cached ``ChatCompletion`` is None, and a cached llama_index response has no token
+counts in its ``additional_kwargs``: a hit costs no tokens, so budgets and tracers do not count it.
+"""
+import asyncio
+import hashlib
+import inspect
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+import openai
+from llama_index.core.base.llms.types import (ChatMessage, ChatResponse, ChatResponseAsyncGen, ChatResponseGen,
+                                              CompletionResponse, CompletionResponseAsyncGen,
+                                              CompletionResponseGen, LLMMetadata)
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.llms import LLM
+from llama_index.core.llms.callbacks import llm_chat_callback, llm_completion_callback
+from openai.types.chat import ChatCompletion, ParsedChatCompletion
+
+_WHITESPACE = re.compile(r"\s+")
+# where llama_index LLMs report usage in additional_kwargs
+_TOKEN_COUNTS = ("prompt_tokens", "completion_tokens", "total_tokens")
+
+
+def _without_usage(additional_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in additional_kwargs.items() if k not in _TOKEN_COUNTS}
+
+
+@dataclass
+class ResponseCacheStats:
+    hits: int = 0
+    disk_hits: int = 0
+    # waited for an identical request that was already in flight
+    coalesced: int = 0
+    misses: int = 0
+    bypassed: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.coalesced + self.misses
+        return (self.hits + self.coalesced) / total if total else 0.0
+
+    def __str__(self) -> str:
+        return (f"{self.hits} hits ({self.disk_hits} from disk), {self.coalesced} coalesced, {self.misses} misses, "
+                f"{self.bypassed} not cacheable, {self.hit_rate:.0%} hit rate")
+
+
+class ResponseCache:
+    def __init__(self, path: Optional[str] = None, capacity: int = 4096, ttl: Optional[float] = None,
+                 normalise: bool = False, max_temperature: Optional[float] = None):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.normalise = normalise
+        self.max_temperature = max_temperature
+        self.stats = ResponseCacheStats()
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self._db = None
+        if path is not None:
+            # sync clients are called from worker threads
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created REAL NOT NULL
+                )""")
+            self._db.commit()
+
+    def cacheable(self, temperature: Optional[float]) -> bool:
+        if self.max_temperature is None or temperature is None or temperature <= self.max_temperature:
+            return True
+        self.stats.bypassed += 1
+        return False
+
+    def key(self, model: Optional[str], messages: Sequence[Dict[str, Any]], temperature: Optional[float] = None,
+            response_format: Any = None, **extra: Any) -> str:
+        if self.normalise:
+            messages = [{**m, "content": _WHITESPACE.sub(" ", m["content"]).strip()}
+                        if isinstance(m.get("content"), str) else m for m in messages]
+        request = {"model": model, "messages": list(messages), "temperature": temperature,
+                   "response_format": response_format, **extra}
+        return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def _fresh(self, created: float) -> bool:
+        return self.ttl is None or time.time() - created <= self.ttl
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and self._fresh(entry[0]):
+                self._memory.move_to_end(key)
+                self.stats.hits += 1
+                return entry[1]
+            if self._db is not None:
+                row = self._db.execute("SELECT created, value FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None and self._fresh(row[0]):
+                    self._remember(key, row[0], row[1])
+                    self.stats.hits += 1
+                    self.stats.disk_hits += 1
+                    return row[1]
+            self.stats.misses += 1
+            return None
+
+    def put(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, value)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", (key, value, now))
+                self._db.commit()
+
+    async def aget_or_call(self, key: Optional[str], call: Callable[[], Awaitable[Any]],
+                           dump: Callable[[Any], str], load: Callable[[str], Any]) -> Any:
+        """The cached response for ``key``, or ``await call()`` stored under it. A None key is not cached."""
+        if key is None:
+            return await call()
+        pending = self._pending.get(key)
+        if pending is not None:
+            try:
+                value = await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise  # it is this call that is being cancelled
+                # the request this call waited for was cancelled, so ask again
+                return await self.aget_or_call(key, call, dump, load)
+            self.stats.coalesced += 1
+            return load(value)
+        hit = self.get(key)
+        if hit is not None:
+            return load(hit)
+        future = self._pending[key] = asyncio.get_running_loop().create_future()
+        try:
+            response = await call()
+            value = dump(response)
+            self.put(key, value)
+            future.set_result(value)
+            return response
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # nobody may be waiting, and that is fine
+            raise
+        finally:
+            del self._pending[key]
+
+    def _remember(self, key: str, created: float, value: str) -> None:
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.capacity:
+            self._memory.popitem(last=False)
+
+    def expire(self) -> int:
+        """Deletes the entries older than ``ttl`` from disk. Returns how many."""
+        if self.ttl is None or self._db is None:
+            return 0
+        with self._lock:
+            deleted = self._db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,)).rowcount
+            self._db.commit()
+        return deleted
+
+
+def _messages(messages: Sequence[ChatMessage]) -> List[Dict[str, Any]]:
+    return [{"role": str(getattr(m.role, "value", m.role)), "content": m.content} for m in messages]
+
+
+class CachedLLM(LLM):
+    """``llm`` with its chat and completion calls answered from ``cache`` when they can be."""
+
+    llm: LLM = Field(description="The LLM that answers on a miss.")
+
+    _cache: ResponseCache = PrivateAttr()
+
+    def __init__(self, llm: LLM, cache: ResponseCache, **kwargs: Any):
+        super().__init__(llm=llm, **kwargs)
+        self._cache = cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedLLM"
+
+    @property
+    def cache(self) -> ResponseCache:
+        return self._cache
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return self.llm.metadata
+
+    def _key(self, kind: str, messages: List[Dict[str, Any]], kwargs: Dict[str, Any]) -> Optional[str]:
+        extra = dict(kwargs)
+        temperature = extra.pop("temperature", getattr(self.llm, "temperature", None))
+        if not self._cache.cacheable(temperature):
+            return None
+        return self._cache.key(self.metadata.model_name, messages, temperature, call=kind, **extra)
+
+    @staticmethod
+    def _dump_chat(response: ChatResponse) -> str:
+        return json.dumps({"message": response.message.model_dump(mode="json"),
+                           "additional_kwargs": response.additional_kwargs}, default=str)
+
+    @staticmethod
+    def _load_chat(value: str) -> ChatResponse:
+        data = json.loads(value)
+        message = ChatMessage.model_validate(data["message"])
+        # the whole text is the delta, for streams replayed from the cache
+        return ChatResponse(message=message, delta=message.content,
+                            additional_kwargs=_without_usage(data["additional_kwargs"]))
+
+    @staticmethod
+    def _dump_completion(response: CompletionResponse) -> str:
+        return json.dumps({"text": response.text, "additional_kwargs": response.additional_kwargs}, default=str)
+
+    @staticmethod
+    def _load_completion(value: str) -> CompletionResponse:
+        data = json.loads(value)
+        return CompletionResponse(text=data["text"], delta=data["text"],
+                                  additional_kwargs=_without_usage(data["additional_kwargs"]))
+
+    def _chat_key(self, messages: Sequence[ChatMessage], kwargs: Dict[str, Any]) -> Optional[str]:
+        return self._key("chat", _messages(messages), kwargs)
+
+    def _completion_key(self, prompt: str, formatted: bool, kwargs: Dict[str, Any]) -> Optional[str]:
+        return self._key("complete", [{"role": "user", "content": prompt}], {**kwargs, "formatted": formatted})
+
+    def _cached(self, key: Optional[str], call: Callable[[], Any], dump: Callable[[Any], str],
+                load: Callable[[str], Any]) -> Any:
+        hit = self._cache.get(key) if key is not None else None
+        if hit is not None:
+            return load(hit)
+        response = call()
+        if key is not None:
+            self._cache.put(key, dump(response))
+        return response
+
+    async def _astream(self, key: Optional[str], call: Callable[[], Awaitable[Any]], dump: Callable[[Any], str],
+                       load: Callable[[str], Any]) -> Any:
+        hit = self._cache.get(key) if key is not None else None
+        if hit is not None:
+            response = load(hit)
+
+            async def replay() -> Any:
+                yield response
+
+            return replay()
+        stream = await call()
+
+        async def gen() -> Any:
+            last = None
+            async for last in stream:
+                yield last
+            # only a stream that ran to the end is a whole response
+            if key is not None and last is not None:
+                self._cache.put(key, dump(last))
+
+        return gen()
+
+    @llm_chat_callback()
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        return self._cached(self._chat_key(messages, kwargs), lambda: self.llm.chat(messages, **kwargs),
+                            self._dump_chat, self._load_chat)
+
+    @llm_chat_callback()
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        return await self._cache.aget_or_call(self._chat_key(messages, kwargs),
+                                              lambda: self.llm.achat(messages, **kwargs),
+                                              self._dump_chat, self._load_chat)
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        return self._cached(self._completion_key(prompt, formatted, kwargs),
+                            lambda: self.llm.complete(prompt, formatted=formatted, **kwargs),
+                            self._dump_completion, self._load_completion)
+
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        return await self._cache.aget_or_call(self._completion_key(prompt, formatted, kwargs),
+                                              lambda: self.llm.acomplete(prompt, formatted=formatted, **kwargs),
+                                              self._dump_completion, self._load_completion)
+
+    @llm_chat_callback()
+    def stream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseGen:
+        return self.llm.stream_chat(messages, **kwargs)
+
+    @llm_chat_callback()
+    async def astream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseAsyncGen:
+        return await self._astream(self._chat_key(messages, kwargs), lambda: self.llm.astream_chat(messages, **kwargs),
+                                   self._dump_chat, self._load_chat)
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        return self.llm.stream_complete(prompt, formatted=formatted, **kwargs)
+
+    @llm_completion_callback()
+    async def astream_complete(self, prompt: str, formatted: bool = False,
+                               **kwargs: Any) -> CompletionResponseAsyncGen:
+        return await self._astream(self._completion_key(prompt, formatted, kwargs),
+                                   lambda: self.llm.astream_complete(prompt, formatted=formatted, **kwargs),
+                                   self._dump_completion, self._load_completion)
+
+
+def _response_format_key(response_format: Any) -> Any:
+    # a pydantic class is keyed by its schema, so changing the model misses the cache
+    if inspect.isclass(response_format) and hasattr(response_format, "model_json_schema"):
+        return response_format.model_json_schema()
+    return response_format
+
+
+class CachedCompletions:
+    """``create``/``parse`` in front of a client, answering repeated requests from ``cache``."""
+
+    # per-call settings that do not change the response
+    IGNORED = ("timeout", "extra_headers")
+
+    def __init__(self, client: Any, cache: ResponseCache):
+        self.client = client
+        self.cache = cache
+        # the sync client would hold the event loop for the whole request
+        self._blocking = isinstance(client, openai.OpenAI)
+
+    def _method(self, name: str) -> Any:
+        if hasattr(self.client, name):
+            return getattr(self.client, name)  # PooledOpenAI
+        if name == "create":
+            return self.client.chat.completions.create
+        return self.client.beta.chat.completions.parse
+
+    async def _call(self, name: str, response_type: Any, kwargs: Dict[str, Any],
+                    on_delta: Optional[Callable[[str], Any]] = None) -> Any:
+        request = {k: v for k, v in kwargs.items() if k not in self.IGNORED}
+        model, messages = request.pop("model"), request.pop("messages")
+        temperature = request.pop("temperature", None)
+        response_format = _response_format_key(request.pop("response_format", None))
+        key = None
+        if self.cache.cacheable(temperature):
+            key = self.cache.key(model, messages, temperature, response_format, call=name, **request)
+        method = self._method(name)
+
+        async def call() -> Any:
+            if on_delta is not None and hasattr(self.client, name):
+                return await method(on_delta=on_delta, **kwargs)  # PooledOpenAI streams it
+            if self._blocking:
+                response = await asyncio.to_thread(method, **kwargs)
+            else:
+                response = await method(**kwargs)
+            if on_delta is not None:
+                on_delta(response.choices[0].message.content or "")
+            return response
+
+        def load(value: str) -> Any:
+            response = response_type.model_validate_json(value)
+            response.usage = None
+            if on_delta is not None:
+                on_delta(response.choices[0].message.content or "")
+            return response
+
+        def dump(response: Any) -> str:
+            # parse() responses are typed ParsedChatCompletion[None] while holding the parsed model
+            return response.model_dump_json(warnings=False)
+
+        return await self.cache.aget_or_call(key, call, dump, load)
+
+    async def create(self, on_delta: Optional[Callable[[str], Any]] = None, **kwargs: Any) -> Any:
+        return await self._call("create", ChatCompletion, kwargs, on_delta)
+
+    async def parse(self, **kwargs: Any) -> Any:
+        response_format = kwargs.get("response_format")
+        response_type = ParsedChatCompletion[response_format] if inspect.isclass(response_format) else ParsedChatCompletion
+        return await self._call("parse", response_type, kwargs)
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+    import tempfile
+
+    from fakes import FakeLLM
+
+    # python llm_cache.py [number of prompts]
+    prompts = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    queries = [f"what is reflection? (student {i % 50})" for i in range(prompts)]
+
+    async def run(llm, label):
+        start = time.perf_counter()
+        await asyncio.gather(*(llm.acomplete(f"You are an experienced physics teacher.\n  query:{q}")
+                               for q in queries))
+        print(f"{label:30}{time.perf_counter() - start:6.2f}s  {inner.calls} calls to the model")
+
+    async def main():
+        global inner
+        inner = FakeLLM(latency=0.5, jitter=0.5)
+        await run(inner, "no cache")
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "responses.sqlite")
+            inner = FakeLLM(latency=0.5, jitter=0.5)
+            cached = CachedLLM(inner, ResponseCache(path=path))
+            await run(cached, "cold cache")
+            await run(cached, "warm, in memory")
+            print(f"{'':30}{cached.cache.stats}")
+            # a new process: the memory tier is empty, the disk tier is not
+            inner = FakeLLM(latency=0.5, jitter=0.5)
+            cached = CachedLLM(inner, ResponseCache(path=path))
+            await run(cached, "new process, from disk")
+            print(f"{'':30}{cached.cache.stats}")
+
+    asyncio.run(main())
@@ -0,0 +1,685 @@
+"""In-process property graph store, a drop-in for ``Neo4jPGStore`` when there is no database.
+
+It stores the same graph that ``Neo4jPGStore`` writes. Entities are keyed by name, chunks by id,
+and an entity with a ``triplet_source_id`` gets a ``MENTIONS`` edge from its chunk. Relations
+are unique per (source, type, target), and their properties are set only when they are
+created. Reads return what the Neo4j store returns, including vector scores on its
+``(1 + cos) / 2`` scale, so thresholds carry over.
+
+Layout:
+
+* nodes are dense integers, with hash indexes from id, entity name and label,
+* edges are parallel int32 columns (source, target, type). Adjacency is a CSR index (offsets
+  and edge order, per direction) that is rebuilt once enough edges were appended after it,
+  and the appended edges are scanned until then,
+* embeddings are rows of a float32 matrix, normalised on insert, so a vector query is one
+  matrix-vector product,
+* deletes only flag nodes and edges dead, ``persist`` writes the live graph compacted,
+* with a ``vector_index`` (see ann_index.py) unfiltered vector queries go through it instead,
+  and it is kept up to date on upserts, deletes and merges.
+
+``persist`` writes a directory of ``.npy`` arrays (embeddings, edges, adjacency) plus JSON
+lines for names and properties. ``from_persist_dir(path, mmap=True)`` maps the arrays
+instead of reading them, and they are only copied into memory when the store is written to.
+
+Run this file directly for a benchmark on a synthetic graph.
+"""
+import json
+import operator
+import os
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from llama_index.core.graph_stores.types import (
+    TRIPLET_SOURCE_KEY,
+    ChunkNode,
+    EntityNode,
+    LabelledNode,
+    PropertyGraphStore,
+    Relation,
+    Triplet,
+)
+from llama_index.core.vector_stores.types import FilterCondition, FilterOperator, VectorStoreQuery
+
+MENTIONS = "MENTIONS"
+# label of nodes that only exist as the endpoint of a relation, as in Neo4jPGStore
+IMPLICIT_LABEL = "Chunk"
+FORMAT_VERSION = 1
+VECTOR_INDEX_DIR = "vector_index"
+
+_OPERATORS = {
+    FilterOperator.EQ: operator.eq,
+    FilterOperator.NE: operator.ne,
+    FilterOperator.GT: operator.gt,
+    FilterOperator.GTE: operator.ge,
+    FilterOperator.LT: operator.lt,
+    FilterOperator.LTE: operator.le,
+    FilterOperator.IN: lambda value, allowed: value in allowed,
+    FilterOperator.NIN: lambda value, allowed: value not in allowed,
+}
+
+
+class _Column:
+    """Append-only NumPy column that doubles its capacity when full.
+
+    It can start from an existing (e.g. memory-mapped) array, which is copied on the first write.
+    """
+
+    def __init__(self, dtype: Any, width: Optional[int] = None, data: Optional[np.ndarray] = None):
+        self.dtype = dtype
+        self.width = width
+        self._data = data if data is not None else np.zeros(self._shape(0), dtype)
+        self._size = len(self._data)
+        self._owned = data is None
+
+    def _shape(self, rows: int) -> Tuple[int, ...]:
+        return (rows,) if self.width is None else (rows, self.width)
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def data(self) -> np.ndarray:
+        return self._data[:self._size]
+
+    def _reserve(self, rows: int) -> None:
+        if self._owned and rows <= len(self._data):
+            return
+        grown = np.zeros(self._shape(max(rows, 2 * len(self._data), 64)), self.dtype)
+        grown[:self._size] = self._data[:self._size]
+        self._data, self._owned = grown, True
+
+    def append(self, value: Any) -> int:
+        self._reserve(self._size + 1)
+        self._data[self._size] = value
+        self._size += 1
+        return self._size - 1
+
+    def __setitem__(self, index: Any, value: Any) -> None:
+        self._reserve(self._size)
+        self._data[index] = value
+
+
+class LocalPropertyGraphStore(PropertyGraphStore):
+    supports_structured_queries: bool = False
+    supports_vector_queries: bool = True
+
+    def __init__(self, vector_index: Any = None) -> None:
+        # optional ann_index.IVFFlatIndex (or ExactIndex) over entity embeddings, for unfiltered vector queries
+        self.vector_index = vector_index
+        self._lock = threading.RLock()
+        # nodes
+        self._ids: List[str] = []
+        self._index: Dict[str, int] = {}
+        self._is_entity: List[bool] = []
+        self._labels: List[str] = []
+        self._texts: List[Optional[str]] = []
+        self._properties: List[Dict[str, Any]] = []
+        self._live = _Column(bool)
+        self._by_name: Dict[str, int] = {}
+        self._by_label: Dict[str, Set[int]] = {}
+        # embeddings, the width is taken from the first one
+        self._embeddings: Optional[_Column] = None
+        self._has_embedding = _Column(bool)
+        # edges
+        self._types: List[str] = []
+        self._type_codes: Dict[str, int] = {}
+        self._src = _Column(np.int32)
+        self._dst = _Column(np.int32)
+        self._type = _Column(np.int32)
+        self._edge_live = _Column(bool)
+        self._edge_properties: List[Dict[str, Any]] = []
+        self._edge_index: Dict[Tuple[int, int, int], int] = {}
+        # CSR adjacency per direction: (offsets, edge order, number of edges covered)
+        self._csr: Dict[str, Tuple[np.ndarray, np.ndarray, int]] = {}
+
+    @property
+    def client(self) -> Any:
+        return self
+
+    def __len__(self) -> int:
+        return int(self._live.data.sum())
+
+    @property
+    def edge_count(self) -> int:
+        return int(self._edge_live.data.sum())
+
+    # ----- writes -----
+
+    def _node(self, node_id: str) -> int:
+        """Index of ``node_id``, created as an implicit (chunk) node if it does not exist."""
+        index = self._index.get(node_id)
+        if index is not None:
+            if not self._live.data[index]:
+                self._live[index] = True
+                self._by_label.setdefault(self._labels[index], set()).add(index)
+            return index
+        index = len(self._ids)
+        self._ids.append(node_id)
+        self._index[node_id] = index
+        self._is_entity.append(False)
+        self._labels.append(IMPLICIT_LABEL)
+        self._texts.append(None)
+        self._properties.append({})
+        self._live.append(True)
+        self._has_embedding.append(False)
+        if self._embeddings is not None:
+            self._embeddings.append(0)
+        self._by_label.setdefault(IMPLICIT_LABEL, set()).add(index)
+        return index
+
+    def _relabel(self, index: int, label: str) -> None:
+        self._by_label.get(self._labels[index], set()).discard(index)
+        self._labels[index] = label
+        self._by_label.setdefault(label, set()).add(index)
+
+    def _set_embedding(self, index: int, embedding: Sequence[float]) -> None:
+        vector = np.asarray(embedding, dtype=np.float32)
+        if self._embeddings is None:
+            self._embeddings = _Column(np.float32, width=len(vector))
+            for _ in range(len(self._ids)):
+                self._embeddings.append(0)
+        if len(vector) != self._embeddings.width:
+            raise ValueError(f"expected {self._embeddings.width}-dim embeddings, got {len(vector)}")
+        norm = np.linalg.norm(vector)
+        self._embeddings[index] = vector / norm if norm else vector
+        self._has_embedding[index] = True
+
+    def _add_edge(self, source: int, type_name: str, target: int, properties: Dict[str, Any]) -> int:
+        code = self._type_codes.get(type_name)
+        if code is None:
+            code = self._type_codes[type_name] = len(self._types)
+            self._types.append(type_name)
+        key = (source, code, target)
+        edge = self._edge_index.get(key)
+        if edge is not None:
+            # like apoc.merge.relationship in Neo4jPGStore, properties are only set on create
+            return edge
+        edge = self._src.append(source)
+        self._dst.append(target)
+        self._type.append(code)
+        self._edge_live.append(True)
+        self._edge_properties.append(dict(properties))
+        self._edge_index[key] = edge
+        return edge
+
+    def upsert_nodes(self, nodes: Sequence[LabelledNode]) -> None:
+        with self._lock:
+            embedded = []
+            for node in nodes:
+                index = self._node(node.id)
+                self._properties[index].update(node.properties)
+                if isinstance(node, EntityNode):
+                    self._is_entity[index] = True
+                    self._texts[index] = node.name
+                    self._by_name[node.name] = index
+                    self._relabel(index, node.label)
+                    source_id = node.properties.get(TRIPLET_SOURCE_KEY)
+                    if source_id is not None:
+                        self._add_edge(self._node(source_id), MENTIONS, index, {})
+                elif isinstance(node, ChunkNode):
+                    self._texts[index] = node.text
+                    self._relabel(index, node.label)
+                if node.embedding is not None:
+                    self._set_embedding(index, node.embedding)
+                    if self._is_entity[index]:
+                        embedded.append(index)
+            if self.vector_index is not None and embedded:
+                embedded = list(dict.fromkeys(embedded))
+                self.vector_index.add([self._ids[i] for i in embedded], self._embeddings.data[embedded])
+
+    def upsert_relations(self, relations: List[Relation]) -> None:
+        with self._lock:
+            for relation in relations:
+                self._add_edge(self._node(relation.source_id), relation.label,
+                               self._node(relation.target_id), relation.properties)
+
+    def _delete_nodes(self, indices: Iterable[int]) -> None:
+        indices = [i for i in indices if self._live.data[i]]
+        if not indices:
+            return
+        if self.vector_index is not None:
+            self.vector_index.remove([self._ids[i] for i in indices])
+        for index in indices:
+            self._live[index] = False
+            self._has_embedding[index] = False
+            self._by_label.get(self._labels[index], set()).discard(index)
+            if self._is_entity[index] and self._by_name.get(self._texts[index]) == index:
+                del self._by_name[self._texts[index]]
+            # a node deleted and upserted again starts empty, as a new Neo4j node would
+            self._properties[index] = {}
+            self._is_entity[index] = False
+            self._texts[index] = None
+        self._delete_edges(self._incident(np.asarray(indices, dtype=np.int32)))
+
+    def _delete_edges(self, edges: np.ndarray) -> None:
+        src, dst, types = self._src.data, self._dst.data, self._type.data
+        for edge in edges.tolist():
+            if self._edge_live.data[edge]:
+                self._edge_live[edge] = False
+                del self._edge_index[(int(src[edge]), int(types[edge]), int(dst[edge]))]
+
+    def delete(self, entity_names: Optional[List[str]] = None, relation_names: Optional[List[str]] = None,
+               properties: Optional[dict] = None, ids: Optional[List[str]] = None) -> None:
+        with self._lock:
+            if entity_names:
+                self._delete_nodes(self._by_name[name] for name in entity_names if name in self._by_name)
+            if ids:
+                self._delete_nodes(self._index[i] for i in ids if i in self._index)
+            if relation_names:
+                codes = [self._type_codes[name] for name in relation_names if name in self._type_codes]
+                self._delete_edges(np.flatnonzero(np.isin(self._type.data, codes) & self._edge_live.data))
+            if properties:
+                self._delete_nodes(self._matching(properties))
+
+    def merge_nodes(self, groups: Iterable[Sequence[str]]) -> int:
+        """Merges every group of entity names into its first one, like 04's apoc.refactor.mergeNodes.
+
+        The first node keeps its own properties, relations of the others are moved onto it.
+        Returns the number of nodes merged away.
+        """
+        merged = 0
+        with self._lock:
+            for names in groups:
+                indices = [self._by_name[name] for name in names if name in self._by_name]
+                if len(indices) < 2:
+                    continue
+                keep, others = indices[0], indices[1:]
+                edges = self._incident(np.asarray(others, dtype=np.int32))
+                moved = [(int(self._src.data[e]), self._types[self._type.data[e]], int(self._dst.data[e]),
+                          self._edge_properties[e]) for e in edges.tolist()]
+                self._delete_nodes(others)
+                for source, type_name, target, props in moved:
+                    self._add_edge(keep if source in others else source, type_name,
+                                   keep if target in others else target, props)
+                merged += len(others)
+        return merged
+
+    # ----- adjacency -----
+
+    def _adjacency(self, direction: str) -> Tuple[np.ndarray, np.ndarray, int]:
+        key = self._src if direction == "out" else self._dst
+        csr = self._csr.get(direction)
+        edges = len(key)
+        # rebuilt when the unindexed tail gets long, the tail is scanned linearly until then.
+        # Nodes added since the last build can only have edges in the tail.
+        if csr is None or edges - csr[2] > max(1024, csr[2] // 8):
+            order = np.argsort(key.data, kind="stable").astype(np.int32)
+            offsets = np.searchsorted(key.data[order], np.arange(len(self._ids) + 1)).astype(np.int64)
+            csr = self._csr[direction] = (offsets, order, edges)
+        return csr
+
+    def _edges_from(self, nodes: np.ndarray, direction: str) -> np.ndarray:
+        offsets, order, built = self._adjacency(direction)
+        key = (self._src if direction == "out" else self._dst).data
+        indexed = nodes[nodes < len(offsets) - 1]
+        starts, counts = offsets[indexed], offsets[indexed + 1] - offsets[indexed]
+        positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        tail = built + np.flatnonzero(np.isin(key[built:], nodes))
+        edges = np.concatenate([order[positions], tail]).astype(np.int64)
+        return edges[self._edge_live.data[edges]]
+
+    def _incident(self, nodes: np.ndarray) -> np.ndarray:
+        return np.unique(np.concatenate([self._edges_from(nodes, "out"), self._edges_from(nodes, "in")]))
+
+    # ----- reads -----
+
+    def _node_properties(self, index: int) -> Dict[str, Any]:
+        return {k: v for k, v in self._properties[index].items() if v is not None}
+
+    def _labelled(self, index: int) -> LabelledNode:
+        if self._is_entity[index]:
+            return EntityNode(name=self._texts[index], label=self._labels[index],
+                              properties=self._node_properties(index))
+        return ChunkNode(id_=self._ids[index], text=self._texts[index] or "", properties=self._node_properties(index))
+
+    def _as_entity(self, index: int) -> EntityNode:
+        # get_triplets/get_rel_map return every endpoint as an EntityNode named by its id
+        return EntityNode(name=self._ids[index], label=self._labels[index], properties=self._node_properties(index))
+
+    def _matches(self, index: int, properties: dict) -> bool:
+        stored = self._properties[index]
+        for key, value in properties.items():
+            if key == "name" and self._is_entity[index]:
+                found = self._texts[index]
+            elif key == "text" and not self._is_entity[index]:
+                found = self._texts[index]
+            else:
+                found = stored.get(key)
+            if found != value:
+                return False
+        return True
+
+    def _matching(self, properties: dict, candidates: Optional[Iterable[int]] = None) -> List[int]:
+        if candidates is None:
+            candidates = np.flatnonzero(self._live.data).tolist()
+        return [i for i in candidates if self._live.data[i] and self._matches(i, properties)]
+
+    def get(self, properties: Optional[dict] = None, ids: Optional[List[str]] = None) -> List[LabelledNode]:
+        with self._lock:
+            candidates = [self._index[i] for i in ids if i in self._index] if ids else None
+            return [self._labelled(i) for i in self._matching(properties or {}, candidates)]
+
+    def get_by_label(self, label: str) -> List[LabelledNode]:
+        with self._lock:
+            return [self._labelled(i) for i in sorted(self._by_label.get(label, ()))]
+
+    def _triplet(self, edge: int, entities: Optional[Dict[int, EntityNode]] = None) -> Triplet:
+        """``entities`` shares the endpoint nodes between the triplets of one read."""
+        source, target = int(self._src.data[edge]), int(self._dst.data[edge])
+        relation = Relation(label=self._types[self._type.data[edge]], source_id=self._ids[source],
+                            target_id=self._ids[target], properties=dict(self._edge_properties[edge]))
+        if entities is None:
+            return [self._as_entity(source), relation, self._as_entity(target)]
+        for index in (source, target):
+            if index not in entities:
+                entities[index] = self._as_entity(index)
+        return [entities[source], relation, entities[target]]
+
+    def get_triplets(self, entity_names: Optional[List[str]] = None, relation_names: Optional[List[str]] = None,
+                     properties: Optional[dict] = None, ids: Optional[List[str]] = None) -> List[Triplet]:
+        with self._lock:
+            if entity_names or ids:
+                seeds = [self._by_name[n] for n in entity_names or () if n in self._by_name]
+                seeds += [self._index[i] for i in ids or () if i in self._index]
+            else:
+                seeds = np.flatnonzero(self._live.data).tolist()
+            entity = np.asarray(self._is_entity, dtype=bool)
+            seeds = [i for i in dict.fromkeys(seeds) if entity[i] and self._matches(i, properties or {})]
+            if not seeds:
+                return []
+            edges = self._incident(np.asarray(seeds, dtype=np.int32))
+            # only relations between entities, MENTIONS comes from a chunk
+            edges = edges[entity[self._src.data[edges]] & entity[self._dst.data[edges]]]
+            if relation_names:
+                codes = [self._type_codes[n] for n in relation_names if n in self._type_codes]
+                edges = edges[np.isin(self._type.data[edges], codes)]
+            return [self._triplet(edge) for edge in edges.tolist()]
+
+    def _capped_incident(self, nodes: List[int], limit: Optional[int],
+                         entity: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(node, edge) pairs: the entity-to-entity edges of each node, its first ``limit`` if given."""
+        edges = self._incident(np.asarray(nodes, dtype=np.int32))
+        edges = edges[entity[self._src.data[edges]] & entity[self._dst.data[edges]]]
+        # each edge once per requested endpoint
+        wanted = np.zeros(len(self._ids), dtype=bool)
+        wanted[nodes] = True
+        src, dst = self._src.data[edges], self._dst.data[edges]
+        owner = np.concatenate([src[wanted[src]], dst[wanted[dst]]])
+        owned = np.concatenate([edges[wanted[src]], edges[wanted[dst]]])
+        order = np.lexsort((owned, owner))
+        owner, owned = owner[order], owned[order]
+        if limit is not None:
+            keep = np.arange(len(owner)) - np.searchsorted(owner, owner) < limit
+            owner, owned = owner[keep], owned[keep]
+        return owner, owned
+
+    def _live_entities(self, ids: Iterable[str], entity: np.ndarray) -> List[int]:
+        nodes = [self._index[i] for i in dict.fromkeys(ids) if i in self._index]
+        return [i for i in nodes if self._live.data[i] and entity[i]]
+
+    def get_incident_triplets(self, ids: List[str], limit: Optional[int] = None) -> List[Triplet]:
+        """The relations between each node and other entities (either direction), at most ``limit`` per node."""
+        with self._lock:
+            entity = np.asarray(self._is_entity, dtype=bool)
+            nodes = self._live_entities(ids, entity)
+            if not nodes:
+                return []
+            _, owned = self._capped_incident(nodes, limit, entity)
+            return [self._triplet(edge) for edge in np.unique(owned).tolist()]
+
+    def expand_incident(self, ids: List[str], depth: int, limit: Optional[int] = None) -> Dict[str, List[Triplet]]:
+        """``get_incident_triplets`` for ``ids``, then for the entities they reach, ``depth`` hops out, in one call.
+
+        Maps every node expanded to its relations. The nodes of a hop are the ones the relations of
+        the previous hop reach that were not expanded yet.
+        """
+        incident: Dict[str, List[Triplet]] = {}
+        with self._lock:
+            entity = np.asarray(self._is_entity, dtype=bool)
+            frontier = self._live_entities(ids, entity)
+            expanded = set(frontier)
+            triplets: Dict[int, Triplet] = {}
+            entities: Dict[int, EntityNode] = {}
+            for _ in range(depth):
+                if not frontier:
+                    break
+                owner, owned = self._capped_incident(frontier, limit, entity)
+                for node, edge in zip(owner.tolist(), owned.tolist()):
+                    if edge not in triplets:
+                        triplets[edge] = self._triplet(edge, entities)
+                    incident.setdefault(self._ids[node], []).append(triplets[edge])
+                reached = set(self._src.data[owned].tolist()) | set(self._dst.data[owned].tolist())
+                frontier = sorted(reached - expanded)
+                expanded.update(frontier)
+        return incident
+
+    def get_rel_map(self, graph_nodes: List[LabelledNode], depth: int = 2, limit: int = 30,
+                    ignore_rels: Optional[List[str]] = None) -> List[Triplet]:
+        """Relations on paths of up to ``depth`` hops (either direction) from each node, ``limit`` in total."""
+        triplets: List[Triplet] = []
+        with self._lock:
+            mentions = self._type_codes.get(MENTIONS, -1)
+            for node in graph_nodes:
+                start = self._index.get(node.id)
+                if start is None or not self._live.data[start]:
+                    continue
+                seen_nodes = {start}
+                seen_edges: Set[int] = set()
+                frontier = np.asarray([start], dtype=np.int32)
+                for _ in range(depth):
+                    if len(triplets) + len(seen_edges) >= limit or not len(frontier):
+                        break
+                    edges = self._incident(frontier)
+                    edges = [e for e in edges[self._type.data[edges] != mentions].tolist() if e not in seen_edges]
+                    seen_edges.update(edges)
+                    reached = set(self._src.data[edges].tolist()) | set(self._dst.data[edges].tolist())
+                    frontier = np.asarray(sorted(reached - seen_nodes), dtype=np.int32)
+                    seen_nodes |= reached
+                triplets.extend(self._triplet(edge) for edge in sorted(seen_edges))
+                if len(triplets) >= limit:
+                    break
+        ignore = set(ignore_rels or ())
+        return [t for t in triplets[:limit] if t[1].label not in ignore]
+
+    def structured_query(self, query: str, param_map: Optional[Dict[str, Any]] = None) -> Any:
+        raise NotImplementedError("Structured query not implemented for LocalPropertyGraphStore.")
+
+    def _filter_mask(self, filters: Any, candidates: np.ndarray) -> np.ndarray:
+        results = []
+        for f in filters.filters:
+            if not hasattr(f, "key"):
+                results.append(self._filter_mask(f, candidates))
+                continue
+            test = _OPERATORS.get(f.operator)
+            if test is None:
+                raise NotImplementedError(f"filter operator {f.operator} is not supported")
+            values = [self._properties[i].get(f.key) for i in candidates.tolist()]
+            results.append(np.asarray([v is not None and test(v, f.value) for v in values], dtype=bool))
+        if not results:
+            return np.ones(len(candidates), dtype=bool)
+        combine = np.logical_or if filters.condition == FilterCondition.OR else np.logical_and
+        return combine.reduce(results)
+
+    def vector_query(self, query: VectorStoreQuery, **kwargs: Any) -> Tuple[List[LabelledNode], List[float]]:
+        with self._lock:
+            if self._embeddings is None or query.query_embedding is None:
+                return [], []
+            vector = np.asarray(query.query_embedding, dtype=np.float32)
+            if len(vector) != self._embeddings.width:
+                return [], []
+            if self.vector_index is not None and query.filters is None:
+                keys, cosines = self.vector_index.search(vector, query.similarity_top_k)
+                return [self._labelled(self._index[key]) for key in keys], [(1 + c) / 2 for c in cosines]
+            candidates = np.flatnonzero(self._has_embedding.data & np.asarray(self._is_entity, dtype=bool))
+            if query.filters is not None and len(candidates):
+                candidates = candidates[self._filter_mask(query.filters, candidates)]
+            if not len(candidates):
+                return [], []
+            norm = np.linalg.norm(vector)
+            cosine = self._embeddings.data[candidates] @ (vector / norm if norm else vector)
+            top_k = min(query.similarity_top_k, len(candidates))
+            best = np.argpartition(-cosine, top_k - 1)[:top_k]
+            best = best[np.argsort(-cosine[best], kind="stable")]
+            # vector.similarity.cosine in Neo4j is (1 + cos) / 2
+            scores = ((1 + cosine[best]) / 2).tolist()
+            return [self._labelled(int(i)) for i in candidates[best]], scores
+
+    def get_schema(self, refresh: bool = False) -> Any:
+        with self._lock:
+            return {
+                "node_labels": {label: len(nodes) for label, nodes in self._by_label.items() if nodes},
+                "relation_types": sorted({self._types[c] for c in np.unique(self._type.data[self._edge_live.data])}),
+            }
+
+    # ----- persistence -----
+
+    def persist(self, persist_path: str, fs: Any = None) -> None:
+        """Writes the live graph to the directory ``persist_path`` (local filesystem only)."""
+        if fs is not None:
+            raise NotImplementedError("LocalPropertyGraphStore only persists to the local filesystem")
+        with self._lock:
+            os.makedirs(persist_path, exist_ok=True)
+            nodes = np.flatnonzero(self._live.data)
+            remap = np.full(len(self._ids), -1, dtype=np.int32)
+            remap[nodes] = np.arange(len(nodes), dtype=np.int32)
+            edges = np.flatnonzero(self._edge_live.data)
+            arrays = {
+                "has_embedding": self._has_embedding.data[nodes],
+                "src": remap[self._src.data[edges]],
+                "dst": remap[self._dst.data[edges]],
+                "type": self._type.data[edges],
+            }
+            if self._embeddings is not None:
+                arrays["embeddings"] = self._embeddings.data[nodes]
+            # persisting the adjacency means loading never has to sort the edges
+            for direction, key in (("out", arrays["src"]), ("in", arrays["dst"])):
+                order = np.argsort(key, kind="stable").astype(np.int32)
+                arrays[f"{direction}_order"] = order
+                arrays[f"{direction}_offsets"] = np.searchsorted(key[order], np.arange(len(nodes) + 1)).astype(np.int64)
+            # write next to the old files and rename, a store mapping the old ones keeps reading them
+            written = []
+
+            def replace(name: str, write: Any) -> None:
+                path = os.path.join(persist_path, name)
+                with open(path + ".tmp", "wb") as f:
+                    write(f)
+                written.append((path + ".tmp", path))
+
+            def lines(rows: Iterable[Any]) -> Any:
+                return lambda f: f.writelines(json.dumps(row, default=str).encode("utf-8") + b"\n" for row in rows)
+
+            for name, array in arrays.items():
+                replace(f"{name}.npy", lambda f, array=array: np.save(f, array))
+            replace("nodes.jsonl", lines([self._ids[i], self._is_entity[i], self._labels[i], self._texts[i],
+                                          self._properties[i]] for i in nodes.tolist()))
+            replace("edges.jsonl", lines(self._edge_properties[e] for e in edges.tolist()))
+            replace("meta.json", lines([{
+                "format": FORMAT_VERSION, "nodes": len(nodes), "edges": len(edges), "types": self._types,
+                "dimensions": self._embeddings.width if self._embeddings is not None else None}]))
+            for tmp, path in written:
+                os.replace(tmp, path)
+            if self.vector_index is not None:
+                self.vector_index.save(os.path.join(persist_path, VECTOR_INDEX_DIR))
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str, mmap: bool = True) -> "LocalPropertyGraphStore":
+        with open(os.path.join(persist_dir, "meta.json")) as f:
+            meta = json.load(f)
+        if meta["format"] != FORMAT_VERSION:
+            raise ValueError(f"unsupported graph format {meta['format']}")
+
+        def load(name: str) -> np.ndarray:
+            return np.load(os.path.join(persist_dir, f"{name}.npy"), mmap_mode="r" if mmap else None)
+
+        store = cls()
+        with open(os.path.join(persist_dir, "nodes.jsonl"), encoding="utf-8") as f:
+            for index, line in enumerate(f):
+                node_id, is_entity, label, text, properties = json.loads(line)
+                store._ids.append(node_id)
+                store._index[node_id] = index
+                store._is_entity.append(is_entity)
+                store._labels.append(label)
+                store._texts.append(text)
+                store._properties.append(properties)
+                store._by_label.setdefault(label, set()).add(index)
+                if is_entity:
+                    store._by_name[text] = index
+        with open(os.path.join(persist_dir, "edges.jsonl"), encoding="utf-8") as f:
+            store._edge_properties = [json.loads(line) for line in f]
+        store._types = list(meta["types"])
+        store._type_codes = {name: code for code, name in enumerate(store._types)}
+        store._live = _Column(bool, data=np.ones(meta["nodes"], dtype=bool))
+        store._has_embedding = _Column(bool, data=load("has_embedding"))
+        if meta["dimensions"] is not None:
+            store._embeddings = _Column(np.float32, width=meta["dimensions"], data=load("embeddings"))
+        store._src = _Column(np.int32, data=load("src"))
+        store._dst = _Column(np.int32, data=load("dst"))
+        store._type = _Column(np.int32, data=load("type"))
+        store._edge_live = _Column(bool, data=np.ones(meta["edges"], dtype=bool))
+        store._edge_index = {(s, t, d): e for e, (s, t, d) in enumerate(zip(
+            store._src.data.tolist(), store._type.data.tolist(), store._dst.data.tolist()))}
+        for direction in ("out", "in"):
+            store._csr[direction] = (load(f"{direction}_offsets"), load(f"{direction}_order"), meta["edges"])
+        if os.path.exists(os.path.join(persist_dir, VECTOR_INDEX_DIR)):
+            from ann_index import load_vector_index
+            store.vector_index = load_vector_index(os.path.join(persist_dir, VECTOR_INDEX_DIR), mmap=mmap)
+        return store
+
+
+if __name__ == "__main__":
+    import random
+    import sys
+    import tempfile
+    import time
+
+    from llama_index.core.graph_stores import SimplePropertyGraphStore
+
+    # python local_graph_store.py [number of entities]
+    entities = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    dimensions = 256
+    random.seed(11)
+    rng = np.random.default_rng(11)
+    names = [f"Entity {i}" for i in range(entities)]
+    labels = ["PERSON", "ORGANIZATION", "LOCATION", "PRODUCT"]
+    vectors = rng.standard_normal((entities, dimensions)).astype(np.float32)
+    nodes = [EntityNode(name=name, label=random.choice(labels), embedding=vector.tolist(),
+                        properties={TRIPLET_SOURCE_KEY: f"chunk-{i // 10}"})
+             for i, (name, vector) in enumerate(zip(names, vectors))]
+    relations = [Relation(label=random.choice(["PARTNERSHIP", "INVESTMENT", "ACQUISITION"]),
+                          source_id=random.choice(names), target_id=random.choice(names))
+                 for _ in range(entities * 3)]
+    print(f"{entities} entities, {len(relations)} relations, {dimensions}-dim embeddings")
+
+    def timed(label, fn, repeat=1):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            result = fn()
+        seconds = (time.perf_counter() - start) / repeat
+        print(f"{label:36}{seconds * 1000:10.2f} ms")
+        return result
+
+    store = LocalPropertyGraphStore()
+    timed("upsert nodes", lambda: store.upsert_nodes(nodes))
+    timed("upsert relations", lambda: store.upsert_relations(relations))
+    seeds = [EntityNode(name=name) for name in random.sample(names, 10)]
+    timed("get_triplets (10 names)", lambda: store.get_triplets(entity_names=[s.name for s in seeds]), 20)
+    timed("get_rel_map (10 nodes, depth 2)", lambda: store.get_rel_map(seeds, depth=2, limit=1000), 20)
+    query = VectorStoreQuery(query_embedding=vectors[0].tolist(), similarity_top_k=10)
+    found, scores = timed("vector_query (top 10)", lambda: store.vector_query(query), 20)
+    assert found[0].name == names[0]
+
+    simple = SimplePropertyGraphStore()
+    simple.upsert_nodes(nodes)
+    simple.upsert_relations(relations)
+    timed("SimplePropertyGraphStore.get_triplets", lambda: simple.get_triplets(entity_names=[s.name for s in seeds]), 5)
+    timed("SimplePropertyGraphStore.get_rel_map", lambda: simple.get_rel_map(seeds, depth=2, limit=1000), 5)
+
+    with tempfile.TemporaryDirectory() as path:
+        timed("persist", lambda: store.persist(path))
+        loaded = timed("from_persist_dir (mmap)", lambda: LocalPropertyGraphStore.from_persist_dir(path))
+        timed("vector_query after load", lambda: loaded.vector_query(query), 20)
+        assert [t[1].label for t in loaded.get_triplets(entity_names=[seeds[0].name])] == \
+            [t[1].label for t in store.get_triplets(entity_names=[seeds[0].name])]
+        del loaded
@@ -0,0 +1,123 @@
+"""Writes a dedup merge plan back to Neo4j in chunks instead of one transaction per group.
+
+Each chunk is a single ``UNWIND $groups`` statement running in its own session, so
+thousands of groups cost a few round trips instead of thousands. A failed chunk is retried
+with exponential backoff. Retrying is safe because the auto-commit transaction of the failed
+attempt was rolled back as a whole.
+"""
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Sequence, Tuple, Type
+
+# Same merge as query_part4_return_nodes, once per group of the chunk
+MERGE_GROUPS_QUERY = """
+UNWIND $groups AS group
+CALL {
+  WITH group
+  UNWIND group AS name
+  MATCH (e:__Entity__ {name:name})
+  WITH e
+  ORDER BY size(e.name) DESC // prefer longer names to remain after merging
+  RETURN collect(e) AS nodes
+}
+CALL apoc.refactor.mergeNodes(nodes, {properties: {
+    `.*`: 'discard'
+}})
+YIELD node
+RETURN count(*) AS merged
+"""
+
+
+@dataclass
+class ChunkResult:
+    index: int
+    groups: int
+    merged: int
+    attempts: int
+    seconds: float
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class MergeWriter:
+    def __init__(self, driver,
+                 chunk_size: int = 500,
+                 max_retries: int = 3,
+                 backoff: float = 0.5,
+                 retry_on: Tuple[Type[BaseException], ...] = (Exception,),
+                 query: str = MERGE_GROUPS_QUERY,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.driver = driver
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.retry_on = retry_on
+        self.query = query
+        self.sleep = sleep
+
+    def chunks(self, plan: Sequence[Sequence[str]]) -> List[List[List[str]]]:
+        groups = [list(group) for group in plan if len(group) > 1]
+        return [groups[i:i + self.chunk_size] for i in range(0, len(groups), self.chunk_size)]
+
+    def write_chunk(self, index: int, groups: List[List[str]]) -> ChunkResult:
+        start = time.perf_counter()
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                with self.driver.session() as session:
+                    record = session.run(self.query, {"groups": groups}).single()
+                merged = record["merged"] if record is not None else 0
+                return ChunkResult(index, len(groups), merged, attempts, time.perf_counter() - start)
+            except self.retry_on as e:
+                if attempts > self.max_retries:
+                    return ChunkResult(index, len(groups), 0, attempts, time.perf_counter() - start, error=repr(e))
+                self.sleep(self.backoff * 2 ** (attempts - 1))
+
+    def write(self, plan: Sequence[Sequence[str]]) -> List[ChunkResult]:
+        """Merges every group of ``plan`` and returns one timing/outcome record per chunk."""
+        return [self.write_chunk(i, chunk) for i, chunk in enumerate(self.chunks(plan))]
+
+
+if __name__ == "__main__":
+    import math
+
+    from fakes import RecordingDriver
+
+    # python merge_writer.py: the statements a plan turns into, against a driver that records them
+    plan = [[f"Entity {i}", f"Entity {i} Inc."] for i in range(1203)] + [["Alone"]]
+    driver = RecordingDriver(lambda query, params: [{"merged": len(params["groups"])}])
+    results = MergeWriter(driver, chunk_size=500).write(plan)
+    assert len(driver.statements) == math.ceil(1203 / 500) == len(results)
+    assert all(query == MERGE_GROUPS_QUERY and "UNWIND $groups" in query for query, _ in driver.statements)
+    assert [params["groups"] for _, params in driver.statements] == [plan[0:500], plan[500:1000], plan[1000:1203]]
+    assert [(r.index, r.groups, r.merged, r.attempts, r.ok) for r in results] == \
+        [(0, 500, 500, 1, True), (1, 500, 500, 1, True), (2, 203, 203, 1, True)]
+    print(f"{len(plan)} groups -> {len(driver.statements)} UNWIND statements")
+
+    class TransientError(Exception):
+        pass
+
+    # the first chunk fails twice and then succeeds, the second never does
+    failures = {"Entity 0": 2, "Entity 2": 10}
+
+    def flaky(query, params):
+        first = params["groups"][0][0]
+        if failures.get(first, 0) > 0:
+            failures[first] -= 1
+            raise TransientError(f"deadlock on {first}")
+        return [{"merged": len(params["groups"])}]
+
+    slept = []
+    driver = RecordingDriver(flaky)
+    results = MergeWriter(driver, chunk_size=2, max_retries=3, backoff=0.5, sleep=slept.append).write(plan[:6])
+    assert [(r.attempts, r.ok) for r in results] == [(3, True), (4, False), (1, True)]
+    assert results[1].merged == 0 and "deadlock on Entity 2" in results[1].error
+    # 0.5s, 1s for the first chunk, then 0.5s, 1s, 2s for the second before it gives up
+    assert slept == [0.5, 1.0, 0.5, 1.0, 2.0]
+    assert len(driver.statements) == 8
+    for result in results:
+        print(f"chunk {result.index}: {result.attempts} attempt(s), {'ok' if result.ok else result.error}")
@@ -0,0 +1,274 @@
+"""Cheap string rules for entity dedup, run before or instead of the embedding comparison.
+
+Names are normalised (lower case, collapsed whitespace) and indexed by character n-grams,
+so only names sharing enough n-grams are ever compared. The edit distance is banded and
+gives up as soon as it cannot stay under the cut-off, so obviously different names never
+pay for a full dynamic programming table.
+
+``NgramIndex.match_candidates`` only skips pairs the match rule cannot accept, so
+``string_candidate_pairs`` finds every match comparing all pairs would. The faster
+``candidate_pairs`` keeps pairs sharing a fixed fraction of their n-grams, and misses
+matches between short names, whose edits leave few n-grams in common.
+
+Run this file directly for a benchmark over a synthetic entity-name corpus.
+"""
+import re
+from bisect import bisect_right
+from collections import Counter
+from typing import Dict, Iterable, List, Sequence, Set, Tuple
+
+NGRAM_SIZE = 3
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_name(name: str) -> str:
+    return _WHITESPACE.sub(" ", name.strip().lower())
+
+
+def levenshtein(a: str, b: str) -> int:
+    """Full edit distance, kept as the reference the bounded version is checked against."""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def bounded_levenshtein(a: str, b: str, max_distance: int) -> int:
+    """Edit distance if it is at most ``max_distance``, otherwise ``max_distance + 1``.
+
+    Only the diagonal band of width 2 * max_distance + 1 is filled in, and the loop exits
+    as soon as a whole row is over the bound.
+    """
+    if a == b:
+        return 0
+    if len(a) > len(b):
+        a, b = b, a
+    over = max_distance + 1
+    if len(b) - len(a) > max_distance:
+        return over
+
+    # common prefix and suffix never change the distance
+    start = 0
+    while start < len(a) and a[start] == b[start]:
+        start += 1
+    end_a, end_b = len(a), len(b)
+    while end_a > start and a[end_a - 1] == b[end_b - 1]:
+        end_a -= 1
+        end_b -= 1
+    a, b = a[start:end_a], b[start:end_b]
+    la, lb = len(a), len(b)
+    if la == 0:
+        return lb if lb <= max_distance else over
+
+    previous = [j if j <= max_distance else over for j in range(lb + 1)]
+    for i in range(1, la + 1):
+        lo = max(1, i - max_distance)
+        hi = min(lb, i + max_distance)
+        current = [over] * (lb + 1)
+        if i <= max_distance:
+            current[0] = i
+        row_min = current[0]
+        ca = a[i - 1]
+        for j in range(lo, hi + 1):
+            value = previous[j - 1] + (ca != b[j - 1])
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if value > over:
+                value = over
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > max_distance:
+            return over
+        previous = current
+    return previous[lb] if previous[lb] <= max_distance else over
+
+
+def names_match(a: str, b: str, max_distance: int = 5) -> bool:
+    # Same rule as the Cypher filter: CONTAINS either way or apoc.text.distance(...) < max_distance
+    a, b = normalize_name(a), normalize_name(b)
+    if not a or not b:
+        # "" is in every name, a blank entity would match all of its label block
+        return False
+    return a in b or b in a or bounded_levenshtein(a, b, max_distance - 1) < max_distance
+
+
+def ngrams(text: str, n: int = NGRAM_SIZE) -> Set[str]:
+    if len(text) <= n:
+        return {text}
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class NgramIndex:
+    """Inverted index from character n-gram to the names containing it."""
+
+    def __init__(self, names: Sequence[str], n: int = NGRAM_SIZE):
+        self.n = n
+        self.names = [normalize_name(name) for name in names]
+        self.grams = [ngrams(name, n) for name in self.names]
+        self.counts = [Counter(name[i:i + n] for i in range(len(name) - n + 1)) for name in self.names]
+        self.postings: Dict[str, List[int]] = {}
+        for i, grams in enumerate(self.grams):
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(i)
+
+    def candidate_pairs(self, min_overlap: float = 0.5, max_posting: int = 1000) -> Iterable[Tuple[int, int]]:
+        """Pairs (i, j), i < j, sharing at least ``min_overlap`` of the smaller n-gram set.
+
+        Identical normalised names always pair up. N-grams found in more than ``max_posting``
+        names (think "ban" or "inc") carry no signal and are skipped when counting.
+        """
+        for i, grams in enumerate(self.grams):
+            shared: Dict[int, int] = {}
+            for gram in grams:
+                posting = self.postings[gram]
+                if len(posting) > max_posting:
+                    continue
+                for j in posting:
+                    if j > i:
+                        shared[j] = shared.get(j, 0) + 1
+            for j, count in shared.items():
+                smaller = min(len(grams), len(self.grams[j]))
+                if count >= min_overlap * smaller or self.names[i] == self.names[j]:
+                    yield i, j
+
+    def match_candidates(self, max_distance: int = 5, max_posting: int = 1000) -> Iterable[Tuple[int, int]]:
+        """Pairs (i, j), i < j, that ``names_match(..., max_distance)`` may accept. No match is left out.
+
+        Names less than ``max_distance`` edits apart share at least max(len) - n + 1 - edits * n
+        n-grams, counted with repeats, and a name inside another shares all of its n-grams.
+        Pairs are compared when their shared n-grams can reach either bound. Where the edit
+        bound is not positive, as it is for names up to (edits + 1) * n - 1 characters, the
+        length difference alone decides. N-grams skipped for a long posting list lower the
+        bounds by what they could have added.
+        """
+        n, edits = self.n, max_distance - 1
+        short = (edits + 1) * n - 1
+        lengths = [len(name) for name in self.names]
+        by_length: Dict[int, List[int]] = {}
+        for i, length in enumerate(lengths):
+            by_length.setdefault(length, []).append(i)
+        # names shorter than n have no n-gram of their own, but can still be inside another name
+        tiny = [i for i, length in enumerate(lengths) if length < n]
+        common = {gram for gram, posting in self.postings.items() if len(posting) > max_posting}
+        skipped_counts = [sum(c for gram, c in counts.items() if gram in common) for counts in self.counts]
+        skipped_grams = [sum(1 for gram in counts if gram in common) for counts in self.counts]
+
+        for i, counts in enumerate(self.counts):
+            la = lengths[i]
+            found: Set[int] = set(range(i + 1, len(self.names))) if la < n else set(tiny[bisect_right(tiny, i):])
+            # max(la, lb) <= short + skipped: the edit bound allows sharing nothing
+            for lb in range(max(0, la - edits), la + edits + 1):
+                if max(la, lb) <= short + skipped_counts[i]:
+                    bucket = by_length.get(lb, ())
+                    found.update(bucket[bisect_right(bucket, i):])
+
+            shared: Dict[int, List[int]] = {}
+            for gram, count in counts.items():
+                if gram in common:
+                    continue
+                for j in self.postings[gram]:
+                    if j > i and j not in found:
+                        totals = shared.setdefault(j, [0, 0])
+                        totals[0] += min(count, self.counts[j][gram])
+                        totals[1] += 1
+            for j, (together, distinct) in shared.items():
+                lb = lengths[j]
+                if abs(la - lb) <= edits and together >= max(la, lb) - n + 1 - edits * n - skipped_counts[i]:
+                    found.add(j)
+                elif distinct + min(skipped_grams[i], skipped_grams[j]) >= len(self.counts[i if la <= lb else j]):
+                    found.add(j)
+            for j in sorted(found):
+                yield i, j
+
+
+def string_candidate_pairs(entities, max_distance: int = 5) -> Iterable[Tuple[int, int]]:
+    """Candidate pairs from names alone, usable as ``DedupEngine(candidate_fn=...)`` instead of embeddings.
+
+    Finds every pair of same-label names that ``names_match`` accepts.
+    """
+    from entity_dedup import block_by_labels
+
+    for indices in block_by_labels(entities).values():
+        index = NgramIndex([entities[i].name for i in indices])
+        for a, b in index.match_candidates(max_distance):
+            if names_match(index.names[a], index.names[b], max_distance):
+                yield indices[a], indices[b]
+
+
+if __name__ == "__main__":
+    import random
+    import sys
+    import time
+
+    # python name_matching.py [number of base names]
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 600
+
+    random.seed(7)
+    syllables = ["star", "ocean", "bank", "amer", "ica", "epic", "game", "fast", "tag", "lo", "go",
+                 "first", "de", "part", "ure", "corp", "net", "sun", "mic", "ro", "soft", "data"]
+    suffixes = [" R", " Inc.", " Corp.", " logos", "s", " Games"]
+
+    def random_name():
+        words = ["".join(random.choices(syllables, k=random.randint(1, 3))) for _ in range(random.randint(1, 3))]
+        return " ".join(word.capitalize() for word in words)
+
+    def variant(name):
+        roll = random.random()
+        if roll < 0.3:
+            return name + random.choice(suffixes)
+        if roll < 0.6:
+            return name.upper() if random.random() < 0.5 else name.lower()
+        i = random.randrange(len(name))
+        return name[:i] + random.choice("abcdefghijklmnopqrstuvwxyz") + name[i + 1:]
+
+    corpus, planted = [], set()
+    for _ in range(size):
+        name = random_name()
+        corpus.append(name)
+        if random.random() < 0.3:
+            corpus.append(variant(name))
+            planted.add((len(corpus) - 2, len(corpus) - 1))
+    print(f"corpus: {len(corpus)} names, {len(planted)} planted duplicates")
+
+    def report(label, seconds, compared, matches):
+        print(f"{label:32}{seconds:8.3f}s  {compared:8} comparisons  {len(matches):6} matches"
+              f"  planted found {len(planted & matches)}/{len(planted)}")
+
+    def naive_match(a, b):
+        a, b = a.lower(), b.lower()
+        return a in b or b in a or levenshtein(a, b) < 5
+
+    t0 = time.perf_counter()
+    naive = {(i, j) for i in range(len(corpus)) for j in range(i + 1, len(corpus)) if naive_match(corpus[i], corpus[j])}
+    naive_s = time.perf_counter() - t0
+    comparisons = len(corpus) * (len(corpus) - 1) // 2
+    report("all pairs, full levenshtein", naive_s, comparisons, naive)
+
+    t0 = time.perf_counter()
+    bounded = {(i, j) for i in range(len(corpus)) for j in range(i + 1, len(corpus)) if names_match(corpus[i], corpus[j])}
+    bounded_s = time.perf_counter() - t0
+    report("all pairs, bounded levenshtein", bounded_s, comparisons, bounded)
+
+    t0 = time.perf_counter()
+    index = NgramIndex(corpus)
+    candidates = list(index.candidate_pairs())
+    indexed = {(i, j) for i, j in candidates if names_match(corpus[i], corpus[j])}
+    indexed_s = time.perf_counter() - t0
+    report("n-gram overlap + bounded", indexed_s, len(candidates), indexed)
+
+    t0 = time.perf_counter()
+    index = NgramIndex(corpus)
+    candidates = list(index.match_candidates())
+    lossless = {(i, j) for i, j in candidates if names_match(corpus[i], corpus[j])}
+    lossless_s = time.perf_counter() - t0
+    report("n-gram bounds + bounded", lossless_s, len(candidates), lossless)
+    assert lossless == bounded
+    assert not names_match("", "Epic") and not names_match("  ", "Epic")
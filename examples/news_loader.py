@@ -0,0 +1,165 @@
+"""Lazy loading of the news articles CSV into llama-index Documents.
+
+``pd.read_csv`` followed by ``iterrows`` parses and wraps every article before the first
+one is used. ``iter_news_documents`` reads the file in chunks and yields one Document at
+a time, so memory stays flat on multi-GB dumps, and extraction can start as soon as the
+first chunk is parsed.
+
+Every Document gets the id ``news-<row>``, where row is the article's position in the file.
+``OffsetCheckpoint`` remembers which rows made it into the graph so an interrupted ingest
+can resume from the first row that did not.
+"""
+import json
+import os
+from typing import IO, Any, Dict, Iterable, Iterator, Optional, Set, Union
+
+import pandas as pd
+from llama_index.core import Document
+
+DOC_ID_PREFIX = "news-"
+
+
+def iter_news_documents(source: Union[str, IO],
+                        start: int = 0,
+                        limit: Optional[int] = None,
+                        chunksize: int = 1000) -> Iterator[Document]:
+    """Documents for rows ``start`` to ``start + limit`` of ``source`` (a path, URL or open file)."""
+    if limit is not None and limit <= 0:
+        return
+    emitted = 0
+    # rows before start are skipped by the parser, they are never turned into Python objects
+    reader = pd.read_csv(source, usecols=["title", "text"], chunksize=chunksize,
+                         skiprows=range(1, start + 1) if start else None)
+    with reader:
+        row = start
+        for chunk in reader:
+            titles = chunk["title"].fillna("").astype(str).tolist()
+            texts = chunk["text"].fillna("").astype(str).tolist()
+            for title, text in zip(titles, texts):
+                yield Document(text=f"{title}: {text}", id_=f"{DOC_ID_PREFIX}{row}")
+                row += 1
+                emitted += 1
+                if limit is not None and emitted >= limit:
+                    return
+
+
+def document_row(doc_id: str) -> Optional[int]:
+    if doc_id and doc_id.startswith(DOC_ID_PREFIX):
+        return int(doc_id[len(DOC_ID_PREFIX):])
+    return None
+
+
+class OffsetCheckpoint:
+    """Tracks finished rows and persists the first row that is not finished yet.
+
+    Chunks finish out of order when ingestion is concurrent, so a row only counts once all
+    of its chunks are written, and only the contiguous prefix of finished rows is saved.
+    Resuming from ``resume_from`` never skips an unfinished article, at worst it re-ingests a
+    few that were already done.
+    """
+
+    def __init__(self, path: str, start: Optional[int] = None):
+        self.path = path
+        if start is None:
+            start = 0
+            if os.path.exists(path):
+                with open(path) as f:
+                    start = json.load(f)["resume_from"]
+        self.resume_from = start
+        self._pending: Dict[int, int] = {}
+        self._done: Set[int] = set()
+
+    def chunk_documents(self, documents: Iterable[Document], splitter: Any = None) -> Iterator[Any]:
+        """Splits documents into chunks like kg_ingestion.chunk_documents, counting the chunks of every row."""
+        from kg_ingestion import chunk_documents
+
+        for document in documents:
+            nodes = list(chunk_documents([document], splitter))
+            row = document_row(document.doc_id)
+            if row is not None:
+                if nodes:
+                    self._pending[row] = len(nodes)
+                else:
+                    self.mark_done([row])
+            yield from nodes
+
+    def mark_done(self, rows: Iterable[int]) -> None:
+        self._done.update(row for row in rows if row >= self.resume_from)
+        moved = False
+        while self.resume_from in self._done:
+            self._done.discard(self.resume_from)
+            self.resume_from += 1
+            moved = True
+        if moved:
+            self.save()
+
+    def mark_nodes_done(self, nodes: Iterable[Any]) -> None:
+        """Counts ingested chunks against their rows, for use in an ingestion sink."""
+        finished = []
+        for node in nodes:
+            row = document_row(node.ref_doc_id)
+            if row is None or row not in self._pending:
+                continue
+            self._pending[row] -= 1
+            if self._pending[row] == 0:
+                del self._pending[row]
+                finished.append(row)
+        self.mark_done(finished)
+
+    def save(self) -> None:
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"resume_from": self.resume_from}, f)
+        os.replace(tmp, self.path)
+
+
+if __name__ == "__main__":
+    import io
+    import tempfile
+
+    from llama_index.core.node_parser import SentenceSplitter
+
+    # python news_loader.py
+    rows = [("Port strike", "Dockworkers walked out.\n" + "Shipping lines rerouted, \"for now\", said an agent. " * 12),
+            ("Rate cut", "The central bank cut rates."),
+            ("", "An article without a title."),
+            ("Merger", "Velora Logistics agreed to buy Acme Systems.\n\nThe deal closes in May."),
+            ("Recall", "A carmaker recalled 10,000 vehicles.")]
+    csv = pd.DataFrame({"author": "staff", "title": rows[i][0] or None, "text": rows[i][1]}
+                       for i in range(len(rows))).to_csv(index=False)
+    assert csv.count("\n") > len(rows) + 1  # records span lines
+
+    def load(**kwargs):
+        return [(document.doc_id, document.text) for document in
+                iter_news_documents(io.StringIO(csv), chunksize=2, **kwargs)]
+
+    everything = load()
+    assert everything == [(f"news-{i}", f"{title}: {text}") for i, (title, text) in enumerate(rows)]
+    # a start after a multiline record skips records, not lines
+    assert load(start=1, limit=3) == everything[1:4] and load(start=4) == everything[4:]
+    assert load(limit=0) == []
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "checkpoint.json")
+        checkpoint = OffsetCheckpoint(path)
+        # a splitter small enough that the first article has several chunks
+        nodes = list(checkpoint.chunk_documents(iter_news_documents(io.StringIO(csv)),
+                                                SentenceSplitter(chunk_size=64, chunk_overlap=0)))
+        by_row = {}
+        for node in nodes:
+            by_row.setdefault(document_row(node.ref_doc_id), []).append(node)
+        assert len(by_row[0]) > 1, by_row[0]
+        # rows finishing out of order: only the contiguous prefix is saved
+        checkpoint.mark_nodes_done(by_row[2] + by_row[1] + by_row[0][:1])
+        assert checkpoint.resume_from == 0 and not os.path.exists(path)
+        checkpoint.mark_nodes_done(by_row[0][1:] + by_row[4])
+        assert checkpoint.resume_from == 3 and OffsetCheckpoint(path).resume_from == 3
+        checkpoint.mark_nodes_done(by_row[3])
+        assert OffsetCheckpoint(path).resume_from == 5
+
+        # an interrupted ingest resumes with the first article it did not finish
+        with open(path, "w") as f:
+            json.dump({"resume_from": 3}, f)
+        resumed = OffsetCheckpoint(path)
+        assert load(start=resumed.resume_from) == everything[3:]
+    print(f"{len(rows)} articles, {len(nodes)} chunks: multiline records, resume and out of order rows checked")
@@ -0,0 +1,248 @@
+"""TeacherCrew's reflection loop, with several candidate answers generated and reviewed at once.
+
+``TeacherCrew`` in 07_llama_index_workflow_global_context.py takes turns: the teacher answers,
+the reviewer gives feedback, the teacher answers again. Every call waits for the one before it,
+so two attempts cost four LLM latencies back to back. ``ParallelReflection`` asks the same
+question ``candidates`` times at once, at a spread of temperatures, and each answer is
+reviewed as soon as it comes back. The reviewer ends with a score:
+
+* the first candidate scoring ``threshold`` or more is the answer, and the rest are not
+  waited for,
+* otherwise, once the round is complete, the best candidate is refined with its feedback,
+  again ``candidates`` times at once, for up to ``max_rounds`` rounds,
+* the best candidate seen is returned when the rounds run out.
+
+A round takes about one generation plus one review, whatever the number of candidates.
+Run this file for a comparison with the one-after-another loop, using a fake LLM.
+"""
+import re
+from dataclasses import dataclass
+from typing import Any, List, Optional
+
+from llama_index.core.bridge.pydantic import BaseModel
+from llama_index.core.workflow import Context, StartEvent, StopEvent, Workflow, step
+
+from workflow_fanout import Branch, BranchResult, FanIn, branch_result, fan_out
+
+# candidates drafted and reviewed at the same time, across all runs of one workflow instance
+MAX_PARALLEL_CANDIDATES = 8
+
+TEACHER_PROMPT = """You are an experienced {subject} teacher.
+Please provide an answer to the user query \n query:{query}."""
+
+REFINE_PROMPT = """You are an experienced {subject} teacher.
+Please improve your earlier answer to the user query, incorporating the reviewer's feedback \n
+query:{query} \n
+answer:{answer} \n
+feedback:{feedback}"""
+
+REVIEW_PROMPT = """You are reviewer of a response provided against a query.
+Please provide your feedback to improve the response.
+Below is the query and response for your review \n
+query:{query} \n
+response:{response} \n
+End your feedback with a line "Score: <0-10>" rating how good the response is.
+feedback:
+"""
+
+_SCORE = re.compile(r"score\s*[:=]\s*(\d+(?:\.\d+)?)", re.IGNORECASE)
+
+
+def parse_score(feedback: str) -> float:
+    """The last ``Score: n`` in the reviewer's feedback, 0 when there is none."""
+    scores = _SCORE.findall(feedback)
+    return float(scores[-1]) if scores else 0.0
+
+
+def temperatures(count: int, low: float = 0.2, high: float = 1.0) -> List[float]:
+    # one candidate at the usual low temperature, the others increasingly adventurous
+    if count == 1:
+        return [low]
+    return [round(low + (high - low) * i / (count - 1), 2) for i in range(count)]
+
+
+class Candidate(BaseModel):
+    answer: str
+    feedback: str
+    score: float
+    round: int
+
+
+class Draft(Branch):
+    query: str
+    subject: str
+    round: int
+    temperature: float
+    best: Optional[Candidate] = None
+
+
+class Reviewed(BranchResult):
+    query: str
+    subject: str
+    round: int
+    candidate: Optional[Candidate] = None
+    best: Optional[Candidate] = None
+
+
+@dataclass
+class Reflection:
+    best: Candidate
+    rounds: int
+
+    def __str__(self) -> str:
+        # the same shape as TeacherCrew's result
+        return "final response : \n" + self.best.answer + "\n feedback:" + self.best.feedback
+
+
+class ParallelReflection(Workflow):
+    """Run with ``query`` and ``category`` like ``TeacherCrew``. Returns a ``Reflection``."""
+
+    drafts = FanIn()
+
+    def __init__(self, llm: Any, candidates: int = 3, threshold: float = 8.0, max_rounds: int = 2, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.llm = llm
+        self.candidates = candidates
+        self.threshold = threshold
+        self.max_rounds = max_rounds
+
+    def _fan_out(self, ctx: Context, query: str, subject: str, round: int, best: Optional[Candidate]) -> None:
+        fan_out(ctx, [Draft(query=query, subject=subject, round=round, temperature=t, best=best)
+                      for t in temperatures(self.candidates)])
+
+    @step
+    async def router(self, ctx: Context, ev: StartEvent) -> Draft | None:
+        subject = "maths" if ev.category.lower() == "math" else "physics"
+        self._fan_out(ctx, ev.query, subject, 1, None)
+        return None
+
+    @step(num_workers=MAX_PARALLEL_CANDIDATES)
+    async def draft(self, ev: Draft) -> Reviewed:
+        if ev.best is None:
+            prompt = TEACHER_PROMPT.format(subject=ev.subject, query=ev.query)
+        else:
+            prompt = REFINE_PROMPT.format(subject=ev.subject, query=ev.query, answer=ev.best.answer,
+                                          feedback=ev.best.feedback)
+        try:
+            answer = str(await self.llm.acomplete(prompt, temperature=ev.temperature))
+            feedback = str(await self.llm.acomplete(REVIEW_PROMPT.format(query=ev.query, response=answer)))
+        except Exception as e:
+            # one failed candidate should not sink the others
+            return branch_result(ev, Reviewed, query=ev.query, subject=ev.subject, round=ev.round, best=ev.best,
+                                 error=repr(e))
+        candidate = Candidate(answer=answer, feedback=feedback, score=parse_score(feedback), round=ev.round)
+        return branch_result(ev, Reviewed, query=ev.query, subject=ev.subject, round=ev.round,
+                             candidate=candidate, best=ev.best)
+
+    @step
+    async def judge(self, ctx: Context, ev: Reviewed) -> Draft | StopEvent | None:
+        if ev.candidate is not None and ev.candidate.score >= self.threshold:
+            # good enough: the candidates still being written are abandoned with the run
+            self.drafts.discard(ctx, ev.batch)
+            return StopEvent(result=Reflection(ev.candidate, ev.round))
+        results = self.drafts.collect(ctx, ev)
+        if results is None:
+            return None
+        pool = [r.candidate for r in results if r.candidate is not None] + ([ev.best] if ev.best else [])
+        if not pool:
+            raise RuntimeError(f"every candidate failed in round {ev.round}: {results[0].error}")
+        best = max(pool, key=lambda c: c.score)
+        if ev.round >= self.max_rounds:
+            return StopEvent(result=Reflection(best, ev.round))
+        self._fan_out(ctx, ev.query, ev.subject, ev.round + 1, best)
+        return None
+
+
+if __name__ == "__main__":
+    import asyncio
+    import hashlib
+    import itertools
+    import sys
+    import time
+
+    from fakes import FakeLLM
+
+    # python parallel_reflection.py [candidates] [threshold]
+    candidates = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    threshold = float(sys.argv[2]) if len(sys.argv) > 2 else 8.0
+    numbers = itertools.count(1)
+
+    def respond(prompt: str) -> str:
+        if "Score: <0-10>" in prompt:
+            # a stable score per answer, between 3 and 9
+            score = 3 + hashlib.blake2b(prompt.encode("utf-8"), digest_size=1).digest()[0] % 7
+            return f"Mention Snell's law.\nScore: {score}"
+        return f"answer #{next(numbers)}: reflection is light bouncing off a surface"
+
+    def fake_llm() -> FakeLLM:
+        return FakeLLM(latency=0.3, jitter=0.3, responder=respond)
+
+    async def one_after_another(llm, query, attempts=2):
+        # what TeacherCrew does: answer, review, answer again with the feedback, review
+        feedback = ""
+        for _ in range(attempts):
+            answer = str(await llm.acomplete(TEACHER_PROMPT.format(subject="physics", query=query) + feedback))
+            feedback = str(await llm.acomplete(REVIEW_PROMPT.format(query=query, response=answer)))
+        return answer, parse_score(feedback)
+
+    class ScriptedLLM:
+        """Drafts come back after ``delays[temperature]`` seconds, the reviewer gives the scripted scores."""
+
+        def __init__(self, delays, scores):
+            self.delays, self.scores = delays, scores
+            self.prompts: List[str] = []
+
+        async def acomplete(self, prompt: str, temperature: Optional[float] = None):
+            from llama_index.core.base.llms.types import CompletionResponse
+
+            self.prompts.append(prompt)
+            if temperature is None:
+                answer = next(answer for answer in self.scores if f"response:{answer} " in prompt)
+                return CompletionResponse(text=f"Feedback on {answer}.\nScore: {self.scores[answer]}")
+            await asyncio.sleep(self.delays[temperature])
+            kind = "draft" if "improve your earlier answer" not in prompt else "refined"
+            return CompletionResponse(text=f"{kind} at {temperature}")
+
+    async def check():
+        # three candidates, at 0.2, 0.6 and 1.0: the quick one is good enough, the others are not waited for
+        llm = ScriptedLLM({0.2: 0.05, 0.6: 0.5, 1.0: 0.5},
+                          {"draft at 0.2": 9, "draft at 0.6": 5, "draft at 1.0": 4})
+        crew = ParallelReflection(llm=llm, candidates=3, threshold=8.0, timeout=10)
+        start = time.perf_counter()
+        handler = crew.run(query="q", category="physics")
+        result = await handler
+        assert time.perf_counter() - start < 0.4, "waited for the slow candidates"
+        assert (result.best.answer, result.best.score, result.rounds) == ("draft at 0.2", 9, 1)
+        # the slow candidates finish or are cancelled after the stop, neither reopens the batch
+        await asyncio.sleep(0.6)
+        assert crew.drafts.in_flight() == 0
+
+        # nothing good enough: the best of round 1 is refined by every candidate in round 2
+        llm = ScriptedLLM({0.2: 0.05, 0.6: 0.1, 1.0: 0.15},
+                          {"draft at 0.2": 5, "draft at 0.6": 7, "draft at 1.0": 4,
+                           "refined at 0.2": 6, "refined at 0.6": 9, "refined at 1.0": 8})
+        result = await ParallelReflection(llm=llm, candidates=3, threshold=10.0, timeout=10).run(
+            query="q", category="physics")
+        refines = [p for p in llm.prompts if "improve your earlier answer" in p]
+        assert len(refines) == 3 and all("answer:draft at 0.6" in p and "Feedback on draft at 0.6" in p
+                                         for p in refines)
+        assert (result.best.answer, result.best.score, result.rounds) == ("refined at 0.6", 9, 2)
+
+    async def main():
+        await check()
+        query = "what is reflection?"
+        llm = fake_llm()
+        start = time.perf_counter()
+        answer, score = await one_after_another(llm, query)
+        print(f"one after another  {time.perf_counter() - start:6.2f}s  score {score:g}, {llm.calls} calls")
+
+        for limit in (threshold, 11.0):
+            llm = fake_llm()
+            crew = ParallelReflection(llm=llm, candidates=candidates, threshold=limit, max_rounds=2, timeout=60)
+            start = time.perf_counter()
+            result = await crew.run(query=query, category="physics")
+            label = f"{candidates} at once, stop at {limit:g}"
+            print(f"{label:28}{time.perf_counter() - start:6.2f}s  score {result.best.score:g} "
+                  f"after {result.rounds} round(s), {llm.calls} calls")
+
+    asyncio.run(main())
@@ -0,0 +1,237 @@
+"""Fan-out/fan-in for llama_index workflows: one step emits many events, a pool of workers handles them, one step joins.
+
+The steps in 06_llama_index_workflow.py and 07_llama_index_workflow_global_context.py pass a
+single event from one step to the next, so independent LLM calls (several reviewers, several
+subject agents) run one after another. The workflow runtime can already do better:
+
+* ``ctx.send_event`` puts any number of events on a step's queue,
+* ``@step(num_workers=n)`` gives that step a pool of ``n`` workers (older releases default to 1),
+* ``ctx.collect_events`` joins a fixed list of event types.
+
+``collect_events`` buffers by event type for each step. Two fan-outs in flight at once (a
+loop that fans out every round, or a collector shared by two branches) get their results
+mixed up, and the collector has to know in advance how many results to expect.
+
+``fan_out`` stamps each ``Branch`` event with a batch id, its position and the batch size.
+A worker copies these to its ``BranchResult`` with ``branch_result``. ``FanIn.collect``
+hands back the complete batch, in the order it was sent, as soon as the last result
+arrives. It also stamps when each event was sent and from which step's span, so tracers
+(workflow_trace.py) can tell how long branches waited for a free worker.
+
+    class Review(Branch):
+        reviewer: str
+
+    class Reviewed(BranchResult):
+        text: str = ""
+
+    class Panel(Workflow):
+        reviews = FanIn()
+
+        @step
+        async def start(self, ctx: Context, ev: StartEvent) -> Review | None:
+            fan_out(ctx, [Review(reviewer=name) for name in ev.reviewers])
+
+        @step(num_workers=4)
+        async def review(self, ev: Review) -> Reviewed:
+            return branch_result(ev, Reviewed, text=...)
+
+        @step
+        async def join(self, ctx: Context, ev: Reviewed) -> StopEvent | None:
+            results = self.reviews.collect(ctx, ev)
+            if results is not None:
+                return StopEvent(result=[r.text for r in results])
+
+Fanning out ``n`` LLM calls to ``n`` workers makes the batch take about as long as its
+slowest call, not the sum of all of them. Run this file for a comparison with fake LLMs.
+"""
+import time
+import uuid
+import weakref
+from typing import Any, Dict, List, Optional, Sequence, Set, Type, TypeVar
+
+from llama_index.core.instrumentation.span import active_span_id
+from llama_index.core.workflow import Context, Event
+
+R = TypeVar("R", bound="BranchResult")
+
+
+class Branch(Event):
+    """An event handled by a fanned-out step. ``fan_out`` fills in where it belongs."""
+
+    batch: str = ""
+    index: int = 0
+    total: int = 0
+    sent_at: float = 0.0
+    sent_from: Optional[str] = None
+
+
+class BranchResult(Event):
+    """What a fanned-out step returns for its ``Branch``. A worker that fails can set ``error`` instead of raising."""
+
+    batch: str = ""
+    index: int = 0
+    total: int = 0
+    error: Optional[str] = None
+
+
+def fan_out(ctx: Context, events: Sequence[Branch], step: Optional[str] = None) -> str:
+    """Sends ``events`` as one batch, to ``step`` or to whichever steps accept them. Returns the batch id.
+
+    The sending step must list the branch event type in its return annotation, so the
+    workflow validation knows something produces it, and then return None.
+    """
+    if not events:
+        # nothing would ever reach the collector
+        raise ValueError("fan_out needs at least one event")
+    batch = uuid.uuid4().hex
+    sent_at, sent_from = time.time(), active_span_id.get()
+    for index, event in enumerate(events):
+        event.batch, event.index, event.total = batch, index, len(events)
+        event.sent_at, event.sent_from = sent_at, sent_from
+        ctx.send_event(event, step=step)
+    return batch
+
+
+def branch_result(branch: Branch, result_cls: Type[R], **fields: Any) -> R:
+    """A ``result_cls`` event for ``branch``, carrying its batch, position and batch size."""
+    return result_cls(batch=branch.batch, index=branch.index, total=branch.total, **fields)
+
+
+class _Batches:
+    __slots__ = ("pending", "missing", "discarded")
+
+    def __init__(self):
+        self.pending: Dict[str, List[Optional[BranchResult]]] = {}
+        self.missing: Dict[str, int] = {}
+        self.discarded: Set[str] = set()
+
+
+class FanIn:
+    """Joins the results of each batch, run by run, so a single instance can be shared by every run.
+
+    A run's open batches are kept with its context store and go away with it, also when the
+    run failed, timed out or was cancelled before they completed.
+    """
+
+    def __init__(self):
+        self._runs: "weakref.WeakKeyDictionary[Any, _Batches]" = weakref.WeakKeyDictionary()
+
+    def _batches(self, ctx: Context) -> _Batches:
+        # every step of a run gets its own Context, they all share the run's store
+        batches = self._runs.get(ctx.store)
+        if batches is None:
+            batches = self._runs[ctx.store] = _Batches()
+        return batches
+
+    def collect(self, ctx: Context, result: BranchResult) -> Optional[List[BranchResult]]:
+        """The whole batch in the order it was sent once ``result`` completes it, else None."""
+        batches = self._batches(ctx)
+        if result.batch in batches.discarded:
+            # a straggler of a batch given up on, it must not open the batch again
+            return None
+        slots = batches.pending.get(result.batch)
+        if slots is None:
+            slots = batches.pending[result.batch] = [None] * result.total
+            batches.missing[result.batch] = result.total
+        if slots[result.index] is None:
+            batches.missing[result.batch] -= 1
+        slots[result.index] = result
+        if batches.missing[result.batch]:
+            return None
+        del batches.pending[result.batch], batches.missing[result.batch]
+        return slots
+
+    def in_flight(self) -> int:
+        """Number of batches still waiting for results, in the runs that are still around."""
+        return sum(len(batches.pending) for batches in list(self._runs.values()))
+
+    def discard(self, ctx: Context, batch: str) -> None:
+        """Drops a batch of this run that will never complete. Results still arriving for it are ignored."""
+        batches = self._batches(ctx)
+        batches.pending.pop(batch, None)
+        batches.missing.pop(batch, None)
+        batches.discarded.add(batch)
+
+
+if __name__ == "__main__":
+    import asyncio
+    import gc
+    import sys
+    from types import SimpleNamespace
+
+    from llama_index.core.workflow import StartEvent, StopEvent, Workflow, step
+
+    from fakes import FakeLLM
+
+    # python workflow_fanout.py [number of reviewers]
+    reviewers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    llm = FakeLLM(latency=0.2)
+
+    class Review(Branch):
+        reviewer: str
+        text: str
+
+    class Reviewed(BranchResult):
+        feedback: str = ""
+
+    class ReviewPanel(Workflow):
+        reviews = FanIn()
+
+        @step
+        async def start(self, ctx: Context, ev: StartEvent) -> Review | None:
+            fan_out(ctx, [Review(reviewer=f"reviewer {i}", text=ev.text) for i in range(ev.reviewers)])
+            return None
+
+        @step(num_workers=reviewers)
+        async def review(self, ev: Review) -> Reviewed:
+            response = await llm.acomplete(f"You are {ev.reviewer}. Review this text:\n{ev.text}")
+            return branch_result(ev, Reviewed, feedback=str(response))
+
+        @step
+        async def join(self, ctx: Context, ev: Reviewed) -> StopEvent | None:
+            results = self.reviews.collect(ctx, ev)
+            if results is None:
+                return None
+            return StopEvent(result=[r.feedback for r in results])
+
+    async def main():
+        text = "Climate change affects ecosystems, economies and human livelihoods."
+        start = time.perf_counter()
+        sequential = [str(await llm.acomplete(f"You are reviewer {i}. Review this text:\n{text}"))
+                      for i in range(reviewers)]
+        print(f"one after another  {time.perf_counter() - start:6.2f}s")
+
+        panel = ReviewPanel(timeout=60, verbose=False)
+        start = time.perf_counter()
+        fanned = await panel.run(text=text, reviewers=reviewers)
+        print(f"fanned out         {time.perf_counter() - start:6.2f}s  ({reviewers} reviewers, {llm.latency}s each)")
+        assert fanned == sequential and panel.reviews.in_flight() == 0
+
+        # results of a discarded batch that arrive afterwards do not open it again
+        class Store:
+            pass
+
+        # all FanIn reads from a step's context is the run's store
+        run = SimpleNamespace(store=Store())
+        late = [Reviewed(batch="abandoned", index=i, total=3) for i in range(3)]
+        fan_in = FanIn()
+        assert fan_in.collect(run, late[0]) is None and fan_in.in_flight() == 1
+        fan_in.discard(run, "abandoned")
+        assert fan_in.collect(run, late[1]) is None and fan_in.collect(run, late[2]) is None
+        assert fan_in.in_flight() == 0
+
+        # two runs on one workflow at once do not mix their batches
+        start = time.perf_counter()
+        both = await asyncio.gather(panel.run(text=text, reviewers=reviewers), panel.run(text=text, reviewers=3))
+        print(f"two runs at once   {time.perf_counter() - start:6.2f}s  ({[len(r) for r in both]} results)")
+
+        # a run that times out with its batch half collected does not leave it behind
+        try:
+            await ReviewPanel(timeout=llm.latency * 1.5, verbose=False).run(text=text, reviewers=reviewers * 2)
+        except Exception:
+            pass
+        await asyncio.sleep(0)  # the cancelled workers finish on the next turn of the loop
+        gc.collect()
+        assert panel.reviews.in_flight() == 0, panel.reviews.in_flight()
+
+    asyncio.run(main())
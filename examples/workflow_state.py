@@ -0,0 +1,398 @@
+"""Typed per-run state for llama_index workflows: declared fields, cheap snapshots, large values kept on disk.
+
+``TeacherCrew`` keeps a run's state in ``ctx.data``, a plain dict: any step can write any key
+with any value, so the whole LLM response objects end up there, raw provider payload
+included. Nothing says which keys exist, a typo is a new key, and the only way to checkpoint
+the state is to deep-copy all of it. With many runs in flight, those response objects are
+most of the memory of each run.
+
+Here the state of a run is declared once, as a frozen dataclass with ``slots=True``:
+
+    @dataclass(frozen=True, slots=True)
+    class TeacherState:
+        category: str = "physics"
+        attempt: int = 0
+        response: Optional[str] = field(default=None, metadata={"spill": True})
+
+    class TeacherCrew(Workflow):
+        state = StateSlot(TeacherState, blobs=BlobStore())
+
+        @step
+        async def agent(self, ctx: Context, ev: StartEvent) -> ...:
+            state = await self.state.of(ctx)
+            await self.state.update(ctx, attempt=state.attempt + 1, response=response.text)
+
+* ``update`` checks each value against the field's annotation and raises ``TypeError`` for a
+  wrong type or an unknown field,
+* the current state is an immutable instance, and ``update`` makes a new one that shares
+  every unchanged value. ``snapshot()`` is therefore free and never changes afterwards: a
+  copy-on-write checkpoint. ``restore`` goes back to one, and ``dumps``/``loads`` turn one
+  into JSON and back,
+* values of fields with ``metadata={"spill": True}`` that pickle to ``min_bytes`` or more are
+  written to the ``BlobStore`` and the state keeps a ``BlobRef``. Reading the field loads
+  the value back. Blobs are named by a hash of their content, so runs that hold the same
+  text share one file, and snapshots only copy the references.
+
+``StateSlot`` keeps each run's state in the run's context store (``ctx.data`` on the releases
+that have it), so one workflow instance can serve many runs at once. It is stored as the
+``dumps`` JSON, which keeps the context serializable for checkpoints: fields that are not
+spilled must hold JSON values. A checkpoint only names the blobs, so give a ``BlobStore``
+that outlives the run a directory. The slot also keeps the decoded state of each run, so
+reading the state does not parse the JSON again. Blobs are never deleted while they are
+written: call ``slot.discard(ctx)`` when a run ends, and every blob that no live run of the
+slot refers to is deleted, including those of runs that were dropped without ending.
+"""
+import dataclasses
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import types
+import typing
+import weakref
+from dataclasses import dataclass
+from typing import Any, Generic, Iterable, Optional, Tuple, Type, TypeVar
+
+S = TypeVar("S")
+
+
+@dataclass(frozen=True, slots=True)
+class BlobRef:
+    key: str
+    size: int
+
+
+class BlobStore:
+    """Pickled values in ``directory``, one file per distinct value. Without a directory, a temporary one."""
+
+    def __init__(self, directory: Optional[str] = None, min_bytes: int = 4096):
+        self._temporary = directory is None
+        self.directory = directory or tempfile.mkdtemp(prefix="workflow_blobs_")
+        os.makedirs(self.directory, exist_ok=True)
+        self.min_bytes = min_bytes
+        self.stored = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def put(self, data: bytes) -> BlobRef:
+        key = hashlib.sha256(data).hexdigest()
+        path = self._path(key)
+        if not os.path.exists(path):
+            # written aside and renamed, so a reader never sees half a blob
+            partial = f"{path}.{os.getpid()}.tmp"
+            with open(partial, "wb") as f:
+                f.write(data)
+            os.replace(partial, path)
+            self.stored += 1
+        return BlobRef(key, len(data))
+
+    def get(self, ref: BlobRef) -> Any:
+        with open(self._path(ref.key), "rb") as f:
+            return pickle.load(f)
+
+    def collect(self, live: Iterable[BlobRef]) -> int:
+        """Deletes every blob in the directory but ``live``. Returns how many were deleted."""
+        keep = {ref.key for ref in live}
+        deleted = 0
+        for name in os.listdir(self.directory):
+            # .tmp files are blobs still being written
+            if name not in keep and not name.endswith(".tmp"):
+                try:
+                    os.remove(self._path(name))
+                    deleted += 1
+                except FileNotFoundError:
+                    pass
+        return deleted
+
+    def close(self) -> None:
+        """Removes a temporary directory. A directory that was passed in is left for later runs."""
+        if self._temporary:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def _matches(value: Any, hint: Any) -> bool:
+    """Whether ``value`` fits the annotation ``hint``, as far as a cheap isinstance check can tell."""
+    if hint is Any:
+        return True
+    origin = typing.get_origin(hint)
+    if origin in (typing.Union, types.UnionType):
+        return any(_matches(value, arg) for arg in typing.get_args(hint))
+    if origin is not None:
+        hint = origin  # List[str] is checked as a list, not item by item
+    if hint is type(None):
+        return value is None
+    if hint is float:
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    return not isinstance(hint, type) or isinstance(value, hint)
+
+
+class _Schema:
+    def __init__(self, cls: Type):
+        if not (dataclasses.is_dataclass(cls) and cls.__dataclass_params__.frozen):
+            raise TypeError(f"{cls.__name__} must be a frozen dataclass")
+        self.cls = cls
+        hints = typing.get_type_hints(cls)
+        self.fields = {f.name: hints[f.name] for f in dataclasses.fields(cls)}
+        self.spilled = {f.name for f in dataclasses.fields(cls) if f.metadata.get("spill")}
+
+
+class RunState(Generic[S]):
+    __slots__ = ("_schema", "_current", "blobs")
+
+    def __init__(self, schema: Type[S], blobs: Optional[BlobStore] = None, initial: Optional[S] = None):
+        object.__setattr__(self, "_schema", schema if isinstance(schema, _Schema) else _Schema(schema))
+        object.__setattr__(self, "blobs", blobs)
+        object.__setattr__(self, "_current", initial if initial is not None else self._schema.cls())
+
+    def __getattr__(self, name: str) -> Any:
+        value = getattr(self._current, name)
+        if isinstance(value, BlobRef):
+            return self.blobs.get(value)
+        return value
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"use update({name}=...) to change the state")
+
+    def update(self, **changes: Any) -> None:
+        for name, value in changes.items():
+            if name not in self._schema.fields:
+                raise TypeError(f"{self._schema.cls.__name__} has no field {name!r}")
+            if not _matches(value, self._schema.fields[name]):
+                hint = self._schema.fields[name]
+                raise TypeError(f"{self._schema.cls.__name__}.{name} is {getattr(hint, '__name__', hint)}, "
+                                f"not {type(value).__name__}")
+            if name in self._schema.spilled and self.blobs is not None and value is not None:
+                data = pickle.dumps(value)
+                if len(data) >= self.blobs.min_bytes:
+                    changes[name] = self.blobs.put(data)
+        object.__setattr__(self, "_current", dataclasses.replace(self._current, **changes))
+
+    def snapshot(self) -> S:
+        """The state as it is now. Spilled fields are ``BlobRef``s. Later updates do not change it."""
+        return self._current
+
+    def restore(self, snapshot: S) -> None:
+        object.__setattr__(self, "_current", snapshot)
+
+    def dumps(self, snapshot: Optional[S] = None) -> str:
+        """``snapshot``, by default the current state, as JSON. Spilled values stay in the blob store."""
+        values = {}
+        for name in self._schema.fields:
+            value = getattr(snapshot if snapshot is not None else self._current, name)
+            values[name] = {"blob": value.key, "size": value.size} if isinstance(value, BlobRef) else value
+        return json.dumps(values)
+
+    def loads(self, text: str) -> S:
+        values = json.loads(text)
+        for name, value in values.items():
+            if isinstance(value, dict) and set(value) == {"blob", "size"}:
+                values[name] = BlobRef(value["blob"], value["size"])
+        return self._schema.cls(**values)
+
+    def __repr__(self) -> str:
+        return f"RunState({self._current!r})"
+
+
+class StateSlot(Generic[S]):
+    """A workflow's declared run state, kept in the run's context as the JSON of ``RunState.dumps``.
+
+    ``await slot.of(ctx)`` is a ``RunState`` view of the run ``ctx`` belongs to and
+    ``await slot.update(ctx, ...)`` changes the run's state. The context only ever holds a
+    string, so ``ctx.to_dict()`` can checkpoint it. The slot keeps each run's decoded state
+    with the run's context store, so the JSON is only parsed again when the context holds
+    another one, e.g. after a restore. ``slot.discard(ctx)`` ends a run and deletes the blobs
+    no live run refers to.
+    """
+
+    def __init__(self, schema: Type[S], blobs: Optional[BlobStore] = None, key: str = "run_state"):
+        self.schema = _Schema(schema)
+        self.blobs = blobs
+        self.key = key
+        # per run: the JSON in its context and the snapshot it decodes to
+        self._decoded: "weakref.WeakKeyDictionary[Any, Tuple[str, S]]" = weakref.WeakKeyDictionary()
+
+    def new(self) -> RunState[S]:
+        return RunState(self.schema, self.blobs)
+
+    def _view(self, run: Any, text: Optional[str]) -> RunState[S]:
+        state = self.new()
+        if text is None:
+            return state
+        decoded = self._decoded.get(run) if run is not None else None
+        if decoded is not None and decoded[0] == text:
+            # no parsing, and the view shares every value with the snapshot
+            state.restore(decoded[1])
+        else:
+            state.restore(state.loads(text))
+            self._remember(run, text, state)
+        return state
+
+    def _remember(self, run: Any, text: str, state: RunState[S]) -> None:
+        if run is not None:
+            self._decoded[run] = (text, state.snapshot())
+
+    async def of(self, ctx: Any) -> RunState[S]:
+        """The run's state as it is now. Updating the view does not change the run's state, ``update`` does."""
+        data = getattr(ctx, "data", None)
+        if isinstance(data, dict):
+            # releases where the context is a plain dict
+            return self._view(None, data.get(self.key))
+        return self._view(ctx.store, await ctx.store.get(self.key, default=None))
+
+    async def update(self, ctx: Any, **changes: Any) -> RunState[S]:
+        """``RunState.update`` on the run's state, written back to the context. Returns the new view."""
+        data = getattr(ctx, "data", None)
+        if isinstance(data, dict):
+            state = self._view(None, data.get(self.key))
+            state.update(**changes)
+            data[self.key] = state.dumps()
+            return state
+        async with ctx.store.edit_state() as store:
+            # read, change and write in one step, so concurrent steps of a run do not lose each other's updates
+            state = self._view(ctx.store, store.get(self.key))
+            state.update(**changes)
+            text = store[self.key] = state.dumps()
+            # before the write, so a collect() meanwhile sees the blobs update() just stored
+            self._remember(ctx.store, text, state)
+        return state
+
+    def discard(self, ctx: Any) -> int:
+        """Forgets the finished run ``ctx`` belongs to and deletes the blobs only it and earlier states used.
+
+        Every blob in the directory that is not referred to by a run this slot still knows of
+        is deleted, so the run's checkpoints cannot be restored with their spilled values
+        afterwards. Returns the number of blobs deleted.
+        """
+        store = getattr(ctx, "store", None)
+        if store is not None:
+            self._decoded.pop(store, None)
+        if self.blobs is None:
+            return 0
+        live = [value for _, snapshot in list(self._decoded.values()) for name in self.schema.spilled
+                if isinstance(value := getattr(snapshot, name), BlobRef)]
+        return self.blobs.collect(live)
+
+
+if __name__ == "__main__":
+    import asyncio
+    import copy
+    import time
+    import tracemalloc
+
+    from llama_index.core.base.llms.types import CompletionResponse
+    from llama_index.core.workflow import Context, Event, StartEvent, StopEvent, Workflow, step
+
+    # python workflow_state.py
+    runs, rounds = 300, 3
+
+    @dataclass(frozen=True, slots=True)
+    class TeacherState:
+        category: str = "physics"
+        attempt: int = 0
+        response: Optional[str] = dataclasses.field(default=None, metadata={"spill": True})
+        feedback: Optional[str] = dataclasses.field(default=None, metadata={"spill": True})
+
+    def response(run: int, round: int) -> CompletionResponse:
+        # an answer of about 12KB, with a raw provider payload like the OpenAI LLM attaches
+        text = f"Answer {run}.{round}: " + "Reflection is the change in direction of a wavefront. " * 220
+        raw = json.loads(json.dumps({"id": f"chatcmpl-{run}-{round}", "usage": {"prompt_tokens": 900},
+                                     "choices": [{"message": {"content": text}, "logprobs": None}]}))
+        return CompletionResponse(text=text, raw=raw, additional_kwargs={"prompt_tokens": 900})
+
+    def held_in_dicts():
+        states = []
+        for run in range(runs):
+            data = {"attempt": 0, "category": "physics"}
+            for round in range(rounds):
+                data["attempt"] = round + 1
+                data["response"] = response(run, round)
+                data["feedback"] = response(run, round)
+            states.append(data)
+        return states
+
+    def held_in_run_states(blobs):
+        states = []
+        for run in range(runs):
+            state = RunState(TeacherState, blobs)
+            for round in range(rounds):
+                state.update(attempt=round + 1, response=response(run, round).text,
+                             feedback=response(run, round).text)
+            states.append(state)
+        return states
+
+    def measure(build, *args):
+        tracemalloc.start()
+        states = build(*args)
+        held = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return states, held
+
+    dicts, held = measure(held_in_dicts)
+    print(f"ctx.data dicts with response objects  {held / 1e6:7.2f} MB for {runs} runs in flight")
+    states, held = measure(held_in_run_states, None)
+    print(f"RunState, texts in memory             {held / 1e6:7.2f} MB")
+    blobs = BlobStore()
+    states, held = measure(held_in_run_states, blobs)
+    print(f"RunState, texts spilled to disk       {held / 1e6:7.2f} MB  ({blobs.stored} blobs)")
+
+    start = time.perf_counter()
+    for data in dicts:
+        copy.deepcopy(data)
+    print(f"\ncheckpoint by deepcopy                {(time.perf_counter() - start) * 1e6 / runs:7.1f} us a run")
+    start = time.perf_counter()
+    snapshots = [state.snapshot() for state in states]
+    print(f"checkpoint by snapshot                {(time.perf_counter() - start) * 1e6 / runs:7.1f} us a run")
+    states[0].update(attempt=9)
+    assert snapshots[0].attempt == rounds and states[0].attempt == 9
+    states[0].restore(states[0].loads(states[0].dumps(snapshots[0])))
+    assert states[0].attempt == rounds and states[0].response.startswith(f"Answer 0.{rounds - 1}")
+    try:
+        states[0].update(attempt="three")
+    except TypeError as e:
+        print(f"\nupdate(attempt='three'): {e}")
+
+    # a run's context holds the state as JSON, so it can be checkpointed and restored
+    class Round(Event):
+        pass
+
+    run_blobs = BlobStore(min_bytes=256)
+
+    class Teacher(Workflow):
+        state = StateSlot(TeacherState, blobs=run_blobs)
+
+        @step
+        async def answer(self, ctx: Context, ev: StartEvent) -> Round:
+            await self.state.update(ctx, attempt=1, response=response(0, 0).text)
+            return Round()
+
+        @step
+        async def review(self, ctx: Context, ev: Round) -> StopEvent:
+            state = await self.state.of(ctx)
+            state = await self.state.update(ctx, attempt=state.attempt + 1, response=response(0, 1).text,
+                                            feedback="Mention Snell's law.")
+            return StopEvent(result=state.attempt)
+
+    async def checkpoint():
+        workflow = Teacher(timeout=10)
+        handler = workflow.run()
+        assert await handler == 2
+        # the decoded state is kept with the run's store, not parsed on every read
+        first, second = await workflow.state.of(handler.ctx), await workflow.state.of(handler.ctx)
+        assert first.snapshot() is second.snapshot()
+        saved = json.loads(json.dumps(handler.ctx.to_dict()))
+        restored = Context.from_dict(workflow, saved)
+        state = await workflow.state.of(restored)
+        assert (state.attempt, state.feedback) == (2, "Mention Snell's law.")
+        assert state.response == response(0, 1).text and isinstance(state.snapshot().response, BlobRef)
+        assert len(os.listdir(run_blobs.directory)) == 2
+        # the first response is no longer referred to, the second still is by the restored run
+        assert workflow.state.discard(handler.ctx) == 1
+        assert os.listdir(run_blobs.directory) == [state.snapshot().response.key]
+        assert workflow.state.discard(restored) == 1 and os.listdir(run_blobs.directory) == []
+
+    asyncio.run(checkpoint())
+    run_blobs.close()
+    blobs.close()
@@ -0,0 +1,123 @@
+"""Streaming LLM tokens out of workflow steps to whoever called ``Workflow.run``, while the steps keep running.
+
+A step that ``await``s ``llm.acomplete`` returns its event only once the whole completion is
+in, and the caller of ``run`` sees nothing before the ``StopEvent``. An interactive user
+waits for the slowest path through every step, although the answer started arriving long
+before. The workflow runtime already has a side channel: ``ctx.write_event_to_stream`` hands
+an event to the caller right away, and ``handler.stream_events()`` yields those events while
+the run goes on. This module puts LLM tokens on it:
+
+* ``TokenEvent``: a piece of text from a step. The last event of each completion has
+  ``done=True`` and no text,
+* ``stream_complete(ctx, llm, prompt, step)``: ``llm.acomplete`` for a step, streaming the
+  tokens out as they are generated. It returns the whole ``CompletionResponse``, so the step
+  carries on as before,
+* ``write_tokens(ctx, step)``: a context manager giving an ``on_delta`` callback for OpenAI
+  style clients, such as ``create(on_delta=...)`` of ``openai_pool.PooledOpenAI`` and
+  ``llm_cache.CachedCompletions``. Leaving it ends the completion,
+* ``stream_tokens(handler, steps)``: the caller's side, an async iterator over the tokens of
+  a run, optionally of some steps only. ``await handler`` afterwards gives the result.
+
+    handler = workflow.run(query=query)
+    async for token in stream_tokens(handler, steps={"answer"}):
+        print(token.delta, end="", flush=True)
+    result = await handler
+
+The caller sees the first token after the time to first token of the first streamed call,
+not after the whole run. Runs nobody streams from keep their tokens queued until the run
+ends, so batch jobs should leave streaming off.
+"""
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Callable, Collection, Iterator, Optional
+
+from llama_index.core.base.llms.types import CompletionResponse
+from llama_index.core.workflow import Context, Event
+
+
+class TokenEvent(Event):
+    step: str
+    delta: str = ""
+    # the completion this token belongs to is complete
+    done: bool = False
+
+
+@contextmanager
+def write_tokens(ctx: Context, step: str) -> Iterator[Callable[[str], None]]:
+    """A callback writing each piece of text it gets to the run's event stream, then ``done``."""
+
+    def write(delta: str) -> None:
+        if delta:
+            ctx.write_event_to_stream(TokenEvent(step=step, delta=delta))
+
+    try:
+        yield write
+    finally:
+        # also when the call fails, so the caller does not wait for more of this text
+        ctx.write_event_to_stream(TokenEvent(step=step, done=True))
+
+
+async def stream_complete(ctx: Context, llm: Any, prompt: str, step: str, **kwargs: Any) -> CompletionResponse:
+    """``llm.acomplete(prompt)``, with the tokens written to the run's event stream as they arrive."""
+    response = CompletionResponse(text="")
+    with write_tokens(ctx, step) as write:
+        async for response in await llm.astream_complete(prompt, **kwargs):
+            write(response.delta)
+    return response
+
+
+async def stream_tokens(handler: Any, steps: Optional[Collection[str]] = None) -> AsyncIterator[TokenEvent]:
+    """The ``TokenEvent``s of a run as its steps write them, from ``steps`` only if given."""
+    async for event in handler.stream_events():
+        if isinstance(event, TokenEvent) and (steps is None or event.step in steps):
+            yield event
+
+
+if __name__ == "__main__":
+    import asyncio
+    import time
+
+    from llama_index.core.workflow import StartEvent, StopEvent, Workflow, step
+
+    from fakes import FakeLLM
+
+    # 1s to the first token, then 20 tokens a second
+    llm = FakeLLM(latency=1.0, token_latency=0.05, responder=lambda prompt: " ".join(["word"] * 60))
+
+    class Outline(Event):
+        query: str
+        outline: str
+
+    class Answer(Workflow):
+        def __init__(self, stream: bool, **kwargs: Any):
+            super().__init__(**kwargs)
+            self.stream = stream
+
+        async def complete(self, ctx: Context, prompt: str, name: str) -> str:
+            if self.stream:
+                return str(await stream_complete(ctx, llm, prompt, name))
+            return str(await llm.acomplete(prompt))
+
+        @step
+        async def outline(self, ctx: Context, ev: StartEvent) -> Outline:
+            return Outline(query=ev.query, outline=await self.complete(ctx, f"Outline: {ev.query}", "outline"))
+
+        @step
+        async def answer(self, ctx: Context, ev: Outline) -> StopEvent:
+            return StopEvent(result=await self.complete(ctx, f"Answer {ev.query} from {ev.outline}", "answer"))
+
+    async def main():
+        start = time.perf_counter()
+        await Answer(stream=False, timeout=60).run(query="what is reflection?")
+        print(f"waiting for the result      first text after {time.perf_counter() - start:5.2f}s")
+
+        start = time.perf_counter()
+        handler = Answer(stream=True, timeout=60).run(query="what is reflection?")
+        first = {}
+        async for token in stream_tokens(handler):
+            first.setdefault(token.step, time.perf_counter() - start)
+        await handler
+        print(f"streaming every step        first text after {first['outline']:5.2f}s, "
+              f"done after {time.perf_counter() - start:5.2f}s")
+        print(f"streaming, final step only  first text after {first['answer']:5.2f}s")
+
+    asyncio.run(main())
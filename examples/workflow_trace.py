@@ -0,0 +1,541 @@
+"""Per-step timings, queue waits, LLM latency and tokens for llama_index workflows, as OpenTelemetry spans.
+
+``verbose=True`` prints which step ran, and ``draw_all_possible_flows`` shows which steps can
+follow which. Neither shows where a run spent its time: in a step's own code, waiting for a
+free worker, or in the LLM. The workflow runtime reports every run and every step to the
+llama_index instrumentation dispatcher, as the LLMs and ``openai_pool.PooledOpenAI`` do for
+their calls. ``WorkflowTracer`` listens there, so the workflows need no changes:
+
+    tracer = WorkflowTracer(path="trace.jsonl").install()
+    await workflow.run(...)
+    print(tracer.report())
+    annotate_flow_html("workflow.html", tracer)
+
+For each step it records:
+
+* wall time, from the step starting to it returning its event,
+* queue wait: from the event it handles being emitted (returned by the previous step, sent
+  by ``workflow_fanout.fan_out`` or passed to ``run``) to the step starting on it,
+* LLM calls: how many, their latency, prompt and completion tokens, and retries made by
+  ``PooledOpenAI``. Only the outermost call counts, so ``CachedLLM`` over ``OpenAI`` is one
+  call, and cache hits report no tokens.
+
+With a ``path``, every finished run, step and LLM span is appended as a JSON line in the
+OTLP/JSON export format, which the OpenTelemetry collector's ``otlpjsonfile`` receiver reads.
+``report()`` summarises the steps of every workflow traced. ``annotate_flow_html`` writes the
+timings into the labels of a flow graph drawn by ``draw_all_possible_flows`` or
+``draw_most_recent_execution``, and ``write_flow_html`` draws the steps and events that were
+actually seen, for versions that no longer ship the drawing utilities.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.instrumentation import get_dispatcher
+from llama_index.core.instrumentation.event_handlers import BaseEventHandler
+from llama_index.core.instrumentation.events import BaseEvent
+from llama_index.core.instrumentation.events.llm import (LLMChatEndEvent, LLMChatStartEvent,
+                                                         LLMCompletionEndEvent, LLMCompletionStartEvent)
+from llama_index.core.instrumentation.span import SimpleSpan
+from llama_index.core.instrumentation.span_handlers import BaseSpanHandler
+from llama_index.core.workflow import Event, StartEvent, StopEvent, Workflow
+
+# dispatcher span ids are "<qualified name>-<uuid4>"
+_SPAN_ID = re.compile(r"-[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+_TOKEN_KEYS = (("prompt_tokens", "completion_tokens"), ("input_tokens", "output_tokens"))
+# OTLP span kinds and status codes
+_INTERNAL, _CLIENT = 1, 3
+_OK, _ERROR = 1, 2
+
+
+def _span_name(span_id: str) -> str:
+    return _SPAN_ID.sub("", span_id)
+
+
+def _hex_id(span_id: str, size: int) -> str:
+    return hashlib.blake2b(span_id.encode("utf-8"), digest_size=size).hexdigest()
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}  # int64 is a string in OTLP/JSON
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def _usage(response: Any) -> Tuple[int, int]:
+    """Prompt and completion tokens of a llama_index LLM response, from the provider's usage if it has any."""
+    raw = getattr(response, "raw", None)
+    usage = raw.get("usage") if isinstance(raw, dict) else getattr(raw, "usage", None)
+    for source in (usage, getattr(response, "additional_kwargs", None)):
+        if source is None:
+            continue
+        for prompt_key, completion_key in _TOKEN_KEYS:
+            get = source.get if isinstance(source, dict) else lambda key: getattr(source, key, None)
+            if get(prompt_key) is not None:
+                return int(get(prompt_key) or 0), int(get(completion_key) or 0)
+    return 0, 0
+
+
+@dataclass
+class TraceSpan:
+    span_id: str
+    name: str
+    # run, step, llm, or other for dispatcher spans that are not exported
+    kind: str
+    trace_id: str
+    parent_id: Optional[str]
+    start_ns: int
+    end_ns: int = 0
+    error: Optional[str] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def seconds(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e9
+
+    def to_otlp(self, parent_id: Optional[str]) -> Dict[str, Any]:
+        span = {
+            "traceId": _hex_id(self.trace_id, 16),
+            "spanId": _hex_id(self.span_id, 8),
+            "name": self.name,
+            "kind": _CLIENT if self.kind == "llm" else _INTERNAL,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()
+                           if value is not None],
+            "status": {"code": _ERROR, "message": self.error} if self.error else {"code": _OK},
+        }
+        if parent_id is not None:
+            span["parentSpanId"] = _hex_id(parent_id, 8)
+        return span
+
+
+@dataclass
+class StepStats:
+    calls: int = 0
+    errors: int = 0
+    seconds: List[float] = field(default_factory=list)
+    waits: List[float] = field(default_factory=list)
+    llm_calls: int = 0
+    llm_seconds: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    retries: int = 0
+
+    @property
+    def mean_wait(self) -> float:
+        return sum(self.waits) / len(self.waits) if self.waits else 0.0
+
+    def label(self) -> str:
+        lines = [f"{self.calls}x p50 {_percentile(self.seconds, 0.5):.2f}s max {max(self.seconds, default=0):.2f}s"]
+        if self.waits:
+            lines.append(f"waited {self.mean_wait:.2f}s avg")
+        if self.llm_calls:
+            lines.append(f"{self.llm_calls} LLM {self.llm_seconds:.2f}s, "
+                         f"{self.prompt_tokens + self.completion_tokens} tokens")
+        if self.errors or self.retries:
+            lines.append(f"{self.errors} failed, {self.retries} retries")
+        return "\n".join(lines)
+
+
+class _SpanHandler(BaseSpanHandler[SimpleSpan]):
+    _tracer: "WorkflowTracer" = PrivateAttr()
+
+    def __init__(self, tracer: "WorkflowTracer"):
+        super().__init__()
+        self._tracer = tracer
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "WorkflowTracerSpanHandler"
+
+    def new_span(self, id_: str, bound_args: Any, instance: Optional[Any] = None,
+                 parent_span_id: Optional[str] = None, tags: Optional[Dict[str, Any]] = None,
+                 **kwargs: Any) -> SimpleSpan:
+        self._tracer._enter(id_, bound_args, instance, parent_span_id, tags or {})
+        return SimpleSpan(id_=id_, parent_id=parent_span_id)
+
+    def prepare_to_exit_span(self, id_: str, bound_args: Any, instance: Optional[Any] = None,
+                             result: Optional[Any] = None, **kwargs: Any) -> Optional[SimpleSpan]:
+        self._tracer._exit(id_, result, None)
+        return self.open_spans.get(id_)
+
+    def prepare_to_drop_span(self, id_: str, bound_args: Any, instance: Optional[Any] = None,
+                             err: Optional[BaseException] = None, **kwargs: Any) -> Optional[SimpleSpan]:
+        self._tracer._exit(id_, None, err)
+        return self.open_spans.get(id_)
+
+
+class _EventHandler(BaseEventHandler):
+    _tracer: "WorkflowTracer" = PrivateAttr()
+
+    def __init__(self, tracer: "WorkflowTracer"):
+        super().__init__()
+        self._tracer = tracer
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "WorkflowTracerEventHandler"
+
+    def handle(self, event: BaseEvent, **kwargs: Any) -> None:
+        self._tracer._event(event)
+
+
+class WorkflowTracer:
+    def __init__(self, path: Optional[str] = None):
+        """``path``: a JSONL file the finished spans are appended to, in OTLP/JSON."""
+        self.path = path
+        # per "Workflow.step" and per "Workflow.run"; a run's LLM figures are the sum of its steps'
+        self.steps: Dict[str, StepStats] = defaultdict(StepStats)
+        self.runs: Dict[str, StepStats] = defaultdict(StepStats)
+        # (producer, event type, consumer) -> count; the producer of a run's input is "StartEvent"
+        self.edges: Dict[Tuple[str, str, str], int] = defaultdict(int)
+        self._open: Dict[str, TraceSpan] = {}
+        # per trace: id() of each event a step emitted -> (emitted at, emitting step)
+        self._emitted: Dict[str, Dict[int, Tuple[int, str]]] = defaultdict(dict)
+        # LLM calls that started and have not sent their end event; a streaming call's span
+        # closes when it hands back the stream, so it is finished by the end event instead
+        self._awaiting_end: Set[str] = set()
+        self._deferred: Set[str] = set()
+        self._lock = threading.Lock()
+        self._file = open(path, "a") if path else None
+        self._spans = _SpanHandler(self)
+        self._events = _EventHandler(self)
+        self._dispatcher = None
+
+    def install(self, dispatcher: Any = None) -> "WorkflowTracer":
+        """Starts listening on ``dispatcher``, by default the root one every workflow and LLM reports to."""
+        self._dispatcher = dispatcher or get_dispatcher()
+        self._dispatcher.add_span_handler(self._spans)
+        self._dispatcher.add_event_handler(self._events)
+        return self
+
+    def uninstall(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.span_handlers.remove(self._spans)
+            self._dispatcher.event_handlers.remove(self._events)
+            self._dispatcher = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> "WorkflowTracer":
+        return self.install()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.uninstall()
+
+    def _enter(self, span_id: str, bound_args: Any, instance: Any, parent_id: Optional[str],
+               tags: Dict[str, Any]) -> None:
+        now = time.time_ns()
+        name = _span_name(span_id)
+        with self._lock:
+            parent = self._open.get(parent_id) if parent_id else None
+            if isinstance(instance, Workflow) and name.endswith(".run"):
+                span = TraceSpan(span_id, name, "run", span_id, parent_id, now)
+            elif parent is not None and parent.kind == "run":
+                span = TraceSpan(span_id, name, "step", parent.trace_id, parent_id, now,
+                                 attributes={"workflow.run_id": tags.get("llamaindex.run_id")})
+                # the step's event parameter can have any name
+                ev = next((value for value in bound_args.arguments.values() if isinstance(value, Event)), None)
+                self._received(span, parent, ev)
+            else:
+                span = TraceSpan(span_id, name, "other", parent.trace_id if parent else span_id, parent_id, now)
+            self._open[span_id] = span
+
+    def _received(self, span: TraceSpan, run: TraceSpan, ev: Any) -> None:
+        """Works out when the event a step starts on was emitted, and by which step."""
+        emitted = self._emitted[span.trace_id].pop(id(ev), None) if ev is not None else None
+        if emitted is None and getattr(ev, "sent_at", None):
+            sender = self._open.get(ev.sent_from)
+            emitted = int(ev.sent_at * 1e9), sender.name if sender else _span_name(ev.sent_from or "")
+        if emitted is None and isinstance(ev, StartEvent):
+            emitted = run.start_ns, "StartEvent"
+        span.attributes["workflow.input_event"] = type(ev).__name__
+        if emitted is not None:
+            sent_at, producer = emitted
+            span.attributes["workflow.queue_wait_s"] = max(span.start_ns - sent_at, 0) / 1e9
+            span.attributes["workflow.input_from"] = producer
+            self.edges[producer, type(ev).__name__, span.name] += 1
+
+    def _event(self, event: BaseEvent) -> None:
+        with self._lock:
+            span = self._open.get(event.span_id) if event.span_id else None
+            if span is None:
+                return
+            if isinstance(event, (LLMCompletionStartEvent, LLMChatStartEvent)):
+                span.kind = "llm"
+                self._awaiting_end.add(span.span_id)
+                model = event.model_dict.get("model") or event.model_dict.get("model_name")
+                span.attributes.setdefault("gen_ai.request.model", model)
+            elif isinstance(event, (LLMCompletionEndEvent, LLMChatEndEvent)):
+                span.kind = "llm"
+                self._tokens(span, *_usage(event.response))
+                self._awaiting_end.discard(span.span_id)
+                if span.span_id in self._deferred:
+                    self._deferred.discard(span.span_id)
+                    self._finish(span, None, time.time_ns())
+            elif hasattr(event, "retries") and hasattr(event, "prompt_tokens"):
+                # openai_pool.OpenAICallEvent
+                span.kind = "llm"
+                span.attributes["gen_ai.request.model"] = event.model
+                span.attributes["retries"] = event.retries
+                self._tokens(span, event.prompt_tokens, event.completion_tokens)
+
+    def _tokens(self, span: TraceSpan, prompt: int, completion: int) -> None:
+        # a call made inside another LLM's call (CachedLLM -> OpenAI) reports the real usage;
+        # the outer call then reports the same response again, so it keeps the inner figures
+        if span.attributes.get("gen_ai.usage.input_tokens") is None:
+            span.attributes["gen_ai.usage.input_tokens"] = prompt
+            span.attributes["gen_ai.usage.output_tokens"] = completion
+        outer = self._outer_llm(span)
+        if outer is not span:
+            outer.attributes["gen_ai.usage.input_tokens"] = outer.attributes.get("gen_ai.usage.input_tokens", 0) + prompt
+            outer.attributes["gen_ai.usage.output_tokens"] = (outer.attributes.get("gen_ai.usage.output_tokens", 0)
+                                                             + completion)
+
+    def _ancestors(self, span: TraceSpan):
+        parent = self._open.get(span.parent_id) if span.parent_id else None
+        while parent is not None:
+            yield parent
+            parent = self._open.get(parent.parent_id) if parent.parent_id else None
+
+    def _outer_llm(self, span: TraceSpan) -> TraceSpan:
+        outer = span
+        for ancestor in self._ancestors(span):
+            if ancestor.kind == "step":
+                break
+            if ancestor.kind == "llm":
+                outer = ancestor
+        return outer
+
+    def _exit(self, span_id: str, result: Any, err: Optional[BaseException]) -> None:
+        now = time.time_ns()
+        with self._lock:
+            span = self._open.get(span_id)
+            if span is None:
+                return
+            if err is not None:
+                span.error = repr(err)
+                self._awaiting_end.discard(span_id)
+            elif span_id in self._awaiting_end:
+                self._deferred.add(span_id)  # a stream, still being read
+                return
+            self._finish(span, result, now)
+
+    def _finish(self, span: TraceSpan, result: Any, now: int) -> None:
+        span.end_ns = now
+        if span.kind == "step":
+            self._step_done(span, result)
+        elif span.kind == "llm":
+            self._llm_done(span)
+        elif span.kind == "run":
+            # streams of this run nobody read to the end
+            for span_id in [d for d in self._deferred if self._open[d].trace_id == span.trace_id]:
+                self._deferred.discard(span_id)
+                self._awaiting_end.discard(span_id)
+                self._finish(self._open[span_id], None, now)
+            stats = self.runs[span.name]
+            stats.calls += 1
+            stats.errors += span.error is not None
+            stats.seconds.append(span.seconds)
+            self._emitted.pop(span.trace_id, None)
+        if span.kind != "other" and self._file is not None:
+            exported = next((a.span_id for a in self._ancestors(span) if a.kind != "other"), None)
+            self._file.write(json.dumps({"resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "llamaindex"}}]},
+                "scopeSpans": [{"scope": {"name": "workflow_trace"}, "spans": [span.to_otlp(exported)]}],
+            }]}) + "\n")
+        del self._open[span.span_id]
+
+    def _step_done(self, span: TraceSpan, result: Any) -> None:
+        stats = self.steps[span.name]
+        stats.calls += 1
+        stats.errors += span.error is not None
+        stats.seconds.append(span.seconds)
+        if "workflow.queue_wait_s" in span.attributes:
+            stats.waits.append(span.attributes["workflow.queue_wait_s"])
+        if result is None:
+            return
+        span.attributes["workflow.output_event"] = type(result).__name__
+        if isinstance(result, StopEvent):
+            self.edges[span.name, "StopEvent", "StopEvent"] += 1
+        else:
+            self._emitted[span.trace_id][id(result)] = (span.end_ns, span.name)
+
+    def _llm_done(self, span: TraceSpan) -> None:
+        if self._outer_llm(span) is not span:
+            return
+        step = next((a for a in self._ancestors(span) if a.kind in ("step", "llm")), None)
+        if step is None or step.kind != "step":
+            return  # an LLM call outside any workflow step
+        run_name = step.name.rsplit(".", 1)[0] + ".run"
+        for stats in (self.steps[step.name], self.runs[run_name]):
+            stats.llm_calls += 1
+            stats.llm_seconds += span.seconds
+            stats.prompt_tokens += span.attributes.get("gen_ai.usage.input_tokens", 0)
+            stats.completion_tokens += span.attributes.get("gen_ai.usage.output_tokens", 0)
+            stats.retries += span.attributes.get("retries", 0)
+
+    def report(self) -> str:
+        header = (f"{'':28} {'calls':>5} {'failed':>6} {'p50 s':>7} {'max s':>7} {'wait s':>7} "
+                  f"{'LLM':>5} {'LLM s':>7} {'prompt':>8} {'compl.':>7} {'retries':>7}")
+        lines = [header]
+        for run_name, run in sorted(self.runs.items()):
+            workflow = run_name.rsplit(".", 1)[0]
+            rows = [(run_name, run)] + [("  " + name.rsplit(".", 1)[1], stats)
+                                        for name, stats in sorted(self.steps.items())
+                                        if name.rsplit(".", 1)[0] == workflow]
+            for label, stats in rows:
+                wait = f"{stats.mean_wait:7.3f}" if stats.waits else f"{'':7}"
+                lines.append(f"{label:28} {stats.calls:5d} {stats.errors:6d} "
+                             f"{_percentile(stats.seconds, 0.5):7.2f} {max(stats.seconds, default=0):7.2f} {wait} "
+                             f"{stats.llm_calls:5d} {stats.llm_seconds:7.2f} {stats.prompt_tokens:8d} "
+                             f"{stats.completion_tokens:7d} {stats.retries:7d}")
+        return "\n".join(lines)
+
+    def workflow_steps(self, workflow: Optional[str] = None) -> Dict[str, StepStats]:
+        """Stats by bare step name, for the steps of ``workflow`` (a class name) or of every workflow."""
+        return {name.rsplit(".", 1)[1]: stats for name, stats in self.steps.items()
+                if workflow is None or name.rsplit(".", 1)[0] == workflow}
+
+
+_DATASET = re.compile(r"(nodes|edges) = new vis\.DataSet\(")
+
+_PAGE = """<html>
+<head>
+<meta charset="utf-8">
+<script src="https://cdnjs.cloudflare.com/ajax/libs/vis-network/9.1.2/dist/vis-network.min.js"></script>
+<style>#mynetwork {{ width: 100%; height: 750px; border: 1px solid lightgray; }}</style>
+</head>
+<body>
+<div id="mynetwork"></div>
+<script type="text/javascript">
+nodes = new vis.DataSet({nodes});
+edges = new vis.DataSet({edges});
+new vis.Network(document.getElementById("mynetwork"), {{nodes: nodes, edges: edges}},
+                {{layout: {{hierarchical: {{direction: "UD", sortMethod: "directed"}}}}, physics: false}});
+</script>
+</body>
+</html>
+"""
+
+
+def _annotate(nodes: List[Dict[str, Any]], edges: List[Dict[str, Any]], tracer: WorkflowTracer,
+              workflow: Optional[str]) -> None:
+    steps = tracer.workflow_steps(workflow)
+    for node in nodes:
+        stats = steps.get(node["id"])
+        if stats is not None:
+            node["label"] = f"{node['id']}\n{stats.label()}"
+            node["title"] = node["label"].replace("\n", "<br>")
+    # step -> event edges count emissions, event -> step edges count deliveries
+    counts: Dict[Tuple[str, str], int] = defaultdict(int)
+    for (producer, event, consumer), count in tracer.edges.items():
+        if workflow is None or consumer.rsplit(".", 1)[0] == workflow or producer.rsplit(".", 1)[0] == workflow:
+            if producer != "StartEvent":
+                counts[producer.rsplit(".", 1)[-1], event] += count
+            if consumer != "StopEvent":
+                counts[event, consumer.rsplit(".", 1)[-1]] += count
+    for edge in edges:
+        count = counts.get((edge["from"], edge["to"]))
+        if count:
+            edge["label"] = f"{count}x"
+
+
+def annotate_flow_html(path: str, tracer: WorkflowTracer, workflow: Optional[str] = None,
+                       output: Optional[str] = None) -> str:
+    """Adds the traced timings to the node labels of a pyvis flow graph. Writes to ``output``, by default ``path``."""
+    with open(path) as f:
+        html = f.read()
+    datasets: Dict[str, Tuple[int, int, List[Dict[str, Any]]]] = {}
+    for match in _DATASET.finditer(html):
+        data, end = json.JSONDecoder().raw_decode(html, match.end())
+        datasets[match.group(1)] = (match.end(), end, data)
+    if "nodes" not in datasets:
+        raise ValueError(f"{path} has no vis.js nodes to annotate")
+    _annotate(datasets["nodes"][2], datasets.get("edges", (0, 0, []))[2], tracer, workflow)
+    # replace from the end, so the earlier offsets still hold
+    for start, end, data in sorted(datasets.values(), key=lambda d: d[0], reverse=True):
+        html = html[:start] + json.dumps(data) + html[end:]
+    output = output or path
+    with open(output, "w") as f:
+        f.write(html)
+    return output
+
+
+def write_flow_html(path: str, tracer: WorkflowTracer, workflow: Optional[str] = None) -> str:
+    """Draws the steps and events the tracer saw, with their timings, in the style of the drawing utilities."""
+    nodes: Dict[str, Dict[str, Any]] = {}
+    edges: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+    def node(node_id: str, is_step: bool) -> None:
+        nodes.setdefault(node_id, {"id": node_id, "label": node_id, "shape": "box" if is_step else "ellipse",
+                                   "color": "#ADD8E6" if is_step else "#90EE90"})
+
+    for producer, event, consumer in tracer.edges:
+        if workflow is not None and workflow not in (producer.rsplit(".", 1)[0], consumer.rsplit(".", 1)[0]):
+            continue
+        node(event, False)
+        if producer != "StartEvent":
+            node(producer.rsplit(".", 1)[-1], True)
+            edges[producer.rsplit(".", 1)[-1], event] = {"from": producer.rsplit(".", 1)[-1], "to": event,
+                                                          "arrows": "to"}
+        if consumer != "StopEvent":
+            node(consumer.rsplit(".", 1)[-1], True)
+            edges[event, consumer.rsplit(".", 1)[-1]] = {"from": event, "to": consumer.rsplit(".", 1)[-1],
+                                                         "arrows": "to"}
+    node_list, edge_list = list(nodes.values()), list(edges.values())
+    _annotate(node_list, edge_list, tracer, workflow)
+    with open(path, "w") as f:
+        f.write(_PAGE.format(nodes=json.dumps(node_list), edges=json.dumps(edge_list)))
+    return path
+
+
+if __name__ == "__main__":
+    import asyncio
+    import os
+    import sys
+    import tempfile
+
+    from fakes import FakeLLM
+    from parallel_reflection import ParallelReflection
+
+    # python workflow_trace.py [candidates per round]
+    # more candidates than draft workers, so some drafts wait in the queue
+    candidates = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+
+    async def main():
+        llm = FakeLLM(latency=0.2, jitter=0.2)
+        workflow = ParallelReflection(llm, candidates=candidates, threshold=11, max_rounds=2, timeout=60)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "trace.jsonl")
+            with WorkflowTracer(path=path) as tracer:
+                await asyncio.gather(*(workflow.run(query=f"Explain topic {i}", category="science")
+                                       for i in range(3)))
+            print(tracer.report())
+            with open(path) as f:
+                spans = [json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"][0] for line in f]
+            print(f"\n{len(spans)} spans in {os.path.basename(path)}, e.g.")
+            print(json.dumps(next(s for s in spans if s["kind"] == _CLIENT)))
+        write_flow_html("parallel_reflection_trace.html", tracer)
+        print("\nflow graph with timings: parallel_reflection_trace.html")
+
+    asyncio.run(main())
@@ -1,16 +1,30 @@
 import asyncio
 import json
 import os
+from contextlib import nullcontext
 
-import openai
 from dotenv import load_dotenv
-from llama_index.core.workflow import Workflow, step, Event, StartEvent, StopEvent, draw_all_possible_flows
+from llama_index.core.workflow import Context, Workflow, step, Event, StartEvent, StopEvent, draw_all_possible_flows
 from pydantic import BaseModel
 
+from critique_budget import CritiqueResult, LoopBudget, LoopSpend
+# the response cache, token streaming and tracing are shared with the examples package:
+# run from the repository root, PYTHONPATH=. python llama-index-workflows/01_creating_a_critique_chain.py
+from examples.llm_cache import CachedCompletions, ResponseCache
+from examples.workflow_stream import stream_tokens, write_tokens
+from examples.workflow_trace import WorkflowTracer, annotate_flow_html
+from map_reduce_summary import CondensedReferences
+from openai_pool import PooledOpenAI
+from workflow_batch import BatchRunner
+
 load_dotenv()
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
 
-client = openai.OpenAI(api_key=OPENAI_API_KEY)
+# one async client on a shared connection pool for every step and run, with 8 calls in flight at most.
+# Requests already answered in the last week (review prompts, reruns over the same articles) skip the network.
+# The summaries, at temperature 0.5, are sampled afresh every time.
+client = CachedCompletions(PooledOpenAI(api_key=OPENAI_API_KEY, max_concurrency=8, timeout=30),
+                           ResponseCache(path="llm_cache.sqlite", ttl=7 * 24 * 3600, max_temperature=0.3))
 
 
 class LoopEvent(Event):
@@ -20,11 +34,17 @@ class LoopEvent(Event):
 class SummaryEvent(Event):
     summary: str
     original_text: str
+    # what the summary is written from and reviewed against: the text, or its condensed version
+    reference: str
+    spend: LoopSpend
 
 
 class ReviewEvent(Event):
     review: str
     score: int
+    original_text: str
+    reference: str
+    spend: LoopSpend
 
 
 class ReviewOutput(BaseModel):
@@ -154,62 +174,143 @@ feedback:
 
 
 class SummaryWorkflow(Workflow):
-    @step
-    async def create_summary(self, start_ev: StartEvent | ReviewEvent) -> SummaryEvent:
+    def __init__(self, budget: LoopBudget = None, condense: CondensedReferences = None, stream: bool = False,
+                 **kwargs):
+        super().__init__(**kwargs)
+        self.budget = budget or LoopBudget()
+        # None sends the whole text in every round
+        self.condense = condense
+        # write each summary's tokens to the run's event stream as they are generated
+        self.stream = stream
+
+    async def summarise_part(self, prompt: str, spend: LoopSpend) -> str:
         model = "gpt-4o-mini"
-        print("----")
-        print(start_ev)
-
-        feedback = start_ev.review if isinstance(start_ev, ReviewEvent) else ""
-
-        response = client.chat.completions.create(
+        response = await client.create(
             model=model,
             messages=[
                 {"role": "system", "content": "You are an AI that summarizes text concisely."},
-                {"role": "user", "content": summary_prompt.format(content=content, feedback=feedback)}
+                {"role": "user", "content": prompt}
             ],
-            temperature=0.5,
-            max_tokens=150
+            temperature=0.0,
+            max_tokens=300,
+            timeout=20
         )
-        print(response.choices[0].message.content)
-        return SummaryEvent(summary=response.choices[0].message.content, original_text=content)
+        spend.add_usage(model, response.usage)
+        return response.choices[0].message.content
+
+    @step
+    async def create_summary(self, ctx: Context, start_ev: StartEvent | ReviewEvent) -> SummaryEvent:
+        model = "gpt-4o-mini"
+        print("----")
+        print(start_ev)
+
+        feedback = start_ev.review if isinstance(start_ev, ReviewEvent) else ""
+        spend = start_ev.spend if isinstance(start_ev, ReviewEvent) else LoopSpend()
+        # the text of this run, so that runs over different articles can share the workflow
+        content = start_ev.original_text if isinstance(start_ev, ReviewEvent) else start_ev.content
+        if isinstance(start_ev, ReviewEvent):
+            reference = start_ev.reference
+        elif self.condense is not None:
+            # chunks summarised at once and reduced, then every round works from the result
+            reference = await self.condense.reference(content, lambda prompt: self.summarise_part(prompt, spend))
+        else:
+            reference = content
+
+        with write_tokens(ctx, "create_summary") if self.stream else nullcontext() as on_delta:
+            response = await client.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": "You are an AI that summarizes text concisely."},
+                    {"role": "user", "content": summary_prompt.format(content=reference, feedback=feedback)}
+                ],
+                temperature=0.5,
+                max_tokens=150,
+                timeout=20,
+                on_delta=on_delta
+            )
+        spend.add_usage(model, response.usage)
+        if not self.stream:
+            # streamed summaries are printed by the caller as they are written
+            print(response.choices[0].message.content)
+        return SummaryEvent(summary=response.choices[0].message.content, original_text=content, reference=reference,
+                            spend=spend)
 
     @step
     async def review_summary(self, summary_ev: SummaryEvent) -> ReviewEvent | StopEvent:
         model = "gpt-4o"
         summary = summary_ev.summary
         content = summary_ev.original_text
+        reference = summary_ev.reference
         # review_prompt.format(summary=summary, original_text=content)
         print(review_prompt)
-        response = client.beta.chat.completions.parse(
+        response = await client.parse(
             model=model,
             messages=[
                 {"role": "system",
                  "content": "You are an AI that reviews summaries for clarity, conciseness, and completeness."},
-                {"role": "user", "content": review_prompt.format(summary=summary, original_text=content)}
+                {"role": "user", "content": review_prompt.format(summary=summary, original_text=reference)}
             ],
             temperature=0.3,
             max_tokens=150,
-            response_format=ReviewOutput
+            response_format=ReviewOutput,
+            timeout=30
         )
 
+        spend = summary_ev.spend
+        spend.add_usage(model, response.usage)
         feedback = json.loads(response.choices[0].message.content)
         print("feedback ", feedback)
         review_score = feedback["score"]
         review = feedback["review"]
+        spend.add_review(summary, review_score)
         print("score ", review_score)
         if review_score >= 4:
             print("stopping now")
-            return StopEvent(result=summary)
-        else:
-            print("recreating now")
-            return ReviewEvent(score=review_score, review=review)
-
-
-critique_workflow = SummaryWorkflow(timeout=10, verbose=False)
+            return StopEvent(result=CritiqueResult(summary, review_score, "passed review", spend))
+        reason = self.budget.stop_reason(spend)
+        if reason:
+            # out of budget: the best summary so far beats failing on the timeout
+            print("stopping now,", reason)
+            return StopEvent(result=CritiqueResult(spend.best_summary, spend.best_score, reason, spend))
+        print("recreating now")
+        return ReviewEvent(score=review_score, review=review, original_text=content, reference=reference,
+                           spend=spend)
+
+
+critique_workflow = SummaryWorkflow(budget=LoopBudget(max_iterations=4, max_cost=0.05, patience=2),
+                                    condense=CondensedReferences(chunk_words=500, reference_words=600),
+                                    timeout=60, verbose=False)
 draw_all_possible_flows(
     critique_workflow,
     filename="critique_workflow.html"
 )
 # result = asyncio.run(critique_workflow.run(content=content))
-# print(result)
+# print(result, result.stop_reason, result.spend)
+
+# the same loop for an interactive user, who reads every summary while it is being written
+streaming_workflow = SummaryWorkflow(budget=critique_workflow.budget, condense=critique_workflow.condense, stream=True,
+                                     timeout=60, verbose=False)
+
+
+async def stream_summary(content):
+    handler = streaming_workflow.run(content=content)
+    async for token in stream_tokens(handler, steps={"create_summary"}):
+        print(token.delta, end="\n\n" if token.done else "", flush=True)
+    return await handler
+
+# result = asyncio.run(stream_summary(content))
+
+
+async def summarise_all(articles, checkpoint="summaries.jsonl"):
+    # 16 runs in flight on the shared client; an interrupted batch picks up where it stopped
+    runner = BatchRunner(critique_workflow, concurrency=16, checkpoint=checkpoint)
+    # per-step wall time, queue waits, OpenAI latency, tokens and retries, as OpenTelemetry spans
+    with WorkflowTracer(path="critique_trace.jsonl") as tracer:
+        async for item in runner.run({"content": article} for article in articles):
+            print(item.key, f"{item.seconds:.1f}s", item.error or item.result.stop_reason)
+    print(runner.stats)
+    print(tracer.report())
+    annotate_flow_html("critique_workflow.html", tracer, workflow="SummaryWorkflow",
+                       output="critique_workflow_timings.html")
+
+# asyncio.run(summarise_all([content]))
@@ -0,0 +1,127 @@
+"""Iteration, token and cost budgets for the summary/review loop in 01_creating_a_critique_chain.py.
+
+``SummaryWorkflow`` goes back and forth between ``create_summary`` and ``review_summary``
+until the reviewer scores 4 or more. Nothing else bounds the loop except the workflow
+``timeout``, which covers the whole run, not a round. When the score gets stuck, the workflow
+keeps paying for calls until the timeout, and then fails with nothing to show for them.
+
+``LoopSpend`` is what one run has used so far: rounds, prompt and completion tokens, dollars,
+every score, and the best summary seen. It travels with the events, so the steps stay
+stateless. ``LoopBudget.stop_reason`` decides after every review whether to go on. It stops when:
+
+* ``max_iterations`` rounds have been reviewed,
+* one more round, at the average cost of the rounds so far, would go over ``max_tokens``
+  or ``max_cost``, so the limits are kept and not just noticed afterwards,
+* the best score has not improved by ``min_improvement`` in the last ``patience`` rounds.
+
+When the loop stops on a budget, the workflow returns the best summary seen instead of
+failing. Prices are per million tokens. Tokens of models missing from ``PRICES`` are
+counted but cost nothing.
+"""
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, Field
+
+# (input, output) dollars per million tokens
+PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+}
+
+
+def call_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    prompt_price, completion_price = PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+class LoopSpend(BaseModel):
+    iterations: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+    scores: List[int] = Field(default_factory=list)
+    best_summary: Optional[str] = None
+    best_score: Optional[int] = None
+
+    @property
+    def tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add_usage(self, model: str, usage: Any) -> None:
+        """Counts the ``usage`` of an OpenAI chat completion. A response without usage counts nothing."""
+        if usage is None:
+            return
+        self.prompt_tokens += usage.prompt_tokens
+        self.completion_tokens += usage.completion_tokens
+        self.cost += call_cost(model, usage.prompt_tokens, usage.completion_tokens)
+
+    def add_review(self, summary: str, score: int) -> None:
+        """Ends a round: ``summary`` got ``score`` from the reviewer."""
+        self.iterations += 1
+        self.scores.append(score)
+        # ties go to the earlier summary, it cost less to get
+        if self.best_score is None or score > self.best_score:
+            self.best_summary, self.best_score = summary, score
+
+
+@dataclass
+class LoopBudget:
+    max_iterations: int = 5
+    max_tokens: Optional[int] = None
+    max_cost: Optional[float] = None
+    # rounds without the best score improving by min_improvement before giving up
+    patience: Optional[int] = 2
+    min_improvement: int = 1
+
+    def stop_reason(self, spend: LoopSpend) -> Optional[str]:
+        """Why the loop should stop after the round ``spend`` ends with, or None to go on."""
+        if spend.iterations >= self.max_iterations:
+            return f"reached {self.max_iterations} iterations"
+        rounds = max(spend.iterations, 1)
+        if self.max_tokens is not None and spend.tokens + spend.tokens / rounds > self.max_tokens:
+            return f"another round would go over {self.max_tokens} tokens ({spend.tokens} used)"
+        if self.max_cost is not None and spend.cost + spend.cost / rounds > self.max_cost:
+            return f"another round would go over ${self.max_cost:.4f} (${spend.cost:.4f} spent)"
+        if self.patience is not None and len(spend.scores) > self.patience:
+            before = max(spend.scores[:-self.patience])
+            if max(spend.scores[-self.patience:]) < before + self.min_improvement:
+                return f"no improvement on a score of {before} in {self.patience} rounds"
+        return None
+
+
+@dataclass
+class CritiqueResult:
+    summary: str
+    score: int
+    stop_reason: str
+    spend: LoopSpend
+
+    def __str__(self) -> str:
+        # callers that printed the summary string keep working
+        return self.summary
+
+
+if __name__ == "__main__":
+    from types import SimpleNamespace
+
+    # how a stubborn loop plays out: the reviewer's scores, and about 2.5k tokens a round
+    # (the article and summary go to gpt-4o-mini, then again with the summary to gpt-4o)
+    scores = [2, 3, 3, 3, 3, 2, 3, 3, 3, 3]
+    budgets = {
+        "iterations only": LoopBudget(max_iterations=10, patience=None),
+        "plateau": LoopBudget(max_iterations=10, patience=2),
+        "10k tokens": LoopBudget(max_iterations=10, max_tokens=10000, patience=None),
+        "half a cent": LoopBudget(max_iterations=10, max_cost=0.005, patience=None),
+    }
+    for label, budget in budgets.items():
+        spend = LoopSpend()
+        for score in scores:
+            spend.add_usage("gpt-4o-mini", SimpleNamespace(prompt_tokens=1100, completion_tokens=150))
+            spend.add_usage("gpt-4o", SimpleNamespace(prompt_tokens=1300, completion_tokens=60))
+            spend.add_review(f"summary {spend.iterations + 1}", score)
+            reason = budget.stop_reason(spend)
+            if reason:
+                break
+        print(f"{label:16} {spend.iterations:2d} rounds {spend.tokens:6d} tokens ${spend.cost:.4f}  "
+              f"best: {spend.best_summary} ({spend.best_score})  {reason}")
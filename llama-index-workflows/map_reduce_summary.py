@@ -0,0 +1,152 @@
+"""Map-reduce condensing of long articles for the summary/review loop in 01_creating_a_critique_chain.py.
+
+``create_summary`` puts the whole article in its prompt, and ``review_summary`` sends the whole
+article to gpt-4o again with every summary it reviews. Both calls grow with the article, and
+both are paid again every round. ``CondensedReferences`` condenses an article once:
+
+* map: the article is split at paragraph breaks into chunks of about ``chunk_words`` words,
+  and every chunk is summarised at the same time,
+* reduce: while the chunk summaries together are longer than ``reference_words``, they are
+  summarised again in groups of ``fan_in``, every group at the same time.
+
+The result is the article's reference. Each round writes its summary from the reference and
+is reviewed against it, so a round costs the same for any article length. Only the
+condensing grows with the article, and it happens once. References are kept in an LRU keyed
+by a hash of the text. Concurrent runs over the same article share one condensing. Articles
+that fit in a single chunk are their own reference and cost nothing extra.
+"""
+import asyncio
+import hashlib
+import re
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List
+
+Summarise = Callable[[str], Awaitable[str]]
+
+CHUNK_PROMPT = """Summarize this part of a longer article. Keep every figure, name, date and claim, drop the rest.
+
+{text}
+"""
+
+_PARAGRAPHS = re.compile(r"\n\s*\n")
+
+
+def word_count(text: str) -> int:
+    return len(text.split())
+
+
+def split_text(text: str, chunk_words: int) -> List[str]:
+    """Paragraphs packed into chunks of at most ``chunk_words`` words. Longer paragraphs are cut by word."""
+    pieces: List[str] = []
+    for paragraph in _PARAGRAPHS.split(text):
+        words = paragraph.split()
+        pieces += [" ".join(words[i:i + chunk_words]) for i in range(0, len(words), chunk_words)]
+    chunks: List[str] = []
+    size = 0
+    for piece in pieces:
+        words = word_count(piece)
+        if chunks and size + words <= chunk_words:
+            chunks[-1] += "\n\n" + piece
+            size += words
+        else:
+            chunks.append(piece)
+            size = words
+    return chunks
+
+
+class CondensedReferences:
+    def __init__(self, chunk_words: int = 500, reference_words: int = 600, fan_in: int = 4, capacity: int = 256):
+        if fan_in < 2:
+            # reducing one summary at a time never gets below reference_words
+            raise ValueError(f"fan_in must be at least 2, got {fan_in}")
+        self.chunk_words = chunk_words
+        self.reference_words = reference_words
+        self.fan_in = fan_in
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._references: "OrderedDict[str, str]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Future] = {}
+
+    async def reference(self, text: str, summarise: Summarise) -> str:
+        """``text`` condensed to about ``reference_words`` words. ``summarise`` is only called on a cache miss."""
+        key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        if key in self._references:
+            self.hits += 1
+            self._references.move_to_end(key)
+            return self._references[key]
+        if key in self._pending:
+            # another run is condensing this article right now
+            self.hits += 1
+            return await asyncio.shield(self._pending[key])
+        self.misses += 1
+        future = self._pending[key] = asyncio.ensure_future(self._condense(text, summarise))
+        try:
+            reference = await asyncio.shield(future)
+        finally:
+            del self._pending[key]
+        self._references[key] = reference
+        if len(self._references) > self.capacity:
+            self._references.popitem(last=False)
+        return reference
+
+    async def _condense(self, text: str, summarise: Summarise) -> str:
+        chunks = split_text(text, self.chunk_words)
+        if len(chunks) == 1:
+            return text
+        summaries = await asyncio.gather(*(summarise(CHUNK_PROMPT.format(text=chunk)) for chunk in chunks))
+        while len(summaries) > 1 and sum(map(word_count, summaries)) > self.reference_words:
+            groups = ["\n\n".join(summaries[i:i + self.fan_in]) for i in range(0, len(summaries), self.fan_in)]
+            summaries = await asyncio.gather(*(summarise(CHUNK_PROMPT.format(text=group)) for group in groups))
+        return "\n\n".join(summaries)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    # python map_reduce_summary.py [article length in words] [critique rounds]
+    length = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    paragraph = " ".join(f"word{i}" for i in range(120))
+    article = "\n\n".join([paragraph] * (length // 120))
+    sent = {"words": 0}
+
+    async def llm(prompt: str, output_words: int = 120) -> str:
+        # a model that reads about 20k words a second and answers in 1s
+        sent["words"] += word_count(prompt)
+        await asyncio.sleep(1.0 + word_count(prompt) / 20000)
+        return " ".join(prompt.split()[-output_words:])
+
+    async def rounds_over(source: str) -> float:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            summary = await llm("Summarize the following content.\n" + source)
+            await llm("Rate the summary.\n" + source + "\n" + summary, output_words=40)
+        return time.perf_counter() - start
+
+    async def main():
+        print(f"{word_count(article)} words, {rounds} critique rounds")
+        seconds = await rounds_over(article)
+        print(f"whole article every round  {seconds:6.2f}s  {sent['words']:8d} words sent")
+
+        sent["words"] = 0
+        references = CondensedReferences()
+        start = time.perf_counter()
+        reference = await references.reference(article, llm)
+        condensing = time.perf_counter() - start
+        seconds = condensing + await rounds_over(reference)
+        print(f"condensed once             {seconds:6.2f}s  {sent['words']:8d} words sent "
+              f"({condensing:.2f}s condensing to {word_count(reference)} words)")
+
+        sent["words"] = 0
+        seconds = await rounds_over(await references.reference(article, llm))
+        print(f"condensed, cached          {seconds:6.2f}s  {sent['words']:8d} words sent  "
+              f"{references.hits} hit, {references.misses} miss")
+
+    try:
+        CondensedReferences(fan_in=1)
+        raise AssertionError("fan_in=1 was accepted")
+    except ValueError:
+        pass
+    asyncio.run(main())
@@ -0,0 +1,137 @@
+"""A local stand-in for the OpenAI chat completions endpoint, for offline runs of the workflows here.
+
+``MockOpenAIServer`` answers ``POST /v1/chat/completions`` on 127.0.0.1 from a thread per
+request. Each request takes ``latency`` seconds, so blocking and non-blocking clients can be
+told apart by the wall clock. Point a client at ``server.base_url`` with any API key.
+Requests that ask for a ``response_format`` get the review JSON ``SummaryWorkflow`` parses,
+and the rest get a short summary. Pass ``responder`` to answer differently. ``stream=True``
+requests get server-sent events, a word at a time: the first after ``latency`` and each
+further one ``token_latency`` seconds later. The server also counts requests and the most it
+had in flight at once.
+
+    with MockOpenAIServer(latency=0.2) as server:
+        client = openai.OpenAI(api_key="test", base_url=server.base_url)
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 refuses bursts of new connections
+    request_queue_size = 128
+
+
+def default_responder(request: Dict[str, Any]) -> str:
+    if request.get("response_format"):
+        return json.dumps({"review": "Covers the main points in a logical order.", "score": 4})
+    prompt = request["messages"][-1]["content"]
+    return f"Summary of {len(prompt.split())} words: the content, in brief."
+
+
+class MockOpenAIServer:
+    def __init__(self, latency: float = 0.0, responder: Optional[Callable[[Dict[str, Any]], str]] = None,
+                 port: int = 0, token_latency: float = 0.0):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.responder = responder or default_responder
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._lock = threading.Lock()
+        self._server = _Server(("127.0.0.1", port), self._handler())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                with server._lock:
+                    server.requests += 1
+                    server.in_flight += 1
+                    server.peak_in_flight = max(server.peak_in_flight, server.in_flight)
+                try:
+                    time.sleep(server.latency)
+                    completion = server.completion(request)
+                    if request.get("stream"):
+                        self.send_response(200)
+                        self.send_header("Content-Type", "text/event-stream")
+                        self.send_header("Transfer-Encoding", "chunked")
+                        self.end_headers()
+                        for chunk in server.chunks(completion, request):
+                            data = f"data: {json.dumps(chunk) if chunk else '[DONE]'}\n\n".encode("utf-8")
+                            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                            self.wfile.flush()
+                        self.wfile.write(b"0\r\n\r\n")
+                        return
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+                body = json.dumps(completion).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def completion(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        content = self.responder(request)
+        # roughly 4 characters a token
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in request["messages"]) // 4
+        completion_tokens = len(content) // 4
+        return {
+            "id": f"chatcmpl-mock-{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request["model"],
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    def chunks(self, completion: Dict[str, Any], request: Dict[str, Any]):
+        """The stream of ``completion``, a word per chunk. An empty dict stands for the closing ``[DONE]``."""
+        base = {"id": completion["id"], "object": "chat.completion.chunk", "created": completion["created"],
+                "model": completion["model"]}
+        words = completion["choices"][0]["message"]["content"].split(" ")
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(self.token_latency)
+            delta = {"role": "assistant", "content": word} if i == 0 else {"content": " " + word}
+            yield {**base, "choices": [{"index": 0, "delta": delta,
+                                        "finish_reason": "stop" if i == len(words) - 1 else None}]}
+        if (request.get("stream_options") or {}).get("include_usage"):
+            yield {**base, "choices": [], "usage": completion["usage"]}
+        yield {}
+
+    def start(self) -> "MockOpenAIServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "MockOpenAIServer":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
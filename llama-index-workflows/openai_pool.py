@@ -0,0 +1,248 @@
+"""A non-blocking OpenAI client for workflow steps: one connection pool, per-call timeouts, bounded concurrency.
+
+The steps in 01_creating_a_critique_chain.py are ``async def``, but they call the synchronous
+``openai.OpenAI`` client. Each request holds the event loop until the response arrives, so
+however many workflows are running, the process makes one LLM call at a time.
+
+``PooledOpenAI`` is a single ``openai.AsyncOpenAI`` on one ``httpx`` connection pool, shared
+by every step and every run in the process, so connections are reused instead of opened per
+call. ``create`` and ``parse`` take the same arguments as ``chat.completions.create`` and
+``beta.chat.completions.parse``, and add:
+
+* ``timeout``: seconds for this call, defaulting to the client's,
+* at most ``max_concurrency`` calls in flight. Further calls wait their turn, so a burst of
+  workflows does not run into the provider's rate limits all at once.
+
+The pool and the limit are per event loop, made on first use in it, so a client created at
+import time works in every ``asyncio.run`` of the process.
+
+``create(on_delta=...)`` streams the completion, calling ``on_delta`` with each piece of text
+as it arrives, and still returns the whole ``ChatCompletion``, usage included. A step can
+pass its text on while it is being generated and carry on with the full response.
+
+``stats`` reports calls, failures, retries, the peak in flight and the time calls spent
+waiting for a slot. Every call is also an instrumentation span, with an ``OpenAICallEvent``
+carrying its model, tokens and retries, for tracers such as examples/workflow_trace.py.
+Run this file to compare it with the blocking client on a local mock server
+(mock_openai_server.py).
+"""
+import asyncio
+import time
+import weakref
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, AsyncIterable, Callable, List, Optional, Tuple
+
+import httpx
+import openai
+from openai.types.chat import ChatCompletion, ChatCompletionChunk, ChatCompletionMessage
+from openai.types.chat.chat_completion import Choice
+from llama_index.core.instrumentation import get_dispatcher
+from llama_index.core.instrumentation.events import BaseEvent
+
+dispatcher = get_dispatcher(__name__)
+
+# HTTP requests made by the call running in this task: the SDK retries internally
+_requests: ContextVar[Optional[List[int]]] = ContextVar("openai_pool_requests", default=None)
+
+
+async def _count_request(request: httpx.Request) -> None:
+    counter = _requests.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+class OpenAICallEvent(BaseEvent):
+    model: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    retries: int = 0
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "OpenAICallEvent"
+
+
+async def collect_stream(chunks: AsyncIterable[ChatCompletionChunk],
+                         on_delta: Callable[[str], Any]) -> ChatCompletion:
+    """The ``ChatCompletion`` a stream adds up to, calling ``on_delta`` with each piece of text on the way."""
+    first, finish_reason, usage, parts = None, None, None, []
+    async for chunk in chunks:
+        first = first or chunk
+        usage = chunk.usage or usage
+        # the steps ask for one choice
+        for choice in chunk.choices[:1]:
+            if choice.delta.content:
+                parts.append(choice.delta.content)
+                on_delta(choice.delta.content)
+            finish_reason = choice.finish_reason or finish_reason
+    if first is None:
+        raise ValueError("the stream ended before any chunk arrived")
+    message = ChatCompletionMessage(role="assistant", content="".join(parts))
+    return ChatCompletion(id=first.id, created=first.created, model=first.model, object="chat.completion",
+                          choices=[Choice(index=0, finish_reason=finish_reason or "stop", message=message)],
+                          usage=usage)
+
+
+@dataclass
+class PoolStats:
+    calls: int = 0
+    failures: int = 0
+    retries: int = 0
+    in_flight: int = 0
+    peak_in_flight: int = 0
+    waited: float = 0.0
+
+    def __str__(self) -> str:
+        return (f"{self.calls} calls, {self.failures} failed, {self.retries} retries, "
+                f"at most {self.peak_in_flight} in flight, "
+                f"{self.waited:.2f}s waiting for a slot")
+
+
+class PooledOpenAI:
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None, max_concurrency: int = 16,
+                 max_connections: Optional[int] = None, timeout: float = 30.0, connect_timeout: float = 5.0,
+                 max_retries: int = 2):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_connections = max_connections or max_concurrency
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.stats = PoolStats()
+        # the connection pool and the semaphore belong to the event loop they are first used on, so each
+        # loop gets its own: a client made at import time still works in every asyncio.run() after
+        self._pools: "weakref.WeakKeyDictionary[Any, Tuple[openai.AsyncOpenAI, asyncio.Semaphore]]" = \
+            weakref.WeakKeyDictionary()
+
+    def _pool(self) -> Tuple[openai.AsyncOpenAI, asyncio.Semaphore]:
+        loop = asyncio.get_running_loop()
+        pool = self._pools.get(loop)
+        if pool is None:
+            http_client = openai.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                event_hooks={"request": [_count_request]},
+            )
+            client = openai.AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, http_client=http_client,
+                                        timeout=self.timeout, max_retries=self.max_retries)
+            pool = self._pools[loop] = (client, asyncio.Semaphore(self.max_concurrency))
+        return pool
+
+    @property
+    def client(self) -> openai.AsyncOpenAI:
+        """The ``AsyncOpenAI`` of the running event loop."""
+        return self._pool()[0]
+
+    @dispatcher.span
+    async def _call(self, method: Any, timeout: Optional[float], kwargs: Any,
+                    on_delta: Optional[Callable[[str], Any]] = None) -> Any:
+        queued = time.perf_counter()
+        async with self._pool()[1]:
+            stats = self.stats
+            stats.waited += time.perf_counter() - queued
+            stats.calls += 1
+            stats.in_flight += 1
+            stats.peak_in_flight = max(stats.peak_in_flight, stats.in_flight)
+            requests = [0]
+            token = _requests.set(requests)
+            try:
+                response = await method(timeout=timeout if timeout is not None else self.timeout, **kwargs)
+                if on_delta is not None:
+                    # the slot is held until the last chunk, like a call that is still running
+                    response = await collect_stream(response, on_delta)
+            except Exception:
+                stats.failures += 1
+                raise
+            finally:
+                stats.in_flight -= 1
+                stats.retries += max(requests[0] - 1, 0)
+                _requests.reset(token)
+        usage = response.usage
+        dispatcher.event(OpenAICallEvent(model=kwargs.get("model", ""), retries=max(requests[0] - 1, 0),
+                                         prompt_tokens=usage.prompt_tokens if usage else 0,
+                                         completion_tokens=usage.completion_tokens if usage else 0))
+        return response
+
+    async def create(self, timeout: Optional[float] = None, on_delta: Optional[Callable[[str], Any]] = None,
+                     **kwargs: Any) -> Any:
+        """``chat.completions.create``, within the concurrency limit and ``timeout`` seconds.
+
+        With ``on_delta`` the completion is streamed and ``on_delta`` gets each piece of text.
+        """
+        if on_delta is not None:
+            kwargs.update(stream=True, stream_options={"include_usage": True})
+        return await self._call(self.client.chat.completions.create, timeout, kwargs, on_delta)
+
+    async def parse(self, timeout: Optional[float] = None, **kwargs: Any) -> Any:
+        """``beta.chat.completions.parse``, within the concurrency limit and ``timeout`` seconds."""
+        return await self._call(self.client.beta.chat.completions.parse, timeout, kwargs)
+
+    async def aclose(self) -> None:
+        """Closes the connection pool of the running event loop."""
+        pool = self._pools.pop(asyncio.get_running_loop(), None)
+        if pool is not None:
+            await pool[0].close()
+
+
+if __name__ == "__main__":
+    import sys
+
+    from mock_openai_server import MockOpenAIServer
+
+    # python openai_pool.py [concurrent calls]
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    messages = [{"role": "user", "content": "Summarize the following content. content: ..."}]
+
+    async def blocking(server):
+        # what the steps do today: a synchronous call inside async def
+        client = openai.OpenAI(api_key="test", base_url=server.base_url)
+
+        async def one():
+            return client.chat.completions.create(model="gpt-4o-mini", messages=messages, max_tokens=150)
+
+        await asyncio.gather(*(one() for _ in range(calls)))
+
+    async def pooled(client):
+        await asyncio.gather(*(client.create(model="gpt-4o-mini", messages=messages, max_tokens=150)
+                               for _ in range(calls)))
+        await client.aclose()
+        return client.stats
+
+    async def timeout(client):
+        start = time.perf_counter()
+        try:
+            await client.create(model="gpt-4o-mini", messages=messages, timeout=0.2)
+        except openai.APITimeoutError:
+            return time.perf_counter() - start
+        finally:
+            await client.aclose()
+        raise AssertionError("the call did not time out")
+
+    with MockOpenAIServer(latency=0.25) as server:
+        start = time.perf_counter()
+        asyncio.run(blocking(server))
+        blocked = time.perf_counter() - start
+        print(f"blocking client        {blocked:6.2f}s  {calls} calls, "
+              f"server saw at most {server.peak_in_flight} at once")
+        assert server.peak_in_flight == 1
+        for limit in (8, 32):
+            # made outside any event loop, like the module level client of 01_creating_a_critique_chain.py,
+            # and used by two asyncio.run() in a row
+            client = PooledOpenAI(api_key="test", base_url=server.base_url, max_concurrency=limit)
+            for _ in range(2):
+                server.peak_in_flight = 0
+                start = time.perf_counter()
+                stats = asyncio.run(pooled(client))
+                seconds = time.perf_counter() - start
+                assert server.peak_in_flight == stats.peak_in_flight == min(limit, calls), server.peak_in_flight
+                assert seconds < blocked / 4, seconds
+            print(f"pooled, {limit:2d} at a time    {seconds:6.2f}s  {stats}")
+            assert stats.calls == 2 * calls and not stats.failures
+        server.latency = 1.0
+        client = PooledOpenAI(api_key="test", base_url=server.base_url, max_retries=0)
+        gave_up = asyncio.run(timeout(client))
+        print(f"0.2s timeout on a {server.latency}s call: gave up after {gave_up:.2f}s")
+        assert gave_up < 0.5 and client.stats.failures == 1 and client.stats.in_flight == 0
@@ -0,0 +1,229 @@
+"""Run one workflow over a whole dataset: bounded concurrency, results as they finish, resumable.
+
+The workflow examples run a single input, e.g. ``critique_workflow.run(content=content)``.
+Summarising a dataset one ``run`` after another spends almost all of its time waiting on the
+LLM. ``BatchRunner`` keeps up to ``concurrency`` runs in flight:
+
+* ``inputs`` is any iterable or async iterable of keyword-argument dicts for ``run``. It is
+  read lazily, so a generator over a large file never has more than ``concurrency`` items
+  in memory,
+* ``run`` yields an ``ItemResult`` per input as soon as it finishes, in completion order,
+* a failed run is reported with its error and does not stop the batch,
+* with a ``checkpoint`` path, every finished item is appended there as a JSON line.
+  Rerunning with the same path skips the items that already succeeded, so an interrupted
+  batch carries on where it stopped. Items are identified by ``key``, by default their
+  position in ``inputs``, which suits inputs that come in the same order every time,
+* ``stats`` gives throughput and the latency of each item.
+
+A single workflow instance serves all the runs, so its steps must not keep per-run state on
+``self``.
+"""
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Dict, Iterable, List, Optional, Set, Union
+
+Inputs = Union[Iterable[Dict[str, Any]], AsyncIterable[Dict[str, Any]]]
+
+
+@dataclass
+class ItemResult:
+    key: str
+    input: Dict[str, Any]
+    result: Any = None
+    error: Optional[str] = None
+    seconds: float = 0.0
+
+
+@dataclass
+class BatchStats:
+    submitted: int = 0
+    completed: int = 0
+    failed: int = 0
+    # already done according to the checkpoint
+    skipped: int = 0
+    elapsed: float = 0.0
+    latencies: List[float] = field(default_factory=list)
+
+    @property
+    def throughput(self) -> float:
+        return self.completed / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self) -> str:
+        latencies = sorted(self.latencies) or [0.0]
+        p50 = latencies[len(latencies) // 2]
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        return (f"{self.completed}/{self.submitted} done, {self.failed} failed, {self.skipped} skipped, "
+                f"{self.elapsed:.1f}s, {self.throughput:.2f} items/s, p50 {p50:.2f}s, p95 {p95:.2f}s, "
+                f"max {latencies[-1]:.2f}s")
+
+
+class BatchCheckpoint:
+    """One JSON line per finished item. The keys of items that succeeded are in ``done``."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done: Set[str] = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # the last line of a batch that was killed mid-write
+                    if record.get("error") is None:
+                        self.done.add(record["key"])
+        self._file = open(path, "a")
+
+    def record(self, item: ItemResult, serialize: Callable[[Any], Any]) -> None:
+        result = serialize(item.result) if item.error is None else None
+        self._file.write(json.dumps({"key": item.key, "result": result, "error": item.error,
+                                     "seconds": round(item.seconds, 3)}) + "\n")
+        # flushed per item: the checkpoint is only as good as what reached the file
+        self._file.flush()
+        if item.error is None:
+            self.done.add(item.key)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+async def _aiter(inputs: Inputs) -> AsyncIterator[Dict[str, Any]]:
+    if hasattr(inputs, "__aiter__"):
+        async for item in inputs:
+            yield item
+    else:
+        for item in inputs:
+            yield item
+
+
+class BatchRunner:
+    def __init__(self, workflow: Any, concurrency: int = 16, checkpoint: Optional[str] = None,
+                 key: Optional[Callable[[int, Dict[str, Any]], str]] = None, serialize: Callable[[Any], Any] = str):
+        """``key(position, input)`` identifies an input across runs. ``serialize`` turns results into JSON values."""
+        self.workflow = workflow
+        self.concurrency = concurrency
+        self.checkpoint_path = checkpoint
+        self.key = key or (lambda position, item: str(position))
+        self.serialize = serialize
+        self.stats = BatchStats()
+
+    async def _run_one(self, key: str, item: Dict[str, Any]) -> ItemResult:
+        start = time.perf_counter()
+        handler = self.workflow.run(**item)
+        try:
+            result = await handler
+        except asyncio.CancelledError:
+            # stop the run's own step tasks too, not just our wait for it
+            await handler.cancel_run()
+            raise
+        except Exception as e:
+            return ItemResult(key, item, error=repr(e), seconds=time.perf_counter() - start)
+        return ItemResult(key, item, result=result, seconds=time.perf_counter() - start)
+
+    async def run(self, inputs: Inputs) -> AsyncIterator[ItemResult]:
+        """Yields the result of every input that is not already done, in the order they finish."""
+        stats = self.stats = BatchStats()
+        checkpoint = BatchCheckpoint(self.checkpoint_path) if self.checkpoint_path else None
+        source = _aiter(inputs)
+        pending: Set[asyncio.Future] = set()
+        exhausted = False
+        position = 0
+        start = time.perf_counter()
+        try:
+            while True:
+                # top up from the inputs, only as far as there are free slots
+                while not exhausted and len(pending) < self.concurrency:
+                    try:
+                        item = await source.__anext__()
+                    except StopAsyncIteration:
+                        exhausted = True
+                        break
+                    key = self.key(position, item)
+                    position += 1
+                    if checkpoint is not None and key in checkpoint.done:
+                        stats.skipped += 1
+                        continue
+                    stats.submitted += 1
+                    pending.add(asyncio.ensure_future(self._run_one(key, item)))
+                if not pending:
+                    break
+                finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    item_result = task.result()
+                    if item_result.error is None:
+                        stats.completed += 1
+                    else:
+                        stats.failed += 1
+                    stats.latencies.append(item_result.seconds)
+                    stats.elapsed = time.perf_counter() - start
+                    if checkpoint is not None:
+                        checkpoint.record(item_result, self.serialize)
+                    yield item_result
+        finally:
+            # the caller stopped early or was cancelled: unfinished runs are redone on resume
+            for task in pending:
+                task.cancel()
+            # let the cancelled runs unwind before the loop moves on
+            await asyncio.gather(*pending, return_exceptions=True)
+            if checkpoint is not None:
+                checkpoint.close()
+            stats.elapsed = time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    import random
+    import sys
+    import tempfile
+
+    from llama_index.core.workflow import StartEvent, StopEvent, Workflow, step
+
+    # python workflow_batch.py [number of articles]
+    articles = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    class Summarise(Workflow):
+        # stands in for SummaryWorkflow: 2-4 LLM calls of 0.1-0.3s, and the odd transient failure
+        @step
+        async def summarise(self, ev: StartEvent) -> StopEvent:
+            rng = random.Random(ev.content)
+            for _ in range(rng.randint(2, 4)):
+                await asyncio.sleep(rng.uniform(0.1, 0.3))
+            if random.random() < 0.01:
+                raise ValueError("the reviewer returned invalid JSON")
+            return StopEvent(result=f"summary of {ev.content}")
+
+    def dataset(count):
+        for i in range(count):
+            yield {"content": f"article {i}"}
+
+    async def main():
+        workflow = Summarise(timeout=30)
+        start = time.perf_counter()
+        for item in dataset(20):
+            try:
+                await workflow.run(**item)
+            except ValueError:
+                pass
+        per_item = (time.perf_counter() - start) / 20
+        print(f"one run at a time       {1 / per_item:7.2f} items/s  ({per_item * articles:.0f}s for {articles})")
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "batch.jsonl")
+            runner = BatchRunner(workflow, concurrency=200, checkpoint=path)
+            # interrupted a third of the way through
+            async for item in runner.run(dataset(articles)):
+                if runner.stats.completed + runner.stats.failed >= articles // 3:
+                    break
+            print(f"interrupted             {runner.stats}")
+            runner = BatchRunner(workflow, concurrency=200, checkpoint=path)
+            async for _ in runner.run(dataset(articles)):
+                pass
+            print(f"resumed                 {runner.stats}")
+            runner = BatchRunner(workflow, concurrency=200, checkpoint=path)
+            async for _ in runner.run(dataset(articles)):
+                pass
+            print(f"retrying the failures   {runner.stats}")
+
+    asyncio.run(main())